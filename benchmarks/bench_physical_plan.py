@@ -0,0 +1,160 @@
+"""
+physical plan字段解析的对比：重构前的startswith分支链 vs 注册表分派，先检查两者结果一致，再对比耗时；
+两种实现逐轮交替运行，报告每轮耗时比的中位数和范围，避免先后顺序和机器负载造成的偏差；
+注册表分派只切掉一次字段头、每行只做一次前缀匹配，默认5000个节点交替10轮的中位数比原实现快1.2x-1.3x，
+单轮在1.0x-1.75x之间波动；两者共用的canonicalize也做了简化，注册表分派的吞吐约从7万行/s提高到9.5万行/s
+
+运行方式：python benchmarks/bench_physical_plan.py [节点数] [轮数]
+"""
+import contextlib
+import io
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.analysis_utils import parse_physical_plan, parse_bracket_list, canonicalize, print_err_info
+from utils.structure import Attribute
+
+
+def legacy_parse_physical_plan(node_structure):
+    """
+    重构前的实现，逐行走startswith分支链，用于对比
+    """
+    parameter = {}
+    parameter_tag = {}
+    for line in node_structure:
+        # line = str(len)
+        head = re.match(r"([A-Za-z]+( [A-Za-z]+)*) *(\[\d+])*:", line)
+        if head is None:
+            print_err_info(f"line:<{line}> Unable to extract field headers. ")
+            continue
+        head = head.group()
+        if line.startswith('Output'):
+            parameter[Attribute.OUTPUT.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.OUTPUT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Input'):
+            parameter[Attribute.INPUT.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.INPUT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Batched'):
+            parameter[Attribute.BATCHED.value] = canonicalize(line.replace(head, ''))
+            parameter_tag[Attribute.BATCHED.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Arguments'):
+            # TODO[node structure]情况复杂，需要完善（当前策略就是不解析，后面和metrics做匹配也方便）
+            parameter[Attribute.ARGUMENTS.value] = canonicalize(line.replace(head, ''))
+            parameter_tag[Attribute.ARGUMENTS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Result'):
+            parameter[Attribute.RESULT.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.RESULT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Aggregate Attributes'):
+            parameter[Attribute.AGGREGATE.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.AGGREGATE.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Functions'):
+            parameter[Attribute.FUNCTION.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.FUNCTION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Keys'):
+            parameter[Attribute.KEYS.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Join condition'):
+            parameter[Attribute.JOIN_CONDITION.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.JOIN_CONDITION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Left keys'):
+            parameter[Attribute.LEFT_KEYS.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.LEFT_KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Right keys'):
+            parameter[Attribute.RIGHT_KEYS.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.RIGHT_KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Condition'):
+            # TODO[node structure]
+            parameter[Attribute.CONDITION.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.CONDITION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('ReadSchema'):
+            parameter[Attribute.READ_SCHEMA.value] = canonicalize(line.replace(head, ''))
+            parameter_tag[Attribute.READ_SCHEMA.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('PushedFilters'):
+            parameter[Attribute.PUSHED_FILTERS.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.PUSHED_FILTERS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        elif line.startswith('Location'):
+            # parameter[Attribute.LOCATION.value] = line.replace(head, '').split(' ')[2].strip('[').strip(']')
+            # tmp = line.replace(head, '').split(' ')
+            parameter[Attribute.LOCATION.value] = line.replace(head, '').replace(' ', '')
+            parameter_tag[Attribute.LOCATION.value] = line.replace(head, '').replace(' ', '').replace(' ', '')
+        elif line.startswith('PartitionFilters'):
+            parameter[Attribute.PARTITION_FILTERS.value] = parse_bracket_list(line.replace(head, ''))
+            parameter_tag[Attribute.PARTITION_FILTERS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
+        else:
+            print_err_info(f"line:<{line}> Unconsidered field header.")
+            continue
+    return parameter, parameter_tag
+
+
+def build_plan_lines(node_num, width=40):
+    """
+    构造大规模执行计划的节点详细信息
+    :param node_num: 节点数
+    :param width: 每个列表字段的元素数
+    :return: 每个节点的字段行列表
+    """
+    nodes = []
+    for i in range(node_num):
+        columns = ', '.join(f'col_{i}_{j}#{i * width + j}L' for j in range(width))
+        nodes.append([
+            f'Output [{width}]: [{columns}]',
+            f'Input [{width}]: [{columns}]',
+            'Batched: true',
+            f'Location: InMemoryFileIndex [hdfs://server1:9000/warehouse/t{i}]',
+            f'PushedFilters: [IsNotNull(col_{i}_0), GreaterThan(col_{i}_1,10)]',
+            f'ReadSchema: struct<{", ".join(f"col_{i}_{j}:int" for j in range(width))}>',
+            f'Keys [{width}]: [{columns}]',
+            f'Functions [1]: [partial_sum(col_{i}_0#{i * width}L)]',
+            f'Aggregate Attributes [1]: [sum#{i}L]',
+            f'Results [{width}]: [{columns}]',
+            f'Condition : (isnotnull(col_{i}_0#{i * width}L) AND (col_{i}_1#{i * width + 1}L > 10))',
+            f'Arguments: hashpartitioning(col_{i}_0#{i * width}L, 200), ENSURE_REQUIREMENTS, [id=#{i}]',
+            'Join condition: None',
+            f'Left keys [1]: [col_{i}_0#{i * width}L]',
+            f'Right keys [1]: [col_{i}_1#{i * width + 1}L]',
+            f'PartitionFilters: [isnotnull(dt#{i})]',
+        ])
+    return nodes
+
+
+def bench(func, nodes):
+    start = time.perf_counter()
+    for lines in nodes:
+        func(lines)
+    return time.perf_counter() - start
+
+
+def bench_interleaved(funcs, nodes, rounds):
+    """
+    :return: 每个函数每轮的耗时列表；每轮交换先后顺序
+    """
+    costs = [[] for _ in funcs]
+    for round_index in range(rounds):
+        order = list(range(len(funcs)))
+        if round_index % 2:
+            order.reverse()
+        for i in order:
+            costs[i].append(bench(funcs[i], nodes))
+    return costs
+
+
+if __name__ == '__main__':
+    node_num = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    nodes = build_plan_lines(node_num)
+    line_num = sum(len(lines) for lines in nodes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert all(legacy_parse_physical_plan(lines) == parse_physical_plan(lines) for lines in nodes)
+    legacy_costs, costs = bench_interleaved([legacy_parse_physical_plan, parse_physical_plan], nodes, rounds)
+    legacy_cost = statistics.median(legacy_costs)
+    cost = statistics.median(costs)
+    ratios = sorted(legacy / new for legacy, new in zip(legacy_costs, costs))
+    print(f'nodes: {node_num}, lines: {line_num}, rounds: {rounds}')
+    print(f'legacy:   {legacy_cost:.3f}s  {line_num / legacy_cost:,.0f} lines/s (median)')
+    print(f'registry: {cost:.3f}s  {line_num / cost:,.0f} lines/s (median)')
+    print(f'ratio:    {statistics.median(ratios):.2f}x median, {ratios[0]:.2f}x - {ratios[-1]:.2f}x')
@@ -1,41 +1,159 @@
 # This is a sample Python script.
+import logging
+import os
+
 from utils.analysis_utils import *
+from utils.cache_utils import PlanCache
+from utils.catalog_utils import ViewCatalog
+from utils.cluster_utils import ViewClusterer
+from utils.dataset_utils import TokenDataset
+from utils.export_utils import create_view_writer
+from utils.fetch_utils import WebHdfsFetcher, HdfsCliFetcher, LocalCorpusFetcher
+from utils.listing_utils import LogListing
+from utils.manifest_utils import LogManifest, STATUS_DONE, STATUS_FAILED
+from utils.memo_utils import SubtreeMemo
+from utils.metrics_utils import RunMetrics, logger, profiling, timed
+from utils.pipeline_utils import LogPipeline
+from utils.subsume_utils import SubsumptionIndex
 
 HDFS_ROOT = 'hdfs://server1:9000/'
 HISTORY_JSON_PATH = f"{HDFS_ROOT}/spark2-history-json/"
+SPARK_HISTORY_PATH = '/spark2-history'
+EVENT_LOG_PATH = f"{HDFS_ROOT}/spark2-history/"
+# 直接流式读取原始event log（含压缩日志），不再需要jar转换出history json；为False时读取HISTORY_JSON_PATH
+READ_EVENT_LOGS = True
+# namenode的WebHDFS地址，为None时通过hdfs dfs命令读取（每个文件启动一次JVM，适合没有开启WebHDFS的集群）
+WEBHDFS_ADDRESS = 'server1:9870'
+FETCH_CONCURRENCY = 8
+# 本地语料目录或未压缩的tar/zip归档，设置后从本地以内存映射方式读取，不访问hdfs；
+# 语料中以.json结尾的按history json处理，其余按原始event log处理
+LOCAL_CORPUS_PATH = None
+FETCH_RETRIES = 3
+# 解析进程数，为1时在当前进程中解析
+PARALLEL_WORKERS = os.cpu_count() or 1
+# 流水线各段之间的队列长度，读取后等待解析的日志内容都在内存中
+PIPELINE_QUEUE_SIZE = 16
+# 增量运行的状态文件
+MANIFEST_PATH = 'output/manifest.jsonl'
+# 日志目录列表的缓存，再次运行时只重新列出最早的未完成日志之后的部分，超过间隔（秒）后完整列出
+LISTING_CACHE_PATH = 'output/listing.json'
+LISTING_FULL_REFRESH_INTERVAL = 24 * 3600
+# 只处理修改时间在这个时间段内的日志，本地时间，格式为%Y-%m-%d %H:%M
+LOG_START_TIME = '1940-01-01 00:00'
+LOG_END_TIME = '2500-01-01 00:00'
+# 每处理多少个日志保存一次结果
+CHECKPOINT_INTERVAL = 100
+# 解析后节点图的缓存，修改sql还原逻辑后重跑时可跳过文本解析，为None时不使用缓存
+PLAN_CACHE_PATH = 'output/plan_cache'
+PLAN_CACHE_MAX_BYTES = 10 * 1024 ** 3
+# 跨日志复用相同子树的sql片段和累计结果，为0时不使用
+SUBTREE_MEMO_ENTRIES = 100000
+# 去重后候选视图的列式导出，供训练任务直接读取；安装了pyarrow时为parquet文件，否则为列文件目录
+EXPORT_PATH = 'output/views'
+EXPORT_BATCH_SIZE = 10000
+# 导出前按累计子句集合的Jaccard相似度做近似重复聚类
+CLUSTER_THRESHOLD = 0.8
+# 训练用的token id数据集，每个候选视图一个样本，随新日志追加
+DATASET_PATH = 'output/dataset'
+# 按签名索引的候选视图目录，记录出现次数和来源日志，可用sql直接查询；去重结果只保存在这里，导出也从这里读取
+CATALOG_PATH = 'output/views.db'
+# 告警按类别限流输出，完整计数见运行指标
+LOG_LEVEL = logging.INFO
+# 本次运行的阶段计时、匹配率和不支持的算子统计；每条日志的指标追加到LOG_METRICS_PATH，为None时不写
+METRICS_PATH = 'output/metrics.json'
+LOG_METRICS_PATH = 'output/log_metrics.jsonl'
+# 采样profiler的折叠栈输出，多进程解析时每个子进程另写一份，为None时不采样
+PROFILE_PATH = None
+PROFILE_INTERVAL = 0.005
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    logs_name = get_spark_logs_name()
-    all_candidate_views = []
-    for log_name in logs_name:
-        history_json_path = f"{HISTORY_JSON_PATH}/{log_name}.json"
-        _, metrics_text, physical_plan, _, _ = get_history_json(history_json_path)
-        if metrics_text == '':
-            print_err_info(f'[empty history] {history_json_path} is empty.')
-        nodes = get_node_structure(physical_plan)
-        MetricNode.node_cache = get_node_metrics(metrics_text)
-        complete_information(nodes)
-        contribute_sql(MetricNode.node_cache.get('0'))
-        candidate_views = get_candidate_views(MetricNode.node_cache.get('0'))
-        sqls = fill_sql(candidate_views)
-        accumulate_all(MetricNode.node_cache.get('0'))
-        all_candidate_views += candidate_views
-        print()
-    views_set = set(all_candidate_views)
-    count = {}
-    for view1 in all_candidate_views:
-        if view1 not in views_set:
-            continue
-        for view2 in all_candidate_views:
-            if view1 == view2:
-                continue
-            res = compare_view(view1, view2)
-            if res is True:
-                views_set.remove(view2)
-                if count.get(view1) is None:
-                    count[view1] = 1
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(message)s')
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    run_metrics = RunMetrics(LOG_METRICS_PATH)
+    manifest = LogManifest(MANIFEST_PATH)
+    dataset = TokenDataset(DATASET_PATH)
+    catalog = ViewCatalog(CATALOG_PATH)
+    if LOCAL_CORPUS_PATH is None:
+        if WEBHDFS_ADDRESS is None:
+            fetcher = HdfsCliFetcher(retries=FETCH_RETRIES)
+        else:
+            fetcher = WebHdfsFetcher(WEBHDFS_ADDRESS, retries=FETCH_RETRIES)
+        listing = LogListing(fetcher, SPARK_HISTORY_PATH, LISTING_CACHE_PATH, LISTING_FULL_REFRESH_INTERVAL)
+    else:
+        fetcher = LocalCorpusFetcher(LOCAL_CORPUS_PATH)
+        listing = LogListing(fetcher, LOCAL_CORPUS_PATH)
+    plan_cache = None
+    if PLAN_CACHE_PATH is not None:
+        plan_cache = PlanCache(PLAN_CACHE_PATH, max_bytes=PLAN_CACHE_MAX_BYTES)
+    memo = None
+    if SUBTREE_MEMO_ENTRIES > 0:
+        memo = SubtreeMemo(SUBTREE_MEMO_ENTRIES)
+    processed = 0
+
+    def pending_logs():
+        # 只处理新增或有变化的日志，在流水线的列出线程中执行
+        for log_name, size, mtime in listing.iter_logs(LOG_START_TIME, LOG_END_TIME):
+            if not manifest.is_processed(log_name, size, mtime):
+                if LOCAL_CORPUS_PATH is not None:
+                    yield log_name, (log_name, size, mtime)
+                elif READ_EVENT_LOGS:
+                    yield f"{EVENT_LOG_PATH}/{log_name}", (log_name, size, mtime)
                 else:
-                    count[view1] = count[view1] + 1
-                print("[remove view]")
-    print()
+                    yield f"{HISTORY_JSON_PATH}/{log_name}.json", (log_name, size, mtime)
+
+    def sink(history_json_path, log_info, queries):
+        global processed
+        log_name, size, mtime = log_info
+        if queries is None:
+            manifest.record(log_name, size, mtime, STATUS_FAILED)
+        else:
+            sqls = []
+            for _, candidate_views in queries:
+                with timed('dedup'):
+                    catalog.add_all(candidate_views)
+                dataset.add_all(candidate_views)
+                sqls += [view.sql for view in candidate_views]
+            manifest.record(log_name, size, mtime, STATUS_DONE, sqls)
+        processed += 1
+        if processed % CHECKPOINT_INTERVAL == 0:
+            dataset.commit()
+            catalog.flush()
+            manifest.commit()
+            logger.info('%d logs processed', processed)
+
+    pipeline = LogPipeline(fetcher, fetch_concurrency=FETCH_CONCURRENCY, parse_workers=PARALLEL_WORKERS,
+                           queue_size=PIPELINE_QUEUE_SIZE, plan_cache=plan_cache, memo=memo, metrics=run_metrics,
+                           profile_path=PROFILE_PATH if PARALLEL_WORKERS > 1 else None,
+                           profile_interval=PROFILE_INTERVAL)
+    with profiling(PROFILE_PATH, PROFILE_INTERVAL):
+        pipeline.run(pending_logs(), sink)
+    fetcher.close()
+    dataset.close()
+    catalog.flush()
+    manifest.commit()
+    # 多进程时子树缓存在各子进程中，这里只有顺序处理时才有统计
+    if memo is not None and memo.lookups > 0:
+        run_metrics.extra['subtree_memo'] = {
+            'hit_rate': memo.hit_rate(), 'subtrees': len(memo),
+            'most_common': [{'fingerprint': fingerprint, 'name': name, 'count': count}
+                            for fingerprint, name, count, _ in memo.most_common()]}
+    items = catalog.items()
+    catalog.close()
+    clusterer = ViewClusterer(CLUSTER_THRESHOLD)
+    clusterer.add_all(items)
+    representatives = set(clusterer.representatives().values())
+    # 每个视图能回答的查询数（按出现次数加权）
+    subsumption = SubsumptionIndex()
+    subsumption.add_all(view for view, _ in items)
+    coverage = subsumption.coverage(items)
+    with create_view_writer(EXPORT_PATH, EXPORT_BATCH_SIZE) as writer:
+        for index, ((view, frequency), cluster) in enumerate(zip(items, clusterer.cluster_ids())):
+            writer.append(view, frequency, cluster, index in representatives, coverage[index])
+    if METRICS_PATH is not None:
+        run_metrics.write(METRICS_PATH)
+    else:
+        run_metrics.close()
+    summary = run_metrics.summary()
+    logger.info('%d logs (%d failed) in %.1fs, metric match rate %s', summary['logs'], summary['failed'],
+                summary['wall'], 'n/a' if summary['match_rate'] is None else f"{summary['match_rate']:.2%}")
@@ -0,0 +1,163 @@
+import io
+import json
+import unittest
+
+from utils.parallel_utils import analyze_stream
+from utils.structure import SQLContribute
+
+LOCAL_TABLE_SCAN_METRICS = (
+    '[PlanMetric]\n'
+    'id: 0 name: HashAggregate desc: HashAggregate(keys=[a#1], functions=[count(1)], output=[a#1, n#2L])\n'
+    'number of output rows: 1\n\n\n\n'
+    'id: 1 name: LocalTableScan desc: LocalTableScan [a#1]\n'
+    'number of output rows: 1\n\n\n\n'
+    '  1->0;\n'
+    '[SubGraph]\n'
+    'cluster0\n')
+LOCAL_TABLE_SCAN_PLAN = (
+    '== Physical Plan ==\n'
+    '* HashAggregate (2)\n'
+    '+- LocalTableScan (1)\n\n\n'
+    '(1) LocalTableScan\n'
+    'Output [1]: [a#1]\n'
+    'Arguments: [a#1]\n\n'
+    '(2) HashAggregate\n'
+    'Input [1]: [a#1]\n'
+    'Keys [1]: [a#1]\n'
+    'Functions [1]: [count(1)]\n'
+    'Aggregate Attributes [1]: [count(1)#3L]\n'
+    'Results [2]: [a#1, count(1)#3L AS n#2L]\n')
+
+JOIN_PLAN = '''== Physical Plan ==
+* HashAggregate (12)
++- Exchange (11)
+   +- * HashAggregate (10)
+      +- * Project (9)
+         +- * SortMergeJoin Inner (8)
+            :- * Sort (4)
+            :  +- Exchange (3)
+            :     +- * Filter (2)
+            :        +- Scan parquet default.t1 (1)
+            +- * Sort (7)
+               +- Exchange (6)
+                  +- * Filter (5)
+                     +- Scan parquet default.t2 (0)
+
+
+(1) Scan parquet default.t1
+Output [2]: [a#1, b#2]
+Batched: true
+Location: InMemoryFileIndex [hdfs://x/t1]
+PushedFilters: [IsNotNull(a)]
+ReadSchema: struct<a:int,b:int>
+
+(2) Filter
+Input [2]: [a#1, b#2]
+Condition : (isnotnull(a#1) AND (b#2 > 10))
+
+(3) Exchange
+Input [2]: [a#1, b#2]
+Arguments: hashpartitioning(a#1, 200), ENSURE_REQUIREMENTS, [id=#20]
+
+(4) Sort
+Input [2]: [a#1, b#2]
+Arguments: [a#1 ASC NULLS FIRST], false, 0
+
+(5) Scan parquet default.t2
+Output [2]: [d#4, c#5]
+Batched: true
+Location: InMemoryFileIndex [hdfs://x/t2]
+PushedFilters: [IsNotNull(d)]
+ReadSchema: struct<d:int,c:int>
+
+(6) Filter
+Input [2]: [d#4, c#5]
+Condition : isnotnull(d#4)
+
+(7) Exchange
+Input [2]: [d#4, c#5]
+Arguments: hashpartitioning(d#4, 200), ENSURE_REQUIREMENTS, [id=#21]
+
+(8) Sort
+Input [2]: [d#4, c#5]
+Arguments: [d#4 ASC NULLS FIRST], false, 0
+
+(9) SortMergeJoin
+Left keys [1]: [a#1]
+Right keys [1]: [d#4]
+Join condition: None
+
+(10) Project
+Output [2]: [a#1, c#5]
+Input [4]: [a#1, b#2, d#4, c#5]
+
+(11) HashAggregate
+Input [2]: [a#1, c#5]
+Keys [1]: [a#1]
+Functions [1]: [partial_sum(c#5)]
+Aggregate Attributes [1]: [sum#11L]
+Results [2]: [a#1, sum#12L]
+
+(12) Exchange
+Input [2]: [a#1, sum#12L]
+Arguments: hashpartitioning(a#1, 200), ENSURE_REQUIREMENTS, [id=#30]
+
+(13) HashAggregate
+Input [2]: [a#1, sum#12L]
+Keys [1]: [a#1]
+Functions [1]: [sum(c#5)]
+Aggregate Attributes [1]: [sum(c#5)#10L]
+Results [2]: [a#1, sum(c#5)#10L AS s#13L]
+'''
+JOIN_METRIC_NODES = [
+    ('0', 'HashAggregate', 'HashAggregate(keys=[a#1], functions=[sum(c#5)], output=[a#1, s#13L])'),
+    ('1', 'Exchange', 'Exchange hashpartitioning(a#1, 200), ENSURE_REQUIREMENTS, [id=#30]'),
+    ('2', 'HashAggregate', 'HashAggregate(keys=[a#1], functions=[partial_sum(c#5)], output=[a#1, sum#12L])'),
+    ('3', 'Project', 'Project [a#1, c#5]'),
+    ('4', 'SortMergeJoin', 'SortMergeJoin [a#1], [d#4], Inner'),
+    ('5', 'Sort', 'Sort [a#1 ASC NULLS FIRST], false, 0'),
+    ('6', 'Exchange', 'Exchange hashpartitioning(a#1, 200), ENSURE_REQUIREMENTS, [id=#20]'),
+    ('7', 'Filter', 'Filter (isnotnull(a#1) AND (b#2 > 10))'),
+    ('8', 'Scan parquet default.t1', 'FileScan parquet default.t1[a#1,b#2] Batched: true, '
+                                     'Location: InMemoryFileIndex[hdfs://x/t1], ReadSchema: struct<a:int,b:int>'),
+    ('9', 'Sort', 'Sort [d#4 ASC NULLS FIRST], false, 0'),
+    ('10', 'Exchange', 'Exchange hashpartitioning(d#4, 200), ENSURE_REQUIREMENTS, [id=#21]'),
+    ('11', 'Filter', 'Filter isnotnull(d#4)'),
+    ('12', 'Scan parquet default.t2', 'FileScan parquet default.t2[d#4,c#5] Batched: true, '
+                                      'Location: InMemoryFileIndex[hdfs://x/t2], ReadSchema: struct<d:int,c:int>'),
+]
+JOIN_EDGES = [(1, 0), (2, 1), (3, 2), (4, 3), (5, 4), (9, 4), (6, 5), (7, 6), (8, 7), (10, 9), (11, 10), (12, 11)]
+
+
+def metrics_text(nodes, edges):
+    body = '\n\n\n\n'.join(f'id: {nid} name: {name} desc: {desc}\nnumber of output rows: 1'
+                            for nid, name, desc in nodes)
+    return '[PlanMetric]\n' + body + '\n\n\n\n' + ''.join(f'  {a}->{b};\n' for a, b in edges) + '[SubGraph]\ncluster0\n'
+
+
+def history_stream(*entries):
+    return io.StringIO(json.dumps(list(entries)))
+
+
+class AnalyzeStreamTest(unittest.TestCase):
+
+    def test_local_table_scan(self):
+        entry = {'node metrics': LOCAL_TABLE_SCAN_METRICS, 'physical plan': LOCAL_TABLE_SCAN_PLAN}
+        results = analyze_stream('local.json', history_stream(entry))
+        self.assertEqual(len(results), 1)
+        index, views = results[0]
+        self.assertEqual(index, 0)
+        self.assertEqual([view.name for view in views], ['HashAggregate'])
+        self.assertEqual(views[0].contribute_sql[SQLContribute.FROM.value], ('LocalTableScan',))
+
+    def test_broken_query_is_skipped(self):
+        good = {'node metrics': LOCAL_TABLE_SCAN_METRICS, 'physical plan': LOCAL_TABLE_SCAN_PLAN}
+        # 没有边的node metrics无法还原
+        broken = {'node metrics': '[PlanMetric]\nid: 0 name: Project desc: Project [a#1]\n',
+                  'physical plan': '== Physical Plan ==\n'}
+        results = analyze_stream('mixed.json', history_stream(broken, good))
+        self.assertEqual([index for index, _ in results], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from utils.cache_utils import PlanCache, CACHE_SUFFIX
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = PlanCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit(self):
+        key = PlanCache.key('plan', 'metrics')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {0: 'node'})
+        self.assertEqual(self.cache.get(key), {0: 'node'})
+        self.assertNotEqual(PlanCache.key('plan', 'metrics'), PlanCache.key('planm', 'etrics'))
+
+    def test_corrupt_entry_is_a_miss(self):
+        key = PlanCache.key('plan', 'metrics')
+        self.cache.put(key, {0: 'node'})
+        path = os.path.join(self.directory.name, key + CACHE_SUFFIX)
+        corrupt = [b'', b'garbage', b'\x80\x04\x95',
+                   # 模块已删除、类已改名或构造参数已变化
+                   b'cnonexistent_module\nThing\n.', b'cbuiltins\nNoSuchClass\n.',
+                   b"cbuiltins\nint\n(S'x'\nI1\nI2\ntR.",
+                   b"cbuiltins\nint\n(S'x'\ntR.", b'\x80\x09.']
+        for data in corrupt:
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assertIsNone(self.cache.get(key), data)
+
+    def test_evict(self):
+        cache = PlanCache(self.directory.name, max_bytes=0)
+        key = PlanCache.key('plan', 'metrics')
+        cache.put(key, {0: 'node'})
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from tests.test_dedup import view_summary
+from utils.catalog_utils import ViewCatalog
+from utils.dedup_utils import view_signature
+
+
+class ViewCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'views.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def state(self, catalog, signature):
+        return catalog.top_views(), catalog.sources(signature), len(catalog)
+
+    def test_same_source_twice(self):
+        # 一条sql中有两个相同签名的视图，另一条sql中有一个
+        first = [view_summary(['a'], ['x'], index=0), view_summary(['b'], ['x'], index=0)]
+        second = [view_summary(['a'], ['x', 'y'], source='b.json', index=3)]
+        signature = view_signature(first[0])
+        with ViewCatalog(self.path, batch_size=1) as catalog:
+            catalog.add_all(first)
+            catalog.add_all(second)
+            catalog.flush()
+            expected = self.state(catalog, signature)
+            # 同一次运行中再次写入同一条sql
+            catalog.add_all(first)
+            catalog.flush()
+            self.assertEqual(self.state(catalog, signature), expected)
+        # 重新打开后重跑两个日志，缓存在同一批中写入
+        with ViewCatalog(self.path, batch_size=100) as catalog:
+            catalog.add_all(second)
+            catalog.add_all(first)
+            catalog.flush()
+            self.assertEqual(self.state(catalog, signature), expected)
+        self.assertEqual(expected[0], [(signature, 'HashAggregate', 'SELECT a, b FROM t1 Where x', 3, 2)])
+        self.assertEqual(expected[1], [('a.json', 0, 2), ('b.json', 3, 1)])
+        self.assertEqual(expected[2], 1)
+
+    def test_find(self):
+        with ViewCatalog(self.path) as catalog:
+            catalog.add_all([view_summary(['a'], [], tables=('t1', 't2')), view_summary(['a'], [])])
+            catalog.flush()
+            self.assertEqual([sql for _, sql, _ in catalog.find({'t2', 't1'})], ['SELECT a FROM t1, t2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
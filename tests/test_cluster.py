@@ -0,0 +1,98 @@
+import random
+import unittest
+
+from tests.test_dedup import view_summary
+from utils import cluster_utils
+from utils.cluster_utils import ViewClusterer, MinHasher, view_features, jaccard, lsh_params
+
+
+def exact_clusters(views, threshold):
+    # 两两比较精确的Jaccard相似度，超过阈值的视图连通后的簇号
+    features = [view_features(view) for view in views]
+    parents = list(range(len(views)))
+
+    def find(index):
+        while parents[index] != index:
+            index = parents[index]
+        return index
+
+    for i in range(len(views)):
+        for j in range(i):
+            if jaccard(features[i], features[j]) >= threshold:
+                parents[max(find(i), find(j))] = min(find(i), find(j))
+    ids = {}
+    return [ids.setdefault(find(index), len(ids)) for index in range(len(views))]
+
+
+def near_duplicates(rand, families, variants):
+    # 每组一个20个SELECT列的基础视图，变体各替换其中一列，组内两两相似度至少18/22
+    views = []
+    for family in range(families):
+        columns = [f'c{family}_{i}' for i in range(20)]
+        for variant in range(variants):
+            select = list(columns)
+            select[rand.randrange(len(select))] = f'v{family}_{variant}'
+            views.append(view_summary(select, []))
+    rand.shuffle(views)
+    return views
+
+
+class ViewClustererTest(unittest.TestCase):
+
+    def test_matches_exact_jaccard(self):
+        rand = random.Random(7)
+        views = near_duplicates(rand, 8, 5)
+        # 再加一些和所有视图都不相似的视图
+        views += [view_summary([f'u{i}', f'w{i}'], []) for i in range(5)]
+        clusterer = ViewClusterer(0.8)
+        clusterer.add_all((view, 1) for view in views)
+        expected = exact_clusters(views, 0.8)
+        self.assertEqual(clusterer.cluster_ids(), expected)
+        self.assertEqual(len(set(expected)), 13)
+
+    def test_clusters_are_exact_components(self):
+        # 相似度在阈值附近的随机视图：LSH可能漏掉个别候选对，但合并的视图一定在同一个精确的连通分量中
+        rand = random.Random(3)
+        pool = [f'c{i}' for i in range(12)]
+        views = [view_summary(rand.sample(pool, rand.randint(3, 8)), rand.sample(pool, rand.randint(0, 2)))
+                 for _ in range(60)]
+        clusterer = ViewClusterer(0.6)
+        for view in views:
+            clusterer.add(view)
+        exact = exact_clusters(views, 0.6)
+        components = {}
+        for cluster, component in zip(clusterer.cluster_ids(), exact):
+            components.setdefault(cluster, set()).add(component)
+        self.assertTrue(all(len(component) == 1 for component in components.values()))
+
+    def test_representative(self):
+        views = [view_summary(['a', 'b', 'c', 'd', 'e'], []), view_summary(['a', 'b', 'c', 'd', 'e', 'f'], []),
+                 view_summary(['x'], [])]
+        clusterer = ViewClusterer(0.8)
+        clusterer.add_all(zip(views, [1, 3, 2]))
+        self.assertEqual(clusterer.cluster_ids(), [0, 0, 1])
+        self.assertEqual(clusterer.representatives(), {0: 1, 1: 2})
+
+    def test_python_signature(self):
+        feature_sets = [view_features(view) for view in near_duplicates(random.Random(1), 2, 2)] + [frozenset()]
+        hasher = MinHasher(16)
+        expected = [hasher._python_signature([hasher.hash_feature(feature) for feature in features])
+                    for features in feature_sets]
+        self.assertEqual(hasher.signatures(feature_sets), expected)
+        np = cluster_utils.np
+        try:
+            cluster_utils.np = None
+            self.assertEqual(MinHasher(16).signatures(feature_sets), expected)
+        finally:
+            cluster_utils.np = np
+
+    def test_lsh_params(self):
+        for threshold in (0.5, 0.8, 0.9):
+            bands, rows = lsh_params(threshold, 128)
+            self.assertEqual(bands * rows, 128)
+            self.assertLessEqual((1 / bands) ** (1 / rows), threshold)
+        self.assertEqual(lsh_params(0.001, 128), (128, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
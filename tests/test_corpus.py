@@ -0,0 +1,92 @@
+import os
+import pickle
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from utils.fetch_utils import LocalCorpusFetcher, MappedFile
+
+FILES = {'a.json': b'[{"x": 1}]', 'b': b'{"Event":"SparkListenerLogStart"}\n' * 100, 'empty.json': b''}
+
+
+class LocalCorpusFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write_files(self):
+        root = self.path('corpus')
+        os.makedirs(os.path.join(root, 'sub'))
+        for name, data in FILES.items():
+            with open(os.path.join(root, 'sub' if name == 'b' else '', name), 'wb') as f:
+                f.write(data)
+        return root
+
+    def check_corpus(self, fetcher, mapped, archive=True):
+        with fetcher:
+            self.assertEqual([(name, size) for name, size, _ in fetcher.iter_listing('/')],
+                             [(name, len(FILES[name])) for name in sorted(FILES)])
+            for name, data in FILES.items():
+                self.assertEqual(fetcher.read_bytes(f'/logs/{name}'), data)
+                self.assertEqual(fetcher.read(name), data.decode('utf-8'))
+                # 单独的空文件不能映射
+                with fetcher.open_raw(name) as raw:
+                    self.assertEqual(isinstance(raw, MappedFile), mapped and (len(data) > 0 or archive), name)
+            with self.assertRaises(FileNotFoundError):
+                fetcher.open_raw('missing.json')
+            self.assertIsNone(fetcher.fetch('missing.json'))
+            # 传到子进程后重新打开
+            self.assertEqual(pickle.loads(pickle.dumps(fetcher)).read_bytes('b'), FILES['b'])
+
+    def test_directory(self):
+        self.check_corpus(LocalCorpusFetcher(self.write_files()), True, archive=False)
+
+    def test_tar(self):
+        root = self.write_files()
+        with tarfile.open(self.path('corpus.tar'), 'w') as tar:
+            tar.add(root, 'corpus')
+        self.check_corpus(LocalCorpusFetcher(self.path('corpus.tar')), True)
+
+    def test_compressed_tar_is_rejected(self):
+        root = self.write_files()
+        with tarfile.open(self.path('corpus.tar.gz'), 'w:gz') as tar:
+            tar.add(root, 'corpus')
+        with self.assertRaises(ValueError):
+            list(LocalCorpusFetcher(self.path('corpus.tar.gz')).iter_listing('/'))
+
+    def test_stored_zip(self):
+        with zipfile.ZipFile(self.path('corpus.zip'), 'w', zipfile.ZIP_STORED) as archive:
+            for name, data in FILES.items():
+                # 扩展字段使数据起始位置不只取决于文件名长度
+                info = zipfile.ZipInfo(f'logs/{name}')
+                info.extra = b'\xfe\xca\x02\x00ab'
+                archive.writestr(info, data)
+        self.check_corpus(LocalCorpusFetcher(self.path('corpus.zip')), True)
+
+    def test_deflated_zip(self):
+        with zipfile.ZipFile(self.path('corpus.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in FILES.items():
+                archive.writestr(f'logs/{name}', data)
+        self.check_corpus(LocalCorpusFetcher(self.path('corpus.zip')), False)
+
+    def test_empty_archives(self):
+        open(self.path('empty'), 'wb').close()
+        with tarfile.open(self.path('empty.tar'), 'w'):
+            pass
+        with zipfile.ZipFile(self.path('empty.zip'), 'w'):
+            pass
+        for name in ('empty', 'empty.tar', 'empty.zip'):
+            with LocalCorpusFetcher(self.path(name)) as fetcher:
+                self.assertEqual(list(fetcher.iter_listing('/')), [], name)
+                self.assertIsNone(fetcher.fetch('a.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
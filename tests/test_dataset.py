@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from tests.test_dedup import view_summary
+from utils.dataset_utils import TokenDataset, TokenDatasetReader, encode_view, np, SOURCES_FILE
+
+
+@unittest.skipIf(np is None, 'numpy is required to read token datasets')
+class TokenDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def decoded(self):
+        reader = TokenDatasetReader(self.path)
+        return [reader.vocab.decode(reader[i]) for i in range(len(reader))], reader.sources
+
+    def test_round_trip(self):
+        # 同一条sql中有两个视图
+        views = [view_summary(['a'], ['x > 1'], index=0), view_summary(['b'], [], index=0),
+                 view_summary(['c'], [], source='b.json', index=2)]
+        with TokenDataset(self.path) as dataset:
+            self.assertEqual(dataset.add_all(views[:2]), [0, 1])
+            self.assertEqual(dataset.add(views[2]), 2)
+            expected = [dataset.vocab.decode(encode_view(view, dataset.vocab)) for view in views]
+        samples, sources = self.decoded()
+        self.assertEqual(samples, expected)
+        self.assertEqual(sources, [('a.json', 0), ('a.json', 0), ('b.json', 2)])
+
+    def test_empty(self):
+        TokenDataset(self.path).close()
+        self.assertEqual(self.decoded(), ([], []))
+
+    def test_reprocessed_log_is_not_appended(self):
+        first = [view_summary(['a'], [], index=0), view_summary(['b'], [], index=0)]
+        with TokenDataset(self.path) as dataset:
+            dataset.add_all(first)
+        expected = self.decoded()
+        # 日志变大后重新处理：已有的查询跳过，只追加新的查询
+        with TokenDataset(self.path) as dataset:
+            self.assertEqual(dataset.add_all(first), [])
+            self.assertIsNone(dataset.add(first[0]))
+            self.assertEqual(dataset.add_all([view_summary(['c'], [], index=1)]), [2])
+        samples, sources = self.decoded()
+        self.assertEqual(samples[:2], expected[0])
+        self.assertEqual(sources, [('a.json', 0), ('a.json', 0), ('a.json', 1)])
+
+    def test_uncommitted_rows_are_dropped(self):
+        with TokenDataset(self.path) as dataset:
+            dataset.add(view_summary(['a'], [], index=0))
+        dataset = TokenDataset(self.path)
+        dataset.add(view_summary(['b'], [], index=1))
+        # 模拟写了一半后中断：数据和来源已写出，meta.json没有更新
+        dataset.sources_file.write('["a.json", 1]\n')
+        dataset.sources_file.flush()
+        dataset.tokens_file.write(b'\0' * 8)
+        dataset.tokens_file.flush()
+        dataset.tokens_file.close()
+        dataset.offsets_file.close()
+        dataset.sources_file.close()
+        with TokenDataset(self.path) as dataset:
+            self.assertEqual(len(dataset.keys), 1)
+            self.assertEqual(dataset.add(view_summary(['b'], [], index=1)), 1)
+        samples, sources = self.decoded()
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(sources, [('a.json', 0), ('a.json', 1)])
+
+    def test_dataset_without_sources(self):
+        with TokenDataset(self.path) as dataset:
+            dataset.add(view_summary(['a'], [], index=0))
+        os.remove(os.path.join(self.path, SOURCES_FILE))
+        self.assertEqual(self.decoded()[1], [(None, None)])
+        with TokenDataset(self.path) as dataset:
+            self.assertEqual(dataset.add(view_summary(['a'], [], index=0)), 1)
+        self.assertEqual(self.decoded()[1], [(None, None), ('a.json', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
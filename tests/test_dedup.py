@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from utils.analysis_utils import render_sql
+from utils.catalog_utils import ViewCatalog
+from utils.dedup_utils import view_signature, merge_view
+from utils.structure import ClauseArray, ViewSummary, SQLContribute, EMPTY_CLAUSE_SET
+
+SELECT = SQLContribute.SELECT.value
+FROM = SQLContribute.FROM.value
+WHERE = SQLContribute.WHERE.value
+
+
+def view_summary(select, where, tables=('t1',), source='a.json', index=0):
+    contribute = ClauseArray(())
+    contribute[SELECT] = tuple(select)
+    contribute[FROM] = tuple(tables)
+    contribute[WHERE] = tuple(where)
+    accumulated = ClauseArray(EMPTY_CLAUSE_SET)
+    accumulated[SELECT] = frozenset(select)
+    accumulated[FROM] = frozenset(tables)
+    accumulated[WHERE] = frozenset(where)
+    view = ViewSummary(None, 'HashAggregate', '', contribute, accumulated, source, index)
+    return view._replace(sql=render_sql(view))
+
+
+class ViewDedupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'views.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_signature(self):
+        self.assertEqual(view_signature(view_summary(['a'], ['x > 1'])), view_signature(view_summary(['b'], [])))
+        self.assertNotEqual(view_signature(view_summary(['a'], [])), view_signature(view_summary(['a'], [], ['t2'])))
+
+    def test_merge_view(self):
+        view = merge_view(view_summary(['b', 'a'], ['y', 'x']), {'a', 'b', 'c'}, {'x'})
+        self.assertEqual(view.contribute_sql[SELECT], ('a', 'b', 'c'))
+        self.assertEqual(view.accumulate_contribute[WHERE], frozenset({'x'}))
+        self.assertEqual(view.sql, 'SELECT a, b, c FROM t1 Where x')
+
+    def test_merge_and_frequency(self):
+        with ViewCatalog(self.path, batch_size=1) as catalog:
+            catalog.add_all([view_summary(['a'], ['x', 'y'], source='a.json')])
+            catalog.add_all([view_summary(['b'], ['x'], source='b.json')])
+            catalog.add_all([view_summary(['a'], [], tables=('t2',), source='b.json')])
+            items = catalog.items()
+        self.assertEqual([(view.sql, frequency) for view, frequency in items],
+                         [('SELECT a, b FROM t1 Where x', 2), ('SELECT a FROM t2', 1)])
+        view = items[0][0]
+        self.assertEqual(view.accumulate_contribute[SELECT], frozenset({'a', 'b'}))
+        self.assertEqual((view.source, view.index), ('a.json', 0))
+
+    def test_re_add_is_idempotent(self):
+        views = [view_summary(['a'], ['x'], index=0), view_summary(['a'], ['x'], index=0),
+                 view_summary(['b'], ['x'], index=1)]
+        with ViewCatalog(self.path) as catalog:
+            catalog.add_all(views[:2])
+            catalog.add_all(views[2:])
+            expected = [(view.sql, frequency) for view, frequency in catalog.items()]
+        # 重新处理同一日志（例如中断后重跑）不改变合并结果和出现次数
+        with ViewCatalog(self.path) as catalog:
+            catalog.add_all(views[:2])
+            catalog.add_all(views[2:])
+            self.assertEqual([(view.sql, frequency) for view, frequency in catalog.items()], expected)
+        self.assertEqual(expected, [('SELECT a, b FROM t1 Where x', 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import struct
+import unittest
+
+from utils.eventlog_utils import build_plan_graph, plan_metrics_text, iter_execution_entries, iter_stream_events, \
+    iter_log_entries, event_log_events
+from utils.parallel_utils import analyze_stream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# 一个通过ReusedExchange自连接的sql、一条DDL、一个没有结束事件的自适应执行
+EVENT_LOG = os.path.join(FIXTURES, 'eventlog')
+EVENT_LOG_GZ = os.path.join(FIXTURES, 'eventlog.gz')
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def lz4_java(data):
+    # lz4-java的LZ4BlockOutputStream格式，最后是一个空的结束块
+    out = b''
+    for start in range(0, len(data), 1024):
+        chunk = data[start:start + 1024]
+        compressed = lz4_block.compress(chunk, store_size=False)
+        out += b'LZ4Block' + struct.pack('<BiiI', 0x25, len(compressed), len(chunk), 0) + compressed
+    return out + b'LZ4Block' + struct.pack('<BiiI', 0x10, 0, 0, 0)
+
+
+def snappy_java(data):
+    out = b'\x82SNAPPY\x00' + struct.pack('>ii', 1, 1)
+    for start in range(0, len(data), 1024):
+        compressed = snappy.compress(data[start:start + 1024])
+        out += struct.pack('>i', len(compressed)) + compressed
+    return out
+
+
+def entries_of(data, path, metric_values=True):
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    return list(iter_log_entries(stream, path, metric_values))
+
+
+class EventLogTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = read_bytes(EVENT_LOG)
+        cls.expected = entries_of(cls.data, EVENT_LOG)
+
+    def plan_info(self, execution_id):
+        for line in self.data.decode('utf-8').splitlines():
+            event = json.loads(line)
+            if event.get('executionId') == execution_id and 'sparkPlanInfo' in event:
+                return event['sparkPlanInfo']
+
+    def test_build_plan_graph_reused_exchange(self):
+        nodes, edges, clusters = build_plan_graph(self.plan_info(0))
+        self.assertEqual([node['nodeName'] for node in nodes],
+                         ['WholeStageCodegen (3)', 'SortMergeJoin', 'Exchange', 'WholeStageCodegen (1)', 'Filter',
+                          'Scan parquet default.t1'])
+        # ReusedExchange指向已有的Exchange，InputAdapter不出现在图中
+        self.assertEqual(edges, [(1, 0), (2, 1), (3, 2), (4, 3), (5, 4), (2, 1)])
+        self.assertEqual(clusters, [(0, [1]), (3, [4, 5])])
+
+    def test_plan_metrics_text(self):
+        text = plan_metrics_text(self.plan_info(0), {2: 7, 3: 100, 4: 12, 7: 5})
+        self.assertTrue(text.startswith('[PlanMetric]\nid: 0 name: WholeStageCodegen (3) desc: WholeStageCodegen (3)'))
+        self.assertIn('id: 1 name: SortMergeJoin desc: SortMergeJoin [a#1], [a#11], Inner\nnumber of output rows: 7',
+                      text)
+        self.assertIn('data size: 100 B\n', text)
+        self.assertIn('duration: 12 ms\n', text)
+        # average类型的值不能相加，不输出
+        self.assertNotIn('avg hash probe', text)
+        self.assertTrue(text.endswith('  5->4;\n  2->1;\n[SubGraph]\ncluster0\n1\ncluster3\n4 5\n'))
+        self.assertNotIn('number of output rows', plan_metrics_text(self.plan_info(0)))
+        # 没有边的DDL计划
+        self.assertIsNone(plan_metrics_text(self.plan_info(1)))
+
+    def test_iter_execution_entries(self):
+        with open(EVENT_LOG, encoding='utf-8') as stream:
+            events = list(iter_stream_events(stream, event_log_events(True)))
+        entries = list(iter_execution_entries(events, metric_values=True))
+        self.assertEqual(entries, self.expected)
+        # DDL没有输出；没有结束事件的执行在最后输出，计划为自适应更新后的计划
+        self.assertEqual([entry['execution id'] for entry in entries], [0, 2])
+        self.assertIn('number of output rows: 7\n', entries[0]['node metrics'])
+        self.assertIn('number of output rows: 3\n', entries[0]['node metrics'])
+        self.assertIn('duration: 12 ms\n', entries[0]['node metrics'])
+        self.assertTrue(entries[1]['physical plan'].startswith('== Physical Plan ==\n* HashAggregate'))
+        self.assertTrue(entries[1]['node metrics'].startswith('[PlanMetric]\nid: 0 name: HashAggregate'))
+        without_values = list(iter_execution_entries(events))
+        self.assertNotIn('number of output rows', without_values[0]['node metrics'])
+
+    def test_analyze_event_log(self):
+        with open(EVENT_LOG, encoding='utf-8') as stream:
+            results = analyze_stream(EVENT_LOG, stream)
+        self.assertEqual([(index, [view.name for view in views]) for index, views in results],
+                         [(0, ['SortMergeJoin']), (1, ['HashAggregate'])])
+
+    def test_gzip_fixture(self):
+        self.assertEqual(entries_of(read_bytes(EVENT_LOG_GZ), EVENT_LOG_GZ), self.expected)
+
+    def test_stream_codecs(self):
+        half = len(self.data) // 2
+        codecs = {'.gz': gzip.compress, '.bz2': bz2.compress, '.xz': lzma.compress}
+        if zstandard is not None:
+            codecs['.zstd'] = zstandard.ZstdCompressor().compress
+        for suffix, compress in codecs.items():
+            # 多个压缩流首尾相接
+            data = compress(self.data[:half]) + compress(self.data[half:])
+            self.assertEqual(entries_of(data, 'app' + suffix), self.expected, suffix)
+
+    @unittest.skipIf(lz4_block is None, 'lz4 is not installed')
+    def test_lz4_codec(self):
+        self.assertEqual(entries_of(lz4_java(self.data), 'app.lz4'), self.expected)
+
+    @unittest.skipIf(snappy is None, 'python-snappy is not installed')
+    def test_snappy_codec(self):
+        data = snappy_java(self.data[:100]) + snappy_java(self.data[100:])
+        self.assertEqual(entries_of(data, 'app.snappy'), self.expected)
+
+    def test_truncated_stream(self):
+        data = read_bytes(EVENT_LOG_GZ)
+        with self.assertRaises(ValueError) as raised:
+            entries_of(data[:len(data) // 2], EVENT_LOG_GZ)
+        self.assertIsInstance(raised.exception.__cause__, EOFError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from tests.test_dedup import view_summary
+from utils.export_utils import ColumnarViewWriter, ParquetViewWriter, EXPORT_COLUMNS, open_columns, view_row, np, pq
+
+
+def expected_rows():
+    views = [view_summary(['a'], ['x > 1', 'y'], tables=('t1', 't2')), view_summary(['b'], [], source=None, index=None),
+             view_summary(['c'], ['列 = 1'], source='b.json', index=4)]
+    return views, [view_row(view, i + 1, i % 2, i == 0, i * 3) for i, view in enumerate(views)]
+
+
+def write(writer, views):
+    with writer:
+        for i, view in enumerate(views):
+            writer.append(view, i + 1, i % 2, i == 0, i * 3)
+
+
+def read_columnar(path):
+    columns = open_columns(path)
+    rows = []
+    for i in range(len(columns['sql']['offsets']) - 1):
+        row = {}
+        for name, column_type in EXPORT_COLUMNS:
+            arrays = columns[name]
+            if column_type == 'int64':
+                row[name] = int(arrays['values'][i])
+                continue
+
+            def string(j):
+                return bytes(arrays['data'][arrays['offsets'][j]:arrays['offsets'][j + 1]]).decode('utf-8')
+
+            if column_type == 'string':
+                row[name] = string(i)
+            else:
+                row[name] = [string(j) for j in range(arrays['list_offsets'][i], arrays['list_offsets'][i + 1])]
+        rows.append(row)
+    return rows
+
+
+class ViewWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'views')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @unittest.skipIf(np is None, 'numpy is required to open columnar view exports')
+    def test_columnar_round_trip(self):
+        views, rows = expected_rows()
+        # 每批两行，最后一批不满
+        write(ColumnarViewWriter(self.path, batch_size=2), views)
+        self.assertEqual(read_columnar(self.path), rows)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    @unittest.skipIf(np is None, 'numpy is required to open columnar view exports')
+    def test_columnar_empty(self):
+        write(ColumnarViewWriter(self.path), [])
+        self.assertEqual(read_columnar(self.path), [])
+
+    @unittest.skipIf(pq is None, 'pyarrow is required to write parquet')
+    def test_parquet_round_trip(self):
+        views, rows = expected_rows()
+        path = self.path + '.parquet'
+        write(ParquetViewWriter(path, batch_size=2), views)
+        self.assertEqual(pq.read_table(path).to_pylist(), rows)
+        self.assertEqual(pq.ParquetFile(path).num_row_groups, 2)
+
+    @unittest.skipIf(pq is None, 'pyarrow is required to write parquet')
+    def test_parquet_empty(self):
+        path = self.path + '.parquet'
+        write(ParquetViewWriter(path), [])
+        table = pq.read_table(path)
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.column_names, [name for name, _ in EXPORT_COLUMNS])
+
+    def test_failed_export_is_discarded(self):
+        views, _ = expected_rows()
+        with self.assertRaises(RuntimeError):
+            with ColumnarViewWriter(self.path, batch_size=1) as writer:
+                writer.append(views[0])
+                raise RuntimeError('interrupted')
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from tests.test_analysis import LOCAL_TABLE_SCAN_METRICS, LOCAL_TABLE_SCAN_PLAN
+from utils.fetch_utils import HistoryFetcher, FetchError, WebHdfsFetcher
+from utils.pipeline_utils import LogPipeline
+
+
+class MemoryFetcher(HistoryFetcher):
+    """
+    内存中的日志，前failures次读取失败，用于代替hdfs
+    """
+
+    def __init__(self, files, failures=0, **kwargs):
+        super().__init__(retry_interval=0, **kwargs)
+        self.files = files
+        self.failures = failures
+        self.reads = 0
+
+    def read(self, path):
+        self.reads += 1
+        if self.reads <= self.failures:
+            raise FetchError(f'{path} is temporarily unavailable')
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        return self.files[path]
+
+    def iter_listing(self, directory, start_after=None):
+        for name in sorted(self.files):
+            if start_after is None or name > start_after:
+                yield name, len(self.files[name]), '2020-10-01 00:00'
+
+
+def history_json(*entries):
+    return json.dumps(list(entries))
+
+
+class HistoryFetcherTest(unittest.TestCase):
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            HistoryFetcher()
+
+    def test_retry(self):
+        fetcher = MemoryFetcher({'a.json': '[]'}, failures=2, retries=2)
+        self.assertEqual(fetcher.fetch('a.json'), '[]')
+        self.assertEqual(fetcher.reads, 3)
+        fetcher = MemoryFetcher({'a.json': '[]'}, failures=2, retries=1)
+        self.assertIsNone(fetcher.fetch('a.json'))
+
+    def test_listing(self):
+        fetcher = MemoryFetcher({'b.json': '', 'a.json': '', 'c.json': ''})
+        self.assertEqual([name for name, _, _ in fetcher.iter_listing('/')], ['a.json', 'b.json', 'c.json'])
+        self.assertEqual([name for name, _, _ in fetcher.iter_listing('/', 'a.json')], ['b.json', 'c.json'])
+
+    def test_pipeline(self):
+        entry = {'node metrics': LOCAL_TABLE_SCAN_METRICS, 'physical plan': LOCAL_TABLE_SCAN_PLAN}
+        fetcher = MemoryFetcher({'a.json': history_json(entry), 'b.json': history_json(entry, entry)}, retries=0)
+        logs = [(name, None) for name, _, _ in fetcher.iter_listing('/')] + [('missing.json', None)]
+        results = []
+        LogPipeline(fetcher, fetch_concurrency=2).run(logs, lambda path, info, queries: results.append((path, queries)))
+        self.assertEqual([(path, None if queries is None else len(queries)) for path, queries in results],
+                         [('a.json', 1), ('b.json', 2), ('missing.json', None)])
+
+
+class WebHdfsHandler(BaseHTTPRequestHandler):
+    """
+    /webhdfs/v1/logs下有a、b两个文件和一个子目录，/webhdfs/v1/logs/flaky第一次请求返回500
+    """
+    requests = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        op = parse_qs(url.query)['op'][0]
+        WebHdfsHandler.requests.append((url.path, op))
+        if op == 'LISTSTATUS_BATCH':
+            statuses = [{'pathSuffix': name, 'length': 1, 'modificationTime': 1600000000000, 'type': kind}
+                        for name, kind in (('a', 'FILE'), ('archive', 'DIRECTORY'), ('b', 'FILE'))]
+            self._reply(200, {'DirectoryListing': {'partialListing': {'FileStatuses': {'FileStatus': statuses}},
+                                                   'remainingEntries': 0}})
+        elif url.path.endswith('/flaky') and WebHdfsHandler.requests.count((url.path, op)) == 1:
+            self._reply(500, {'RemoteException': {'message': 'busy'}})
+        elif url.path.endswith('/flaky'):
+            self._reply(200, [])
+        else:
+            self._reply(404, {'RemoteException': {'message': 'File does not exist'}})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class WebHdfsFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        WebHdfsHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebHdfsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.fetcher = WebHdfsFetcher(f'127.0.0.1:{self.server.server_port}', retries=3, retry_interval=0)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_listing_skips_directories(self):
+        self.assertEqual([name for name, _, _ in self.fetcher.iter_listing('/logs')], ['a', 'b'])
+
+    def test_client_error_is_not_retried(self):
+        self.assertIsNone(self.fetcher.fetch('/logs/missing'))
+        self.assertEqual(WebHdfsHandler.requests, [('/webhdfs/v1/logs/missing', 'OPEN')])
+
+    def test_server_error_is_retried(self):
+        self.assertEqual(self.fetcher.fetch('/logs/flaky'), '[]')
+        self.assertEqual(len(WebHdfsHandler.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
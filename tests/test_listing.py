@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from utils.listing_utils import LogListing
+
+
+class ListingFetcher(object):
+    """
+    按文件名排序列出的内存目录，记录每次列出的起点
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.calls = []
+
+    def iter_listing(self, directory, start_after=None):
+        self.calls.append((directory, start_after))
+        for entry in sorted(self.entries):
+            if start_after is None or entry[0] > start_after:
+                yield entry
+
+
+class LogListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'listing.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_incremental_refresh(self):
+        fetcher = ListingFetcher([('app_1', 10, '2020-10-01 00:00'), ('app_2.inprogress', 5, '2020-10-01 00:01'),
+                                  ('app_3', 30, '2020-10-01 00:02')])
+        listing = LogListing(fetcher, '/logs', self.cache_path)
+        self.assertEqual([name for name, _, _ in listing.iter_logs()], ['app_1', 'app_3'])
+        # 未完成的日志写完后改名，又新增了一个日志；从app_1之后重新列出，app_1使用缓存（大小与目录中的不同）
+        fetcher.entries = [('app_1', 11, '2020-10-01 00:00'), ('app_2', 20, '2020-10-01 00:05'),
+                           ('app_3', 30, '2020-10-01 00:02'), ('app_4', 40, '2020-10-01 00:06')]
+        listing = LogListing(fetcher, '/logs', self.cache_path)
+        self.assertEqual(list(listing.iter_logs()), [('app_1', 10, '2020-10-01 00:00'),
+                                                     ('app_2', 20, '2020-10-01 00:05'),
+                                                     ('app_3', 30, '2020-10-01 00:02'),
+                                                     ('app_4', 40, '2020-10-01 00:06')])
+        self.assertEqual(fetcher.calls, [('/logs', None), ('/logs', 'app_1')])
+        # 没有未完成的日志时从最后一个缓存的日志之后继续列出
+        listing = LogListing(fetcher, '/logs', self.cache_path)
+        self.assertEqual(len(list(listing.iter_logs())), 4)
+        self.assertEqual(fetcher.calls[-1], ('/logs', 'app_4'))
+
+    def test_first_log_in_progress(self):
+        fetcher = ListingFetcher([('app_1.inprogress', 10, '2020-10-01 00:00')])
+        list(LogListing(fetcher, '/logs', self.cache_path).iter_logs())
+        fetcher.entries = [('app_1', 10, '2020-10-01 00:01')]
+        self.assertEqual(list(LogListing(fetcher, '/logs', self.cache_path).iter_logs()),
+                         [('app_1', 10, '2020-10-01 00:01')])
+        self.assertEqual(fetcher.calls, [('/logs', None), ('/logs', None)])
+
+    def test_full_refresh(self):
+        fetcher = ListingFetcher([('app_1', 10, '2020-10-01 00:00')])
+        list(LogListing(fetcher, '/logs', self.cache_path).iter_logs())
+        # 超过完整列出的间隔或换了目录时不使用缓存
+        list(LogListing(fetcher, '/logs', self.cache_path, full_refresh_interval=-1).iter_logs())
+        list(LogListing(fetcher, '/other', self.cache_path).iter_logs())
+        self.assertEqual(fetcher.calls, [('/logs', None), ('/logs', None), ('/other', None)])
+
+    def test_time_window(self):
+        fetcher = ListingFetcher([('app_1', 10, '2020-09-30 23:00'), ('app_2', 10, '2020-10-01 12:00'),
+                                  ('local-3', 10, '2020-10-01 12:00'), ('app_4', 10, '2020-10-03 00:00')])
+        listing = LogListing(fetcher, '/logs')
+        self.assertEqual([name for name, _, _ in listing.iter_logs('2020-10-01 00:00', '2020-10-02 00:00')],
+                         ['app_2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
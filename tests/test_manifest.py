@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+
+from utils.manifest_utils import LogManifest, STATUS_DONE, STATUS_FAILED
+
+
+class LogManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'manifest.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_skip_processed(self):
+        manifest = LogManifest(self.path)
+        manifest.record('app_1', 10, '2020-10-01 00:00', STATUS_DONE, ['SELECT a FROM t1'])
+        manifest.record('app_2', 20, '2020-10-01 00:00', STATUS_FAILED)
+        # commit之前中断时不会留下记录
+        self.assertFalse(LogManifest(self.path).is_processed('app_1', 10, '2020-10-01 00:00'))
+        manifest.commit()
+        manifest = LogManifest(self.path)
+        self.assertTrue(manifest.is_processed('app_1', 10, '2020-10-01 00:00'))
+        # 处理失败的日志和新日志需要处理
+        self.assertFalse(manifest.is_processed('app_2', 20, '2020-10-01 00:00'))
+        self.assertFalse(manifest.is_processed('app_3', 30, '2020-10-01 00:00'))
+
+    def test_reprocess_changed(self):
+        manifest = LogManifest(self.path)
+        manifest.record('app_1', 10, '2020-10-01 00:00', STATUS_DONE)
+        manifest.commit()
+        manifest = LogManifest(self.path)
+        self.assertFalse(manifest.is_processed('app_1', 11, '2020-10-01 00:00'))
+        self.assertFalse(manifest.is_processed('app_1', 10, '2020-10-01 00:01'))
+        # 同一日志以最后一条记录为准
+        manifest.record('app_1', 11, '2020-10-01 00:01', STATUS_DONE)
+        manifest.commit()
+        manifest = LogManifest(self.path)
+        self.assertTrue(manifest.is_processed('app_1', 11, '2020-10-01 00:01'))
+        self.assertFalse(manifest.is_processed('app_1', 10, '2020-10-01 00:00'))
+
+    def test_partial_line(self):
+        manifest = LogManifest(self.path)
+        manifest.record('app_1', 10, '2020-10-01 00:00', STATUS_DONE)
+        manifest.commit()
+        # 写到一半时中断
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"log": "app_2", "size": 2')
+        manifest = LogManifest(self.path)
+        self.assertTrue(manifest.is_processed('app_1', 10, '2020-10-01 00:00'))
+        self.assertFalse(manifest.is_processed('app_2', 20, '2020-10-01 00:00'))
+        manifest.record('app_2', 20, '2020-10-01 00:00', STATUS_DONE)
+        manifest.commit()
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['log'] for line in f], ['app_1', 'app_2'])
+        manifest = LogManifest(self.path)
+        self.assertTrue(manifest.is_processed('app_2', 20, '2020-10-01 00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import re
+import unittest
+
+from tests.test_analysis import JOIN_PLAN, JOIN_METRIC_NODES, JOIN_EDGES, metrics_text
+from utils.analysis_utils import analyze_plan
+from utils.memo_utils import SubtreeMemo
+
+
+def renumber(text, offset=100):
+    return re.sub(r'#(\d+)', lambda m: f'#{int(m.group(1)) + offset}', text)
+
+
+def rendered(context, candidate_views, sqls):
+    return ([(view.nid, view.contribute_sql.copy(), view.sql_fragment, view.accumulate_contribute)
+             for view in candidate_views], sqls)
+
+
+class SubtreeMemoTest(unittest.TestCase):
+
+    def test_renumbered_plan(self):
+        metrics = metrics_text(JOIN_METRIC_NODES, JOIN_EDGES)
+        plans = [(JOIN_PLAN, metrics), (renumber(JOIN_PLAN), renumber(metrics))]
+        expected = [rendered(*analyze_plan(plan, text)) for plan, text in plans]
+        memo = SubtreeMemo()
+        self.assertEqual([rendered(*analyze_plan(plan, text, memo=memo)) for plan, text in plans], expected)
+        # 去掉编号后结构相同，第二个计划复用累计结果，但不复用带编号的sql片段
+        self.assertEqual(len(memo), len(JOIN_METRIC_NODES))
+        self.assertTrue(all(entry.count == 2 for entry in memo.entries.values()))
+        self.assertEqual(rendered(*analyze_plan(JOIN_PLAN, metrics, memo=memo)), expected[0])
+        self.assertGreater(memo.hits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
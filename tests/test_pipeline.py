@@ -0,0 +1,59 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from tests.test_analysis import LOCAL_TABLE_SCAN_METRICS, LOCAL_TABLE_SCAN_PLAN
+from tests.test_fetch import MemoryFetcher, history_json
+from utils.pipeline_utils import LogPipeline
+
+
+class CrashingFetcher(MemoryFetcher):
+    """
+    在解析子进程中直接打开日志，第一次打开crash.json时子进程异常退出
+    """
+    in_place = True
+
+    def __init__(self, files, marker):
+        super().__init__(files)
+        self.marker = marker
+
+    def read(self, path):
+        if path == 'crash.json' and not os.path.exists(self.marker):
+            open(self.marker, 'w').close()
+            os._exit(1)
+        return super().read(path)
+
+
+class LogPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        entry = {'node metrics': LOCAL_TABLE_SCAN_METRICS, 'physical plan': LOCAL_TABLE_SCAN_PLAN}
+        self.files = {name: history_json(entry) for name in ('a.json', 'b.json', 'crash.json', 'c.json')}
+
+    def test_sink_runs_off_event_loop_in_order(self):
+        threads = set()
+        results = []
+
+        def sink(path, info, queries):
+            threads.add(threading.get_ident())
+            results.append(path)
+
+        LogPipeline(MemoryFetcher(self.files), fetch_concurrency=3).run([(name, None) for name in self.files], sink)
+        self.assertEqual(results, list(self.files))
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_broken_process_pool_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = CrashingFetcher(self.files, os.path.join(directory, 'crashed'))
+            results = []
+            LogPipeline(fetcher, parse_workers=2).run([(name, None) for name in self.files],
+                                                      lambda path, info, queries: results.append((path, queries)))
+            self.assertTrue(os.path.exists(fetcher.marker))
+        self.assertEqual([(path, len(queries)) for path, queries in results],
+                         [(name, 1) for name in self.files])
+
+
+if __name__ == '__main__':
+    unittest.main()
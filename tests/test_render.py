@@ -0,0 +1,93 @@
+import random
+import unittest
+
+from utils.analysis_utils import canonicalize, generate_sql, render_sql
+from utils.structure import MetricNode, SQLContribute
+
+JOIN_TYPES = {'Inner': 'JOIN', 'LeftOuter': 'LEFT JOIN', 'LeftSemi': 'SEMI JOIN', 'LeftAnti': 'ANTI JOIN',
+              'FullOuter': 'FULL JOIN'}
+# 以分隔符、and结尾或带空白的表达式，覆盖canonicalize的各种截断
+ITEMS = ['a#1', 'b#2L', 'sum(c#5)#10L AS s#13L', 'x and', 'y AND ', 'z,', ' w.', 'v: ', 'p = q', '']
+
+
+def legacy_sql(node):
+    """
+    memo之前的实现：逐项+=拼接，每个子句结束后对整个字符串canonicalize
+    """
+    contribute = node.contribute_sql
+
+    def general(sql):
+        for key, keyword, sep, tail in ((SQLContribute.WHERE, 'Where ', ' and ', ' '),
+                                        (SQLContribute.GROUP_BY, 'Group by ', ', ', ' '),
+                                        (SQLContribute.ORDER_BY, 'Order by ', ', ', '')):
+            items = contribute[key.value]
+            if len(items) > 0:
+                sql += keyword
+                for item in items:
+                    sql += item + sep
+                sql = canonicalize(sql) + tail
+        return canonicalize(sql)
+
+    union_query = contribute[SQLContribute.UNION_QUERY.value]
+    if len(union_query) != 0:
+        sql = union_query[0]
+        for query in union_query[1:]:
+            sql += ' Union ' + query
+        return sql
+    sql = 'SELECT '
+    select = contribute[SQLContribute.SELECT.value]
+    if len(select) != 0:
+        for item in select:
+            sql += item + ', '
+    else:
+        sql += '*'
+    sql = canonicalize(sql) + ' '
+    subquery = contribute[SQLContribute.SUBQUERY.value]
+    if len(subquery) == 0:
+        sql += 'FROM '
+        for item in contribute[SQLContribute.FROM.value]:
+            sql += item + ', '
+        return general(canonicalize(sql) + ' ')
+    join_type = JOIN_TYPES[contribute[SQLContribute.JOIN_TYPE.value][0]]
+    sql += 'From (' + subquery[0] + ') ' + join_type + ' (' + subquery[1] + ') '
+    join_condition = contribute[SQLContribute.JOIN_CONDITION.value]
+    if len(join_condition) > 0:
+        sql += 'ON '
+        for condition in join_condition:
+            sql += condition + ' AND '
+        sql = canonicalize(sql)
+    return general(sql)
+
+
+def random_node(rng):
+    node = MetricNode('0', 'Random', {}, None, {})
+    pick = lambda n: tuple(rng.choice(ITEMS) for _ in range(rng.randint(0, n)))
+    node.contribute_sql[SQLContribute.SELECT.value] = pick(3)
+    node.contribute_sql[SQLContribute.FROM.value] = pick(2) or ('t',)
+    node.contribute_sql[SQLContribute.WHERE.value] = pick(3)
+    node.contribute_sql[SQLContribute.GROUP_BY.value] = pick(2)
+    node.contribute_sql[SQLContribute.ORDER_BY.value] = pick(2)
+    kind = rng.random()
+    if kind < 0.4:
+        node.contribute_sql[SQLContribute.JOIN_TYPE.value] = (rng.choice(list(JOIN_TYPES)),)
+        node.contribute_sql[SQLContribute.JOIN_CONDITION.value] = pick(2)
+        node.contribute_sql[SQLContribute.SUBQUERY.value] = (rng.choice(ITEMS), rng.choice(ITEMS))
+    elif kind < 0.5:
+        node.contribute_sql[SQLContribute.UNION_QUERY.value] = pick(3) or ('u',)
+    return node
+
+
+class RenderSqlTest(unittest.TestCase):
+
+    def test_matches_legacy_concatenation(self):
+        rng = random.Random(10)
+        for _ in range(5000):
+            node = random_node(rng)
+            expected = legacy_sql(node)
+            self.assertEqual(render_sql(node), expected)
+            self.assertEqual(generate_sql(node), expected)
+            self.assertIs(generate_sql(node), node.sql_fragment)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from utils.structure import ClauseArray, ViewSummary, SQLContribute, EMPTY_CLAUSE_SET
+from utils.subsume_utils import SubsumptionIndex, STRUCTURE_CLAUSES, iter_bits
+
+SELECT = SQLContribute.SELECT.value
+WHERE = SQLContribute.WHERE.value
+GROUP_BY = SQLContribute.GROUP_BY.value
+FROM = SQLContribute.FROM.value
+
+
+def view(select, where=(), group_by=(), tables=('t1',)):
+    accumulated = ClauseArray(EMPTY_CLAUSE_SET)
+    accumulated[SELECT] = frozenset(select)
+    accumulated[WHERE] = frozenset(where)
+    accumulated[GROUP_BY] = frozenset(group_by)
+    accumulated[FROM] = frozenset(tables)
+    return ViewSummary(None, 'HashAggregate', '', ClauseArray(()), accumulated, None, None)
+
+
+def naive_subsumes(candidate, query):
+    # 逐个视图按定义判断
+    view_clauses, query_clauses = candidate.accumulate_contribute, query.accumulate_contribute
+    if any(view_clauses[clause.value] != query_clauses[clause.value] for clause in STRUCTURE_CLAUSES):
+        return False
+    if not query_clauses[SELECT] <= view_clauses[SELECT]:
+        return False
+    if view_clauses[GROUP_BY] and not (query_clauses[GROUP_BY] and query_clauses[GROUP_BY] <= view_clauses[GROUP_BY]):
+        return False
+    return view_clauses[WHERE] <= query_clauses[WHERE]
+
+
+class SubsumptionIndexTest(unittest.TestCase):
+
+    def test_matches_naive_inclusion(self):
+        rand = random.Random(5)
+
+        def random_view():
+            return view(rand.sample('abcdef', rand.randint(1, 4)),
+                        rand.sample(['x > 1', 'y = 2', 'z'], rand.randint(0, 2)),
+                        rand.sample('abc', rand.randint(0, 2)), rand.choice([('t1',), ('t2',), ('t1', 't2')]))
+
+        views = [random_view() for _ in range(80)]
+        queries = views + [random_view() for _ in range(80)]
+        index = SubsumptionIndex()
+        index.add_all(views)
+        matches = 0
+        for query in queries:
+            expected = [i for i, candidate in enumerate(views) if naive_subsumes(candidate, query)]
+            self.assertEqual(sorted(index.subsumers(query)), expected)
+            matches += len(expected)
+        # 每个视图至少包含自身，还要有足够多的其他包含关系
+        self.assertGreater(matches, 2 * len(views))
+
+    def test_coverage(self):
+        views = [view('ab'), view('a'), view('ab', group_by='a'), view('ab', where=['x > 1']),
+                 view('ab', tables=['t2'])]
+        index = SubsumptionIndex()
+        index.add_all(views)
+        self.assertEqual(index.subsumers(view('a', where=['x > 1'])), [0, 1, 3])
+        self.assertEqual(index.subsumers(view('b', group_by='a')), [0, 2])
+        self.assertEqual(index.coverage([(views[1], 2), (views[2], 3)]), [5, 2, 3, 0, 0])
+        self.assertEqual(index.rank([(views[1], 2), (views[2], 3)])[0], (views[0], 5))
+
+    def test_iter_bits(self):
+        self.assertEqual(list(iter_bits(0b101001)), [0, 3, 5])
+        self.assertEqual(list(iter_bits(0)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,82 @@
+import functools
+import hashlib
+import io
 import json
 import subprocess
 import re
+import tempfile
 import time
+from collections import deque
 
-from utils.structure import PhysicalPlanNode, MetricNode, Attribute, SQLContribute
+from utils.metrics_utils import logger, timed, count, warn, unsupported
+from utils.structure import PhysicalPlanNode, MetricNode, PlanContext, Attribute, SQLContribute, ClauseArray, \
+    EMPTY_CLAUSE_SET, ViewSummary, intern_value
 
 SECONDS_PER_MINUTE = 60
 
+# 文本扫描用到的正则，统一预编译，配合finditer/sub单次扫描
+EDGE_PATTERN = re.compile(r"(\d+)->(\d+)")
+EXPR_ID_PATTERN = re.compile(r'#\d+L*')
+KEY_VALUE_PATTERN = re.compile(r"\w+=\[.*?]")
+FILE_SCAN_PATTERN = re.compile(r"FileScan .+\[.*?] ")
+FILE_SCAN_FIELD_PATTERN = re.compile(r"\w+: ")
 
-def get_spark_logs_name(start_time='1940-01-01 00:00', end_time='2500-01-01 00:00',
-                        spark_history_path='/spark2-history'):
+
+def filter_spark_logs(entries, start_time='1940-01-01 00:00', end_time='2500-01-01 00:00'):
     """
-    获取spark日志
+    按修改时间过滤日志，去掉未完成和local模式的日志；修改时间是定长的本地时间字符串，
+    直接按字符串比较，不需要逐条解析
+    :param entries: (日志名, 大小, 修改时间)迭代器
     :param start_time: 日志开始时间段
     :param end_time: 日志结束时间段
-    :param spark_history_path: spark日志存储路径
-    :return:
+    :return: (日志名, 大小, 修改时间)迭代器
+    """
+    lower = minute_str(time_str_to_int(start_time) - SECONDS_PER_MINUTE)
+    upper = minute_str(time_str_to_int(end_time) + SECONDS_PER_MINUTE)
+    for log_name, size, mtime in entries:
+        if lower < mtime < upper and 'inprogress' not in log_name and 'local' not in log_name:
+            yield log_name, size, mtime
+
+
+def parse_ls_line(line):
+    """
+    :param line: hdfs dfs -ls的一行输出：权限 副本数 用户 用户组 大小 日期 时间 路径
+    :return: (文件名, 大小, 修改时间)，不是文件行（例如Found n items）时返回None
+    """
+    parts = line.split(None, 7)
+    if len(parts) < 8 or not parts[4].isdigit():
+        return None
+    return parts[7].rstrip('\n').split('/')[-1], int(parts[4]), parts[5] + ' ' + parts[6]
+
+
+def iter_ls_entries(path, start_after=None):
+    """
+    流式读取hdfs dfs -ls的输出，输出按文件名排序
+    :param path:
+    :param start_after: 只返回文件名大于该值的文件，hdfs dfs -ls不支持分页，仍需列出整个目录
+    :return: (文件名, 大小, 修改时间)迭代器
+    """
+    for line in iter_cmd_lines(['hdfs', 'dfs', '-ls', path]):
+        entry = parse_ls_line(line)
+        if entry is not None and (start_after is None or entry[0] > start_after):
+            yield entry
+
+
+def iter_cmd_lines(command_list):
+    """
+    在系统上运行shell指令，逐行返回输出，不缓存全部输出
+    :param command_list: 指令列表
+    :return: 输出行迭代器，指令失败时在最后抛出OSError
     """
-    (ret, logs_name, err) = run_cmd(['hdfs', 'dfs', '-ls', spark_history_path])
-    start_time = time_str_to_int(start_time) - SECONDS_PER_MINUTE
-    end_time = time_str_to_int(end_time) + SECONDS_PER_MINUTE
-    yarn_logs = []
-    assert ret == 0
-    for item in logs_name[1:]:
-        log_path = item.split(' ')[-1]
-        log_name = log_path.split('/')[-1]
-        match = re.search(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}', item)
-        if match and 'inprogress' not in log_path and 'local' not in log_path:
-            cur_time = time_str_to_int(match.group())
-            if start_time < cur_time < end_time:
-                yarn_logs.append(log_name)
-    return yarn_logs
+    logger.info('Running system command: %s', ' '.join(command_list))
+    # 错误输出写到临时文件，避免管道写满阻塞子进程
+    with tempfile.TemporaryFile() as err, \
+            subprocess.Popen(command_list, stdout=subprocess.PIPE, stderr=err) as proc:
+        for line in io.TextIOWrapper(proc.stdout, encoding='utf-8'):
+            yield line
+        if proc.wait() != 0:
+            err.seek(0)
+            raise OSError(f"{' '.join(command_list)} failed: {err.read().decode('utf-8', 'replace').strip()}")
 
 
 def run_cmd(command_list):
@@ -39,7 +85,7 @@ def run_cmd(command_list):
     :param command_list: 指令列表
     :return:返回值、输出、错误输出
     """
-    print('Running system command: {0}'.format(' '.join(command_list)))
+    logger.info('Running system command: %s', ' '.join(command_list))
     proc = subprocess.Popen(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     out, err = proc.communicate()
     ret = proc.returncode
@@ -57,20 +103,165 @@ def time_str_to_int(time_str, ft='%Y-%m-%d %H:%M'):
     return int(time.mktime(time.strptime(time_str, ft)))
 
 
-def get_history_json(history_json_path):
+def minute_str(timestamp):
+    """
+    时间戳转为hdfs dfs -ls格式的本地时间字符串，精确到分钟，同一分钟的结果缓存
+    :param timestamp: 秒
+    :return: 例如：1940-01-01 00:00
+    """
+    return _minute_str(int(timestamp) // SECONDS_PER_MINUTE)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _minute_str(minute):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(minute * SECONDS_PER_MINUTE))
+
+
+def history_entry_fields(entry):
+    """
+    :param entry: history json中的一条sql
+    :return: 原始sql、node metrics、physical plan、dot metrics、物化视图
+    """
+    return entry.get('original query', ''), entry.get('node metrics', ''), entry.get('physical plan', ''), \
+        entry.get('dot metrics', ''), entry.get('materialized views', '')
+
+
+HISTORY_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_history_entries(stream, chunk_size=1 << 20):
+    """
+    流式解析history json，一个执行计划中每一条sql会被解析为json数组中的一项，逐项返回；
+    内存占用只和单项大小有关，和文件大小无关
+    :param stream: 文本流（有read方法）或字符串
+    :param chunk_size: 每次读取的字符数
+    :return: 每条sql对应的字典
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    read_size = chunk_size
+    while True:
+        pos = HISTORY_SEPARATORS.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                return
+            buf = stream.read(read_size)
+            pos = 0
+            eof = buf == ''
+            continue
+        # 数组的开始和结束，兼容多个数组首尾相接的情况
+        if buf[pos] == '[' or buf[pos] == ']':
+            pos += 1
+            continue
+        try:
+            entry, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # 当前项不完整，继续读取；读取量随缓冲区翻倍，避免大项被反复解析
+            chunk = stream.read(max(read_size, len(buf) - pos))
+            eof = chunk == ''
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        pos = end
+        yield entry
+
+
+PLAN_FIELD_HEADER = re.compile(r"([A-Za-z]+( [A-Za-z]+)*) *(\[\d+])*:")
+# (字段前缀, 属性名, 处理函数)，按注册顺序做前缀匹配
+PLAN_FIELD_HANDLERS = []
+# 字段名到(属性名, 处理函数)的解析结果缓存，未考虑的字段缓存为None
+PLAN_FIELD_DISPATCH = {}
+
+
+def register_plan_field(prefix, attribute, handler):
+    """
+    注册physical plan节点详细信息中的字段，以prefix开头的字段交给handler处理
+    :param prefix: 字段前缀
+    :param attribute: 解析结果中的属性名
+    :param handler: 输入去掉字段头的内容，返回(值, 用于和metrics匹配的tag)
+    :return:
+    """
+    PLAN_FIELD_HANDLERS.append((prefix, attribute, handler))
+    PLAN_FIELD_DISPATCH.clear()
+
+
+def parse_list_field(body):
+    return parse_bracket_list(body), intern_value(canonicalize(body).replace(' ', ''))
+
+
+def parse_text_field(body):
+    value = intern_value(canonicalize(body))
+    return value, intern_value(value.replace(' ', ''))
+
+
+def parse_location_field(body):
+    value = intern_value(body.replace(' ', ''))
+    return value, value
+
+
+register_plan_field('Output', Attribute.OUTPUT.value, parse_list_field)
+register_plan_field('Input', Attribute.INPUT.value, parse_list_field)
+register_plan_field('Batched', Attribute.BATCHED.value, parse_text_field)
+# TODO[node structure]Arguments情况复杂，需要完善（当前策略就是不解析，后面和metrics做匹配也方便）
+register_plan_field('Arguments', Attribute.ARGUMENTS.value, parse_text_field)
+register_plan_field('Result', Attribute.RESULT.value, parse_list_field)
+register_plan_field('Aggregate Attributes', Attribute.AGGREGATE.value, parse_list_field)
+register_plan_field('Functions', Attribute.FUNCTION.value, parse_list_field)
+register_plan_field('Keys', Attribute.KEYS.value, parse_list_field)
+register_plan_field('Join condition', Attribute.JOIN_CONDITION.value, parse_list_field)
+register_plan_field('Left keys', Attribute.LEFT_KEYS.value, parse_list_field)
+register_plan_field('Right keys', Attribute.RIGHT_KEYS.value, parse_list_field)
+# TODO[node structure]
+register_plan_field('Condition', Attribute.CONDITION.value, parse_list_field)
+register_plan_field('ReadSchema', Attribute.READ_SCHEMA.value, parse_text_field)
+register_plan_field('PushedFilters', Attribute.PUSHED_FILTERS.value, parse_list_field)
+register_plan_field('Location', Attribute.LOCATION.value, parse_location_field)
+register_plan_field('PartitionFilters', Attribute.PARTITION_FILTERS.value, parse_list_field)
+
+
+def get_plan_field_handler(field):
     """
-    解析json获取spark任务信息，json的生成需要使用日志解析jar包（地址待补充）
-    :param history_json_path:
+    根据字段名找到处理函数，结果会被缓存，每种字段只做一次前缀匹配
+    :param field: 字段名，例如Output、Join condition
+    :return: (属性名, 处理函数)，未考虑的字段返回None
+    """
+    if field in PLAN_FIELD_DISPATCH:
+        return PLAN_FIELD_DISPATCH[field]
+    resolved = None
+    for prefix, attribute, handler in PLAN_FIELD_HANDLERS:
+        if field.startswith(prefix):
+            resolved = (attribute, handler)
+            break
+    PLAN_FIELD_DISPATCH[field] = resolved
+    return resolved
+
+
+def parse_physical_plan(node_structure):
+    """
+    解析 ·删掉physical_plan前面的树形图和后面的subgraph之后· 剩余的结构信息
+    :param node_structure:
     :return:
     """
-    (ret, out, err) = run_cmd(['hdfs', 'dfs', '-cat', history_json_path])
-    if ret != 0 or len(out) == 0 or out[0] == '[]':
-        return "", "", "", "", ""
-    jsons = json.loads(out[0])
-    # 一个执行计划中，每一条sql会被解析为一个json，这里默认一个任务中只有一条sql
-    first_json = jsons[0]
-    return first_json['original query'], first_json['node metrics'], first_json['physical plan'], \
-        first_json['dot metrics'], first_json['materialized views']
+    parameter = {}
+    parameter_tag = {}
+    for line in node_structure:
+        head = PLAN_FIELD_HEADER.match(line)
+        if head is None:
+            warn('field header', f"line:<{line}> Unable to extract field headers.")
+            continue
+        resolved = get_plan_field_handler(head.group(1))
+        if resolved is None:
+            unsupported('field', head.group(1), f"line:<{line}> Unconsidered field header.")
+            continue
+        attribute, handler = resolved
+        parameter[attribute], parameter_tag[attribute] = handler(line[head.end():])
+    return parameter, parameter_tag
 
 
 def get_node_structure(physical_plan):
@@ -82,79 +273,6 @@ def get_node_structure(physical_plan):
     :param physical_plan:
     :return:
     """
-
-    def parse_physical_plan(node_structure):
-        """
-        解析 ·删掉physical_plan前面的树形图和后面的subgraph之后· 剩余的结构信息
-        :param node_structure:
-        :return:
-        """
-        parameter = {}
-        parameter_tag = {}
-        for line in node_structure:
-            # line = str(len)
-            head = re.match(r"([A-Za-z]+( [A-Za-z]+)*) *(\[\d+])*:", line)
-            if head is None:
-                print_err_info(f"line:<{line}> Unable to extract field headers. ")
-                continue
-            head = head.group()
-            if line.startswith('Output'):
-                parameter[Attribute.OUTPUT.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.OUTPUT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Input'):
-                parameter[Attribute.INPUT.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.INPUT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Batched'):
-                parameter[Attribute.BATCHED.value] = canonicalize(line.replace(head, ''))
-                parameter_tag[Attribute.BATCHED.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Arguments'):
-                # TODO[node structure]情况复杂，需要完善（当前策略就是不解析，后面和metrics做匹配也方便）
-                parameter[Attribute.ARGUMENTS.value] = canonicalize(line.replace(head, ''))
-                parameter_tag[Attribute.ARGUMENTS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Result'):
-                parameter[Attribute.RESULT.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.RESULT.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Aggregate Attributes'):
-                parameter[Attribute.AGGREGATE.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.AGGREGATE.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Functions'):
-                parameter[Attribute.FUNCTION.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.FUNCTION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Keys'):
-                parameter[Attribute.KEYS.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Join condition'):
-                parameter[Attribute.JOIN_CONDITION.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.JOIN_CONDITION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Left keys'):
-                parameter[Attribute.LEFT_KEYS.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.LEFT_KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Right keys'):
-                parameter[Attribute.RIGHT_KEYS.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.RIGHT_KEYS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Condition'):
-                # TODO[node structure]
-                parameter[Attribute.CONDITION.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.CONDITION.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('ReadSchema'):
-                parameter[Attribute.READ_SCHEMA.value] = canonicalize(line.replace(head, ''))
-                parameter_tag[Attribute.READ_SCHEMA.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('PushedFilters'):
-                parameter[Attribute.PUSHED_FILTERS.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.PUSHED_FILTERS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            elif line.startswith('Location'):
-                # parameter[Attribute.LOCATION.value] = line.replace(head, '').split(' ')[2].strip('[').strip(']')
-                # tmp = line.replace(head, '').split(' ')
-                parameter[Attribute.LOCATION.value] = line.replace(head, '').replace(' ', '')
-                parameter_tag[Attribute.LOCATION.value] = line.replace(head, '').replace(' ', '').replace(' ', '')
-            elif line.startswith('PartitionFilters'):
-                parameter[Attribute.PARTITION_FILTERS.value] = parse_bracket_list(line.replace(head, ''))
-                parameter_tag[Attribute.PARTITION_FILTERS.value] = canonicalize(line.replace(head, '')).replace(' ', '')
-            else:
-                print_err_info(f"line:<{line}> Unconsidered field header.")
-                continue
-        return parameter, parameter_tag
-
     # remove physical tree
     contexts = physical_plan[physical_plan.find('\n(1)') + 1:].strip('\n')
     # remove Subqueries
@@ -176,10 +294,11 @@ def get_node_structure(physical_plan):
     return nodes
 
 
-def get_node_metrics(metrics_nodes):
+def get_node_metrics(metrics_nodes, context):
     """
     解析node_metrics文件，树节点关系、子图关系、以及运行代价信息
     :param metrics_nodes:
+    :param context: 当前执行计划的PlanContext
     :return:
     """
     start_size = len("[PlanMetric]\n")
@@ -191,15 +310,16 @@ def get_node_metrics(metrics_nodes):
     edge = metrics_nodes[edge_tag.span()[0]:subgraph_tag.span()[0]]
     # TODO [subgraph]
     subgraph = metrics_nodes[subgraph_tag.span()[1]:]
-    metric_nodes = parse_metrics_text(metrics)
+    metric_nodes = parse_metrics_text(metrics, context)
     build_tree_with_edge_text(edge, metric_nodes)
     return metric_nodes
 
 
-def parse_metrics_text(metrics):
+def parse_metrics_text(metrics, context):
     """
     解析代价信息
     :param metrics:
+    :param context: 当前执行计划的PlanContext
     :return:
     """
     metric_nodes = {}
@@ -208,27 +328,30 @@ def parse_metrics_text(metrics):
         start_id = lines[0].find('id:')
         start_name = lines[0].find('name:')
         start_desc = lines[0].find('desc:')
-        nid = lines[0][start_id + len('id:'): start_name].strip()
-        name = lines[0][start_name + len('name:'): start_desc].strip()
+        nid = intern_value(lines[0][start_id + len('id:'): start_name].strip())
+        name = intern_value(lines[0][start_name + len('name:'): start_desc].strip())
         desc = lines[0][start_desc + len('desc:'):].strip()
         desc, desc_tag = parse_metric_desc(name, desc)
         if isinstance(desc_tag, str):
-            desc_tag = desc_tag.replace(' ', '')
+            desc = intern_value(desc)
+            desc_tag = intern_value(desc_tag.replace(' ', ''))
         else:
+            for key in desc.keys():
+                desc[key] = intern_value(desc[key])
             for key in desc_tag.keys():
-                desc_tag[key] = desc_tag[key].replace(' ', '')
+                desc_tag[key] = intern_value(desc_tag[key].replace(' ', ''))
         # TODO[后续处理时间信息]
-        info = lines[1:]
+        info = intern_value(lines[1:])
         ins_node = MetricNode(nid, name, desc, info, desc_tag)
         metric_nodes[nid] = ins_node
         if "WholeStageCodegen" in name or "Sort" == name or \
                 "SubqueryBroadcast" == name or "ReusedExchange" == name:
             continue
         # cache
-        if MetricNode.union_cache.get(name) is None:
-            MetricNode.union_cache[name] = [ins_node]
+        if context.union_cache.get(name) is None:
+            context.union_cache[name] = [ins_node]
         else:
-            MetricNode.union_cache.get(name).append(ins_node)
+            context.union_cache.get(name).append(ins_node)
     return metric_nodes
 
 
@@ -249,23 +372,14 @@ def parse_metric_desc(name, desc):
     para_tag = {}
     if "FileScan" in desc:
         # 处理file scan的情况
-        scan_tag = re.search(r"FileScan .+\[.*?] ", desc)
+        scan_tag = FILE_SCAN_PATTERN.search(desc)
         assert scan_tag is not None
-        para[Attribute.OUTPUT.value] = parse_bracket_list('[' + scan_tag.group().split('[')[1])
-        para_tag[Attribute.OUTPUT.value] = canonicalize('[' + scan_tag.group().split('[')[1])
-        desc = desc[scan_tag.span()[1]:]
-        front = re.search(r"\w+: ", desc)
-        while front is not None:
-            desc = desc[front.span()[1]:]
-            behind = re.search(r"\w+: ", desc)
-            if behind is not None:
-                para[canonicalize(front.group())] = canonicalize(desc[:behind.span()[0]])
-                para_tag[canonicalize(front.group())] = canonicalize(desc[:behind.span()[0]])
-                front = behind
-            else:
-                para[canonicalize(front.group())] = canonicalize(desc)
-                para_tag[canonicalize(front.group())] = canonicalize(desc)
-                break
+        output = '[' + scan_tag.group().split('[')[1]
+        para[Attribute.OUTPUT.value] = parse_bracket_list(output)
+        para_tag[Attribute.OUTPUT.value] = canonicalize(output)
+        for key, value in scan_fields(desc, FILE_SCAN_FIELD_PATTERN, scan_tag.end()):
+            para[canonicalize(key)] = canonicalize(value)
+            para_tag[canonicalize(key)] = canonicalize(value)
     elif "Filter" == name:
         para[Attribute.CONDITION.value] = canonicalize(desc.replace(name, ""))
         para_tag[Attribute.CONDITION.value] = canonicalize(desc.replace(name, ""))
@@ -302,76 +416,247 @@ def parse_metric_desc(name, desc):
             para[Attribute.JOIN_CONDITION.value] = has_condition.group()
             para_tag[Attribute.JOIN_CONDITION.value] = has_condition.group()
     elif "HashAggregate" == name or "TakeOrderedAndProject" == name:
-        key_value = re.search(r"\w+=\[.*?]", desc)
-        while key_value is not None:
-            key = get_attribute_enum(key_value.group().split('=')[0])
+        for key_value in KEY_VALUE_PATTERN.finditer(desc):
+            parts = key_value.group().split('=')
+            key = get_attribute_enum(parts[0])
             if key is not None:
-                value = parse_bracket_list(key_value.group().split('=')[1])
-                para[key.value] = value
-                para_tag[key.value] = canonicalize(key_value.group().split('=')[1])
-            desc = desc[key_value.span()[1]:]
-            key_value = re.search(r"\w+=\[.*?]", desc)
+                para[key.value] = parse_bracket_list(parts[1])
+                para_tag[key.value] = canonicalize(parts[1])
     else:
-        print_err_info(f"[metrics error] {name} is not considered.")
+        unsupported('metric', name, f"{name} is not considered.")
     return para, para_tag
 
 
-def complete_information(nodes):
+# 用于建立匹配索引的字段，两边的tag通常完全相同
+MATCH_INDEX_FIELDS = [Attribute.OUTPUT.value, Attribute.KEYS.value]
+
+
+def is_match(candidate_node, node):
     """
-    根据physical plan中的信息补全metrics节点
+    metrics节点和physical plan节点是否对应：两边都有的字段，metrics中的tag需要包含在physical plan的tag中
+    :param candidate_node: MetricNode
+    :param node: PhysicalPlanNode
+    :return:
+    """
+    if not isinstance(candidate_node.desc_tag, dict):
+        return True
+    for key, other in node.para_tag.items():
+        if key in candidate_node.desc_tag:
+            one = candidate_node.desc_tag.get(key)
+            if not (isinstance(one, str) and isinstance(other, str) and one in other):
+                return False
+    return True
+
+
+class MetricMatcher(object):
+    """
+    单个执行计划的metrics节点匹配索引，按 算子名+Output/Keys tag 分桶，匹配上的节点会被消耗，
+    桶内没有匹配时再退回到同名节点的顺序查找
+    """
+
+    def __init__(self, union_cache):
+        self.candidates = {name: deque(nodes) for name, nodes in union_cache.items()}
+        self.buckets = {}
+        self.consumed = set()
+        for name, nodes in union_cache.items():
+            for candidate_node in nodes:
+                if not isinstance(candidate_node.desc_tag, dict):
+                    continue
+                for field in MATCH_INDEX_FIELDS:
+                    tag = candidate_node.desc_tag.get(field)
+                    if isinstance(tag, str):
+                        self.buckets.setdefault((name, field, tag), deque()).append(candidate_node)
+
+    def has_candidates(self, name):
+        return name in self.candidates
+
+    def _take(self, candidates, node):
+        # 先丢掉队首已被消耗的节点，保证常见情况下是O(1)
+        while candidates and id(candidates[0]) in self.consumed:
+            candidates.popleft()
+        for candidate_node in candidates:
+            if id(candidate_node) not in self.consumed and is_match(candidate_node, node):
+                self.consumed.add(id(candidate_node))
+                return candidate_node
+        return None
+
+    def match(self, node):
+        """
+        为physical plan节点找到对应的metrics节点并消耗掉
+        :param node: PhysicalPlanNode
+        :return: MetricNode，没有匹配时返回None
+        """
+        for field in MATCH_INDEX_FIELDS:
+            tag = node.para_tag.get(field)
+            if tag is None:
+                continue
+            bucket = self.buckets.get((node.name, field, tag))
+            if bucket:
+                candidate_node = self._take(bucket, node)
+                if candidate_node is not None:
+                    return candidate_node
+        candidates = self.candidates.get(node.name)
+        if candidates is None:
+            return None
+        return self._take(candidates, node)
+
+
+def complete_information(nodes, context):
+    """
+    根据physical plan中的信息补全metrics节点，匹配完成后释放索引
     :param nodes:
+    :param context: 当前执行计划的PlanContext
     :return:
     """
-    num = 0
+    matcher = MetricMatcher(context.union_cache)
+    matched = 0
+    unmatched = 0
     for node in nodes:
-        num += 1
-        toDels = []
-        find = False
-        candidates_node = MetricNode.union_cache.get(node.name)
-        if candidates_node is None:
+        if not matcher.has_candidates(node.name):
             continue
-        for candidate_node in candidates_node:
-            if find:
+        candidate_node = matcher.match(node)
+        if candidate_node is not None:
+            candidate_node.desc = {**candidate_node.desc, **node.para}
+            matched += 1
+        else:
+            unmatched += 1
+    count('metric_nodes_matched', matched)
+    count('metric_nodes_unmatched', unmatched)
+    # union_cache只用于匹配
+    context.union_cache = {}
+
+
+def plan_post_order(root, context):
+    """
+    迭代计算执行计划图的后序遍历，子节点在父节点之前，被多个父节点共享的节点只出现一次；
+    结果缓存在context中，多次遍历共用
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return: MetricNode列表
+    """
+    order = context.post_orders.get(root.nid)
+    if order is not None:
+        return order
+    order = []
+    visited = {root.nid}
+    stack = [(root, iter(root.children_node))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if child not in visited:
+                visited.add(child)
+                child_node = context.node_cache.get(child)
+                stack.append((child_node, iter(child_node.children_node)))
                 break
-            match = True
-            for key in node.para_tag.keys():
-                if candidate_node.desc_tag.__contains__(key):
-                    one = candidate_node.desc_tag.get(key)
-                    other = node.para_tag.get(key)
-                    if not (isinstance(one, str) and isinstance(other, str) and one in other):
-                        match = False
-                        break
-            if match:
-                candidate_node.desc = {**candidate_node.desc, **node.para}
-                toDels.append(candidate_node)
-                find = True
-                print("[" + str(num) + "]matched: " + node.name)
-            else:
-                print("[" + str(num) + "]Not matched: " + node.name)
+        else:
+            stack.pop()
+            order.append(node)
+    context.post_orders[root.nid] = order
+    return order
+
+
+# contribute_node_sql读取的描述字段，子树指纹只包含这些字段
+FINGERPRINT_FIELDS = [Attribute.OUTPUT.value, Attribute.CONDITION.value, Attribute.JOIN_TYPE.value,
+                      Attribute.LEFT_KEYS.value, Attribute.RIGHT_KEYS.value, Attribute.JOIN_CONDITION.value,
+                      Attribute.KEYS.value, Attribute.RESULT.value, Attribute.ORDER_BY.value]
+
 
+def contribute_sql(root, context):
+    """
+    自底向上计算每个节点对sql的贡献
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    memo = context.memo
+    if memo is not None:
+        subtree_fingerprints(root, context)
+    for node in plan_post_order(root, context):
+        if memo is not None:
+            entry = memo.get(context.fingerprints[node.nid], context.raw_fingerprints[node.nid])
+            if entry is not None:
+                # 复用其他日志中表达式编号也相同的子树的结果，contribute_sql复制一份，避免修改缓存中的数组
+                node.contribute_sql = entry.contribute_sql.copy()
+                node.sql_fragment = entry.sql_fragment
+                continue
+        contribute_node_sql(node, context)
+
+
+def subtree_fingerprints(root, context):
+    """
+    自底向上计算每个子树的Merkle指纹：节点名、contribute_node_sql用到的描述字段和子节点指纹依次哈希；
+    context.fingerprints去掉表达式编号，用于复用累计结果，context.raw_fingerprints保留编号，
+    用于复用带编号的contribute_sql和sql片段；子查询编号只在渲染时生成，不影响sql片段，不参与指纹
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return: nid到去掉编号的指纹的字典
+    """
+    fingerprints = context.fingerprints
+    raw_fingerprints = context.raw_fingerprints
+    for node in plan_post_order(root, context):
+        digest = hashlib.sha1(node.name.encode('utf-8'))
+        raw_digest = digest.copy()
+        if isinstance(node.desc, dict):
+            for field in FINGERPRINT_FIELDS:
+                value = node.desc.get(field)
+                if value is None:
+                    continue
+                header = b'\x1e' + field.encode('utf-8') + b'\x1d'
+                digest.update(header)
+                raw_digest.update(header)
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    item = str(item)
+                    digest.update(strip_number(item, context).encode('utf-8') + b'\x1f')
+                    raw_digest.update(item.encode('utf-8') + b'\x1f')
+        digest.update(b'\x1c')
+        raw_digest.update(b'\x1c')
+        for child in node.children_node:
+            digest.update(fingerprints[child])
+            raw_digest.update(raw_fingerprints[child])
+        fingerprints[node.nid] = digest.digest()
+        raw_fingerprints[node.nid] = raw_digest.digest()
+    return fingerprints
+
+
+def remember_subtrees(root, context):
+    """
+    将本执行计划中每个子树的结果记入跨日志的子树缓存
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    for node in plan_post_order(root, context):
+        context.memo.store(context.fingerprints[node.nid], context.raw_fingerprints[node.nid], node,
+                           node.nid in context.accumulated)
 
-def contribute_sql(root):
+
+def contribute_node_sql(root, context):
+    """
+    计算单个节点对sql的贡献，子节点需要已经计算完成
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
     children = root.children_node
-    for child in children:
-        contribute_sql(MetricNode.node_cache.get(child))
 
-    # copy child contribute_sql
+    # 与第一个子节点共享各子句的元组，下面修改时总是生成新元组
     if isinstance(children, list) and len(children) > 0:
-        child_ctr = MetricNode.node_cache.get(children[0]).contribute_sql
-        for key in child_ctr.keys():
-            root.contribute_sql[key] = child_ctr[key].copy()
+        root.contribute_sql = context.node_cache.get(children[0]).contribute_sql.copy()
+    contribute = root.contribute_sql
 
     if "Scan" in root.name:
         output = root.desc.get(Attribute.OUTPUT.value)
         if isinstance(output, str):
             output = [output]
-        table = root.name.split(' ')[2]
-        if isinstance(table, str):
-            table = [table]
+        # Scan parquet db.table取表名；LocalTableScan、Scan OneRowRelation等没有表名，用最后一段代替
+        parts = root.name.split(' ')
+        table = intern_value(parts[2] if len(parts) > 2 else parts[-1])
 
         if output is not None:
-            root.contribute_sql[SQLContribute.SELECT.value] += output
-        root.contribute_sql[SQLContribute.FROM.value] += table
+            contribute[SQLContribute.SELECT.value] = contribute[SQLContribute.SELECT.value] + tuple(output)
+        contribute[SQLContribute.FROM.value] = contribute[SQLContribute.FROM.value] + (table,)
         # TODO Partition Filter 和 Pushed Filter待解析
     elif "Filter" == root.name:
         condition = root.desc.get(Attribute.CONDITION.value)
@@ -379,14 +664,14 @@ def contribute_sql(root):
             condition = [condition]
 
         if condition is not None:
-            root.contribute_sql[SQLContribute.WHERE.value] += condition
+            contribute[SQLContribute.WHERE.value] = contribute[SQLContribute.WHERE.value] + tuple(condition)
     elif "Project" == root.name:
         output = root.desc.get(Attribute.OUTPUT.value)
         if isinstance(output, str):
             output = [output]
 
         if output is not None:
-            root.contribute_sql[SQLContribute.SELECT.value] = output
+            contribute[SQLContribute.SELECT.value] = tuple(output)
     elif "SortMergeJoin" == root.name or "BroadcastHashJoin" == root.name:
         join_type = root.desc.get(Attribute.JOIN_TYPE.value)
         left_keys = root.desc.get(Attribute.LEFT_KEYS.value)
@@ -403,12 +688,11 @@ def contribute_sql(root):
         if join_condition is not None:
             conditions.append(join_condition)
 
-        root.contribute_sql[SQLContribute.JOIN_TYPE.value] = [join_type]
-        root.contribute_sql[SQLContribute.JOIN_CONDITION.value] = conditions
-        root.contribute_sql[SQLContribute.SUBQUERY.value].append(
-            generate_sql(MetricNode.node_cache.get(root.children_node[0])))
-        root.contribute_sql[SQLContribute.SUBQUERY.value].append(
-            generate_sql(MetricNode.node_cache.get(root.children_node[1])))
+        contribute[SQLContribute.JOIN_TYPE.value] = (join_type,)
+        contribute[SQLContribute.JOIN_CONDITION.value] = tuple(intern_value(conditions))
+        contribute[SQLContribute.SUBQUERY.value] = contribute[SQLContribute.SUBQUERY.value] + (
+            generate_sql(context.node_cache.get(root.children_node[0]), context),
+            generate_sql(context.node_cache.get(root.children_node[1]), context))
     elif "HashAggregate" == root.name:
         keys = root.desc.get(Attribute.KEYS.value)
         if isinstance(keys, str):
@@ -418,9 +702,9 @@ def contribute_sql(root):
             result = [result]
 
         if keys is not None:
-            root.contribute_sql[SQLContribute.GROUP_BY.value] = keys
+            contribute[SQLContribute.GROUP_BY.value] = tuple(keys)
         if result is not None:
-            root.contribute_sql[SQLContribute.SELECT.value] = result
+            contribute[SQLContribute.SELECT.value] = tuple(result)
     elif "TakeOrderedAndProject" == root.name:
         output = root.desc.get(Attribute.OUTPUT.value)
         if isinstance(output, str):
@@ -430,130 +714,197 @@ def contribute_sql(root):
             order_by = [order_by]
 
         if output is not None:
-            root.contribute_sql[SQLContribute.SELECT.value] = output
+            contribute[SQLContribute.SELECT.value] = tuple(output)
         if order_by is not None:
-            root.contribute_sql[SQLContribute.ORDER_BY.value] = order_by
+            contribute[SQLContribute.ORDER_BY.value] = tuple(order_by)
     elif "Union" == root.name:
         # TODO Union
-        for child in root.children_node:
-            root.contribute_sql[SQLContribute.UNION_QUERY.value].append(generate_sql(MetricNode.node_cache.get(child)))
-    else:
-        print_err_info(f"[node ignore] {root.name} can not be deal.")
-
-
-def accumulate_all(root):
-    def accumulate(target, src):
-        target[SQLContribute.SELECT.value] += remove_list_number(src[SQLContribute.SELECT.value])
-        target[SQLContribute.FROM.value] += remove_list_number(src[SQLContribute.FROM.value])
-        target[SQLContribute.WHERE.value] += remove_list_number(src[SQLContribute.WHERE.value])
-        target[SQLContribute.GROUP_BY.value] += remove_list_number(src[SQLContribute.GROUP_BY.value])
-        target[SQLContribute.ORDER_BY.value] += remove_list_number(src[SQLContribute.ORDER_BY.value])
-        target[SQLContribute.JOIN_TYPE.value] += remove_list_number(src[SQLContribute.JOIN_TYPE.value])
-        target[SQLContribute.JOIN_CONDITION.value] += remove_list_number(src[SQLContribute.JOIN_CONDITION.value])
-
-    accumulate(root.accumulate_contribute, root.contribute_sql)
-    if len(root.children_node) == 0:
-        return root.accumulate_contribute
-
-    if 'Join' in root.name:
-        for child in root.children_node:
-            accumulate(root.accumulate_contribute, accumulate_all(MetricNode.node_cache.get(child)))
-    elif 'Union' in root.name:
-        for child in root.children_node:
-            accumulate(root.accumulate_contribute, accumulate_all(MetricNode.node_cache.get(child)))
+        contribute[SQLContribute.UNION_QUERY.value] = contribute[SQLContribute.UNION_QUERY.value] + tuple(
+            generate_sql(context.node_cache.get(child), context) for child in root.children_node)
     else:
-        accumulate(root.accumulate_contribute, accumulate_all(MetricNode.node_cache.get(root.children_node[0])))
+        unsupported('operator', root.name, f"{root.name} can not be deal.")
+
+
+def accumulate_children(node):
+    """
+    累计时需要合并的子节点：join和union合并所有子节点，其余只合并第一个子节点
+    :param node:
+    :return:
+    """
+    if len(node.children_node) == 0:
+        return []
+    if 'Join' in node.name or 'Union' in node.name:
+        return node.children_node
+    return node.children_node[:1]
+
+
+# accumulate_contribute中累计的子句
+ACCUMULATE_CLAUSES = [SQLContribute.SELECT.value, SQLContribute.FROM.value, SQLContribute.WHERE.value,
+                      SQLContribute.GROUP_BY.value, SQLContribute.ORDER_BY.value, SQLContribute.JOIN_TYPE.value,
+                      SQLContribute.JOIN_CONDITION.value]
+
+
+def strip_number(item, context):
+    """
+    去掉单个表达式中的编号，同一个执行计划中每个字符串只处理一次
+    :param item:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    value = context.stripped.get(item)
+    if value is None:
+        value = context.stripped[item] = intern_value(remove_str_number(item))
+    return value
+
+
+def strip_numbers(items, context):
+    """
+    去掉一组表达式中的编号并去重
+    :param items: 字符串列表
+    :param context: 当前执行计划的PlanContext
+    :return: frozenset
+    """
+    if len(items) == 0:
+        return EMPTY_CLAUSE_SET
+    return frozenset([strip_number(item, context) for item in items])
+
+
+def accumulate_all(root, context):
+    """
+    自底向上累计每个节点及其子树的sql贡献；累计结果是去重后的frozenset，
+    与子节点结果相同时直接共享子节点的集合，相同的集合在执行计划内只保留一份
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return: 根节点的累计结果
+    """
+    order = plan_post_order(root, context)
+    # 逆后序中父节点在子节点之前，先标记出需要累计的节点
+    reached = {root.nid}
+    for node in reversed(order):
+        if node.nid in reached:
+            reached.update(accumulate_children(node))
+    context.accumulated = reached
+    interned = context.interned_sets
+    memo = context.memo
+    for node in order:
+        if node.nid not in reached:
+            continue
+        if memo is not None:
+            entry = memo.get(context.fingerprints[node.nid])
+            if entry is not None and entry.accumulate_contribute is not None:
+                node.accumulate_contribute = entry.accumulate_contribute
+                continue
+        children = [context.node_cache.get(child).accumulate_contribute for child in accumulate_children(node)]
+        accumulated = ClauseArray(EMPTY_CLAUSE_SET)
+        for clause in ACCUMULATE_CLAUSES:
+            values = strip_numbers(node.contribute_sql[clause], context)
+            for child in children:
+                child_values = child[clause]
+                if values <= child_values:
+                    values = child_values
+                elif not child_values <= values:
+                    values = values | child_values
+            accumulated[clause] = interned.setdefault(values, values)
+        node.accumulate_contribute = accumulated
     return root.accumulate_contribute
 
 
-def fill_sql(candidate_views):
+def fill_sql(candidate_views, context):
     """
     给候选视图node节点填充sql字符串
+    :param candidate_views:
+    :param context: 当前执行计划的PlanContext
     :return: 某个sql的所有候选sql
     """
 
     sqls = []
     for candidate_view in candidate_views:
-        gen_sql = generate_sql(candidate_view)
+        gen_sql = generate_sql(candidate_view, context)
         candidate_view.sql = remove_str_number(gen_sql)
         sqls.append(gen_sql)
     return sqls
 
 
+def summarize_view(view, source=None, index=None):
+    """
+    将填充过sql的候选视图精简为不可变摘要，摘要不引用节点图，日志处理完后整个节点图即可释放
+    :param view: 候选视图节点
+    :param source: 来源日志路径
+    :param index: 来源日志中的sql序号
+    :return: ViewSummary
+    """
+    return ViewSummary(view.nid, view.name, view.sql, view.contribute_sql, view.accumulate_contribute,
+                       source, index)
+
+
 def remove_str_number(sql):
-    res = re.search(r'#\d+L*', sql)
-    while res is not None:
-        sql = sql.replace(res.group(), '')
-        res = re.search(r'#\d+L*', sql)
-    return sql
-
-
-def remove_list_number(l):
-    if isinstance(l, list):
-        for i in range(len(l)):
-            l[i] = remove_str_number(l[i])
-    return l
-
-
-def generate_sql(node):
-    def general(node, sql):
-        # Where
-        where = node.contribute_sql[SQLContribute.WHERE.value]
-        if len(where) > 0:
-            sql += "Where "
-            for w in where:
-                sql += w + ' and '
-            sql = canonicalize(sql) + ' '
-
-        # group by
-        group_by = node.contribute_sql[SQLContribute.GROUP_BY.value]
-        if len(group_by) > 0:
-            sql += "Group by "
-            for g in group_by:
-                sql += g + ', '
-            sql = canonicalize(sql) + ' '
-
-        # order by
-        order_by = node.contribute_sql[SQLContribute.ORDER_BY.value]
-        if len(order_by) > 0:
-            sql += "Order by "
-            for o in order_by:
-                sql += o + ', '
-            sql = canonicalize(sql)
-        return canonicalize(sql)
-
-    if len(node.contribute_sql[SQLContribute.UNION_QUERY.value]) != 0:
+    """
+    去掉表达式编号，例如a#12L中的#12L
+    :param sql:
+    :return:
+    """
+    return EXPR_ID_PATTERN.sub('', sql)
+
+
+def generate_sql(node, context=None):
+    """
+    根据节点的contribute_sql生成sql，结果缓存在节点上，同一个节点只渲染一次；
+    渲染后节点的contribute_sql不再修改，合并视图时用render_sql按合并后的子句重新拼接
+    :param node:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    if node.sql_fragment is None:
+        node.sql_fragment = render_sql(node, context)
+    return node.sql_fragment
+
+
+def render_clause(keyword, items, sep):
+    """
+    拼接一个子句，每一项后面跟一个分隔符，再去掉末尾多余的分隔符
+    :param keyword: 子句关键字，例如Where
+    :param items:
+    :param sep: 分隔符，例如 and
+    :return:
+    """
+    return canonicalize(keyword + sep.join(items) + sep)
+
+
+def render_sql(node, context=None):
+    """
+    不使用缓存，根据节点的contribute_sql拼接sql
+    :param node:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    contribute = node.contribute_sql
+    union_query = contribute[SQLContribute.UNION_QUERY.value]
+    if len(union_query) != 0:
         # Union 拼接
-        sql = node.contribute_sql[SQLContribute.UNION_QUERY.value][0]
-        for index in range(1, len(node.contribute_sql[SQLContribute.UNION_QUERY.value])):
-            sql += ' Union ' + node.contribute_sql[SQLContribute.UNION_QUERY.value][index]
-        return sql
-    elif len(node.contribute_sql[SQLContribute.SUBQUERY.value]) == 0:
-        # 除了join的情况拼接
-        # Select
-        sql = "SELECT "
-        select = node.contribute_sql[SQLContribute.SELECT.value]
-        if len(select) != 0:
-            for sel in select:
-                sql += sel + ", "
-        else:
-            sql += "*"
-        sql = canonicalize(sql) + ' '
+        return ' Union '.join(union_query)
 
+    parts = []
+    # Select
+    select = contribute[SQLContribute.SELECT.value]
+    if len(select) != 0:
+        parts.append(render_clause("SELECT ", select, ", ") + ' ')
+    else:
+        parts.append("SELECT * ")
+
+    subquery = contribute[SQLContribute.SUBQUERY.value]
+    if len(subquery) == 0:
+        # 除了join的情况拼接
         # From
-        fromm = node.contribute_sql[SQLContribute.FROM.value]
-        sql += "FROM "
+        fromm = contribute[SQLContribute.FROM.value]
         assert len(fromm) > 0
-        for fro in fromm:
-            sql += fro + ', '
-        sql = canonicalize(sql) + ' '
-        return general(node, sql)
+        parts.append(render_clause("FROM ", fromm, ", ") + ' ')
     else:
         # join场景拼接
-        left_table = 'sub' + str(accumulator(MetricNode))
-        right_table = 'sub' + str(accumulator(MetricNode))
-        join_condition = node.contribute_sql[SQLContribute.JOIN_CONDITION.value]
-        join_type = node.contribute_sql[SQLContribute.JOIN_TYPE.value][0]
+        # 子查询命名计数属于单个执行计划，合并不同日志的视图时不需要context
+        if context is not None:
+            left_table = 'sub' + str(accumulator(context))
+            right_table = 'sub' + str(accumulator(context))
+        join_type = contribute[SQLContribute.JOIN_TYPE.value][0]
         if 'Inner' in join_type:
             join_type = 'JOIN'
         elif 'LeftOuter' in join_type:
@@ -565,44 +916,85 @@ def generate_sql(node):
         elif 'FullOuter' in join_type:
             join_type = 'FULL JOIN'
         else:
-            print_err_info(join_type + 'is not supported.')
-        # Select
-        sql = "SELECT "
-        select = node.contribute_sql[SQLContribute.SELECT.value]
-        if len(select) != 0:
-            for sel in select:
-                sql += sel + ", "
-        else:
-            sql += "*"
-        sql = canonicalize(sql) + ' '
-
+            unsupported('join_type', join_type, f'{join_type} is not supported.')
         # From
-        # sql += f'From (' + node.contribute_sql[SQLContribute.SUBQUERY.value][0] + f') as {left_table} {join_type} (' + \
-        #        node.contribute_sql[SQLContribute.SUBQUERY.value][1] + f') as {right_table} '
-        sql += f'From (' + node.contribute_sql[SQLContribute.SUBQUERY.value][0] + f') {join_type} (' + \
-               node.contribute_sql[SQLContribute.SUBQUERY.value][1] + f') '
+        # parts.append(f'From ({subquery[0]}) as {left_table} {join_type} ({subquery[1]}) as {right_table} ')
+        parts.append(f'From ({subquery[0]}) {join_type} ({subquery[1]}) ')
 
         # Join condition
+        join_condition = contribute[SQLContribute.JOIN_CONDITION.value]
         if len(join_condition) > 0:
-            sql += 'ON '
-            for condition in join_condition:
-                sql += condition + ' AND '
-            sql = canonicalize(sql)
+            parts.append(render_clause('ON ', join_condition, ' AND '))
+
+    # Where
+    where = contribute[SQLContribute.WHERE.value]
+    if len(where) > 0:
+        parts.append(render_clause("Where ", where, ' and ') + ' ')
 
-        return general(node, sql)
+    # group by
+    group_by = contribute[SQLContribute.GROUP_BY.value]
+    if len(group_by) > 0:
+        parts.append(render_clause("Group by ", group_by, ', ') + ' ')
 
+    # order by
+    order_by = contribute[SQLContribute.ORDER_BY.value]
+    if len(order_by) > 0:
+        parts.append(render_clause("Order by ", order_by, ', '))
+    return canonicalize(''.join(parts))
 
-def get_candidate_views(root):
-    def get_candidate_view(root, candidate_views):
-        if len(root.children_node) > 0:
-            for child in root.children_node:
-                get_candidate_view(MetricNode.node_cache.get(child), candidate_views)
-        if 'Join' in root.name or 'HashAggregate' == root.name:
-            candidate_views.append(root)
 
-    candidate_views = []
-    get_candidate_view(root, candidate_views)
-    return candidate_views
+def get_candidate_views(root, context):
+    """
+    join和聚合节点作为候选视图，按后序返回
+    :param root:
+    :param context: 当前执行计划的PlanContext
+    :return:
+    """
+    return [node for node in plan_post_order(root, context)
+            if 'Join' in node.name or 'HashAggregate' == node.name]
+
+
+def analyze_plan(physical_plan, metrics_text, plan_cache=None, memo=None):
+    """
+    对单个执行计划完成结构解析、信息补全、sql还原和累计
+    :param physical_plan:
+    :param metrics_text:
+    :param plan_cache: utils.cache_utils中的PlanCache，命中时跳过文本解析直接还原sql
+    :param memo: utils.memo_utils中的SubtreeMemo，相同子树复用其他日志中的sql片段和累计结果
+    :return: PlanContext、候选视图、候选sql
+    """
+    context = PlanContext()
+    context.memo = memo
+    key = None
+    node_cache = None
+    if plan_cache is not None:
+        key = plan_cache.key(physical_plan, metrics_text)
+        node_cache = plan_cache.get(key)
+    count('plans')
+    if node_cache is None:
+        with timed('get_node_structure'):
+            nodes = get_node_structure(physical_plan)
+        with timed('get_node_metrics'):
+            context.node_cache = get_node_metrics(metrics_text, context)
+        with timed('complete_information'):
+            complete_information(nodes, context)
+        if plan_cache is not None:
+            plan_cache.put(key, context.node_cache)
+    else:
+        count('plan_cache_hits')
+        context.node_cache = node_cache
+    root = context.node_cache.get('0')
+    with timed('contribute_sql'):
+        contribute_sql(root, context)
+    candidate_views = get_candidate_views(root, context)
+    count('candidate_views', len(candidate_views))
+    with timed('fill_sql'):
+        sqls = fill_sql(candidate_views, context)
+    with timed('accumulate_all'):
+        accumulate_all(root, context)
+    if memo is not None:
+        remember_subtrees(root, context)
+    return context, candidate_views, sqls
 
 
 def accumulator(clz):
@@ -611,13 +1003,27 @@ def accumulator(clz):
 
 
 def build_tree_with_edge_text(edge, metric_nodes):
-    item = re.search(r"\d+->\d+", edge)
-    while item is not None:
-        relation = item.group().split('->')
-        metric_nodes[relation[0]].parents_node.append(relation[1])
-        metric_nodes[relation[1]].children_node.append(relation[0])
-        edge = edge[item.span()[1]:]
-        item = re.search(r"\d+->\d+", edge)
+    for item in EDGE_PATTERN.finditer(edge):
+        child, parent = item.groups()
+        metric_nodes[child].parents_node.append(parent)
+        metric_nodes[parent].children_node.append(child)
+
+
+def scan_fields(text, key_pattern, start=0):
+    """
+    单次扫描形如 key1: value1, key2: value2 的文本，value为两个相邻key之间的内容
+    :param text:
+    :param key_pattern: 匹配key的预编译正则
+    :param start: 扫描起始位置
+    :return: (key, value)迭代器，key和value均未规范化
+    """
+    front = None
+    for behind in key_pattern.finditer(text, start):
+        if front is not None:
+            yield front.group(), text[front.end():behind.start()]
+        front = behind
+    if front is not None:
+        yield front.group(), text[front.end():]
 
 
 def parse_bracket_list(string):
@@ -628,7 +1034,7 @@ def parse_bracket_list(string):
     """
     # 只处理带中括号的
     if '[' not in string:
-        return string
+        return intern_value(string)
     stan = string.strip(' ').strip('[').strip(']')
     if ',' in stan:
         stan = stan.split(',')
@@ -637,24 +1043,27 @@ def parse_bracket_list(string):
         # stan.sort()
     else:
         stan = [stan]
-    return stan
+    return intern_value(stan)
 
 
-def print_err_info(info):
-    print('\033[1;31;40m' + 'error occur' + '\033[0m')
-    print('\033[1;31;40m' + info + '\033[0m')
+def print_err_info(info, key='error'):
+    """
+    兼容旧调用，计数并限流输出，新代码直接使用utils.metrics_utils中的warn和unsupported
+    :param info:
+    :param key: 告警类别
+    :return:
+    """
+    warn(key, info)
 
 
 def canonicalize(item):
     """
-    规范化字符串
+    规范化字符串：去掉首尾的分隔符，再去掉末尾的and；strip之后末尾不会是空格，只需检查不带空格的and
     :return:
     """
     if isinstance(item, str):
         item = item.strip('.,: ')
-        if item.endswith('and ') or item.endswith('AND '):
-            item = item[:-4]
-        if item.endswith('and') or item.endswith('AND'):
+        if item.endswith(('and', 'AND')):
             item = item[:-3]
         return item
     else:
@@ -673,26 +1082,3 @@ def get_attribute_enum(string):
                 return attr
     return None
 
-
-def compare_view(view1, view2):
-    compare_from = len(set(view1.accumulate_contribute[SQLContribute.FROM.value]) ^ set(
-        view2.accumulate_contribute[SQLContribute.FROM.value]))
-    compare_group_by = len(set(view1.accumulate_contribute[SQLContribute.GROUP_BY.value]) ^ set(
-        view2.accumulate_contribute[SQLContribute.GROUP_BY.value]))
-    compare_order_by = len(set(view1.accumulate_contribute[SQLContribute.ORDER_BY.value]) ^ set(
-        view2.accumulate_contribute[SQLContribute.ORDER_BY.value]))
-    compare_join_type = len(set(view1.accumulate_contribute[SQLContribute.JOIN_TYPE.value]) ^ set(
-        view2.accumulate_contribute[SQLContribute.JOIN_TYPE.value]))
-    compare_join_condition = len(set(view1.accumulate_contribute[SQLContribute.JOIN_CONDITION.value]) ^ set(
-        view2.accumulate_contribute[SQLContribute.JOIN_CONDITION.value]))
-    if compare_from != 0 or compare_order_by != 0 or compare_group_by != 0 or \
-            compare_join_type != 0 or compare_join_condition != 0:
-        return False
-    select = set(view1.accumulate_contribute[SQLContribute.SELECT.value]) | set(
-        view2.accumulate_contribute[SQLContribute.SELECT.value])
-    where = set(view1.accumulate_contribute[SQLContribute.WHERE.value]) & set(
-        view2.accumulate_contribute[SQLContribute.WHERE.value])
-    view1.contribute_sql[SQLContribute.SELECT.value] = select
-    view1.contribute_sql[SQLContribute.WHERE.value] = where
-    view1.sql = generate_sql(view1)
-    return True
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+CACHE_SUFFIX = '.pkl'
+# 节点类结构变化时递增，旧版本的缓存自然失效
+CACHE_VERSION = 3
+
+
+class PlanCache(object):
+    """
+    以physical plan和node metrics文本的哈希为键，缓存complete_information之后的metrics节点图；
+    超过容量上限时按最近使用时间淘汰
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3, rescan_interval=100):
+        """
+        :param directory: 缓存目录
+        :param max_bytes: 缓存总大小上限
+        :param rescan_interval: 每写入多少次重新统计一次目录大小，多进程共用目录时用来修正各自的估计值
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        os.makedirs(directory, exist_ok=True)
+        self.size = self._scan_size()
+        self.puts = 0
+
+    @staticmethod
+    def key(physical_plan, metrics_text):
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_VERSION).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(physical_plan.encode('utf-8'))
+        # 分隔两段文本，避免不同的切分方式得到同一个键
+        digest.update(b'\0')
+        digest.update(metrics_text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key):
+        """
+        读取缓存的节点图，命中时刷新使用时间
+        :param key:
+        :return: nid到MetricNode的字典，未命中返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                node_cache = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, IndexError, ValueError):
+            # 文件损坏或节点类结构、模块已变化，反序列化时可能抛出其中任一种异常，都当作未命中
+            return None
+        return node_cache
+
+    def put(self, key, node_cache):
+        """
+        写入节点图，先写临时文件再重命名，多进程同时写同一个键也不会读到不完整的文件
+        :param key:
+        :param node_cache:
+        :return:
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(node_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(tmp_path, self._path(key))
+        self.size += size
+        self.puts += 1
+        if self.puts % self.rescan_interval == 0:
+            self.size = self._scan_size()
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        按最近使用时间从旧到新删除，直到总大小不超过上限
+        :return:
+        """
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
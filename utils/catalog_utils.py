@@ -0,0 +1,236 @@
+import json
+import sqlite3
+
+from utils.dedup_utils import SIGNATURE_CLAUSES, view_signature, merge_view
+from utils.metrics_utils import count
+from utils.structure import SQLContribute, ClauseArray, ViewSummary, EMPTY_CLAUSE_SET
+
+# sqlite单条语句的参数个数有上限，按块查询
+QUERY_CHUNK = 500
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS views (
+        signature TEXT PRIMARY KEY,
+        from_tables TEXT NOT NULL,
+        group_by TEXT NOT NULL,
+        order_by TEXT NOT NULL,
+        join_type TEXT NOT NULL,
+        join_condition TEXT NOT NULL,
+        select_items TEXT NOT NULL,
+        where_items TEXT NOT NULL,
+        operator TEXT,
+        sql TEXT NOT NULL,
+        contribute TEXT NOT NULL,
+        frequency INTEGER NOT NULL
+    )''',
+    # from_tables到join_condition与SIGNATURE_CLAUSES对应，值为排序后元素的json数组
+    'CREATE INDEX IF NOT EXISTS views_structure ON views '
+    '(from_tables, join_type, join_condition, group_by, order_by)',
+    'CREATE INDEX IF NOT EXISTS views_frequency ON views (frequency)',
+    '''CREATE TABLE IF NOT EXISTS view_sources (
+        signature TEXT NOT NULL,
+        source TEXT NOT NULL,
+        query_index INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (signature, source, query_index)
+    ) WITHOUT ROWID''',
+]
+
+UPSERT_VIEW = '''INSERT INTO views VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (signature) DO UPDATE SET select_items = excluded.select_items,
+        where_items = excluded.where_items, sql = excluded.sql, frequency = excluded.frequency'''
+# 同一日志的同一条sql重复写入（中断后重跑）时覆盖而不是累加，出现次数由来源记录汇总得到
+UPSERT_SOURCE = '''INSERT INTO view_sources VALUES (?, ?, ?, ?)
+    ON CONFLICT (signature, source, query_index) DO UPDATE SET count = excluded.count'''
+UPDATE_FREQUENCY = '''UPDATE views SET frequency =
+    (SELECT SUM(count) FROM view_sources s WHERE s.signature = views.signature) WHERE signature IN ({})'''
+
+
+def dump_items(items):
+    return json.dumps(sorted(items), ensure_ascii=False)
+
+
+class PendingView(object):
+    def __init__(self, view):
+        self.view = view
+        self.select = set(view.accumulate_contribute[SQLContribute.SELECT.value])
+        self.where = set(view.accumulate_contribute[SQLContribute.WHERE.value])
+        self.frequency = 0
+
+
+class ViewCatalog(object):
+    """
+    sqlite持久化的候选视图目录：按view_signature的规范签名合并视图（SELECT取并集、WHERE取交集），
+    记录出现次数和来源日志；新视图先在内存中按签名合并，每满一批与库中已有记录合并后批量upsert；
+    同一条sql的视图总在同一批中写入，重复处理同一日志不会重复计数
+    """
+
+    def __init__(self, path, batch_size=1000):
+        """
+        :param path: 数据库文件
+        :param batch_size: 累计多少个视图写一次库，在add_all之间检查
+        """
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        # 流水线在写出线程中写入，结束后在主线程中读取，同一时刻只有一个线程使用连接
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        self.pending = {}
+        self.pending_sources = {}
+        self.pending_count = 0
+
+    def add(self, view):
+        """
+        只加入缓存，不触发写库
+        :param view: utils.structure.ViewSummary
+        :return:
+        """
+        signature = view_signature(view)
+        pending = self.pending.get(signature)
+        if pending is None:
+            pending = self.pending[signature] = PendingView(view)
+        else:
+            pending.select |= view.accumulate_contribute[SQLContribute.SELECT.value]
+            pending.where &= view.accumulate_contribute[SQLContribute.WHERE.value]
+            count('views_merged')
+        pending.frequency += 1
+        source = (signature, view.source or '', -1 if view.index is None else view.index)
+        self.pending_sources[source] = self.pending_sources.get(source, 0) + 1
+        self.pending_count += 1
+
+    def add_all(self, views):
+        """
+        :param views: 同一条sql的候选视图，缓存满一批时在全部加入后写库
+        :return:
+        """
+        for view in views:
+            self.add(view)
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def _existing(self, signatures):
+        existing = {}
+        for start in range(0, len(signatures), QUERY_CHUNK):
+            chunk = signatures[start:start + QUERY_CHUNK]
+            rows = self.conn.execute(
+                'SELECT signature, select_items, where_items, operator, contribute, frequency FROM views '
+                f'WHERE signature IN ({", ".join("?" * len(chunk))})', chunk)
+            for signature, select_items, where_items, operator, contribute, frequency in rows:
+                existing[signature] = (set(json.loads(select_items)), set(json.loads(where_items)),
+                                       operator, contribute, frequency)
+        return existing
+
+    def flush(self):
+        """
+        将缓存的视图与库中已有记录合并后写入，一批一个事务
+        :return:
+        """
+        if not self.pending:
+            return
+        existing = self._existing(list(self.pending.keys()))
+        rows = []
+        for signature, pending in self.pending.items():
+            view = pending.view
+            select, where, frequency = pending.select, pending.where, pending.frequency
+            contribute = json.dumps(list(view.contribute_sql), ensure_ascii=False)
+            old = existing.get(signature)
+            if old is not None:
+                # 以库中已有的视图为代表，保持sql稳定
+                old_select, old_where, operator, contribute, old_frequency = old
+                select = select | old_select
+                where = where & old_where
+                frequency += old_frequency
+                count('views_merged')
+                old_contribute = ClauseArray(values=[tuple(items) for items in json.loads(contribute)])
+                view = ViewSummary(None, operator, '', old_contribute, view.accumulate_contribute, None, None)
+            sql = view.sql if frequency == 1 else merge_view(view, select, where).sql
+            rows.append((signature,) + tuple(dump_items(view.accumulate_contribute[clause.value])
+                                             for clause in SIGNATURE_CLAUSES) +
+                        (dump_items(select), dump_items(where), view.name, sql, contribute, frequency))
+        signatures = list(self.pending.keys())
+        with self.conn:
+            self.conn.executemany(UPSERT_VIEW, rows)
+            self.conn.executemany(UPSERT_SOURCE, [key + (count,) for key, count in self.pending_sources.items()])
+            for start in range(0, len(signatures), QUERY_CHUNK):
+                chunk = signatures[start:start + QUERY_CHUNK]
+                self.conn.execute(UPDATE_FREQUENCY.format(', '.join('?' * len(chunk))), chunk)
+        self.pending = {}
+        self.pending_sources = {}
+        self.pending_count = 0
+
+    def top_views(self, n=10):
+        """
+        :param n:
+        :return: 出现次数最多的n个视图，(签名, 算子, sql, 出现次数, 来源日志数)列表
+        """
+        return self.conn.execute(
+            'SELECT v.signature, v.operator, v.sql, v.frequency, '
+            '(SELECT COUNT(DISTINCT source) FROM view_sources s WHERE s.signature = v.signature) '
+            'FROM views v ORDER BY v.frequency DESC LIMIT ?', (n,)).fetchall()
+
+    def items(self):
+        """
+        从库中还原全部视图，先写入缓存中的视图；累计结果只包含库中记录的子句，
+        来源取字典序最小的(来源日志, sql序号)
+        :return: (视图摘要, 出现次数)列表，按视图第一次写入的顺序
+        """
+        self.flush()
+        rows = self.conn.execute(
+            'SELECT from_tables, group_by, order_by, join_type, join_condition, select_items, where_items, '
+            'operator, sql, contribute, frequency, '
+            '(SELECT source FROM view_sources s WHERE s.signature = v.signature '
+            'ORDER BY source, query_index LIMIT 1), '
+            '(SELECT query_index FROM view_sources s WHERE s.signature = v.signature '
+            'ORDER BY source, query_index LIMIT 1) '
+            'FROM views v ORDER BY v.rowid')
+        items = []
+        for row in rows:
+            operator, sql, contribute, frequency, source, index = row[-6:]
+            select, where = json.loads(row[5]), json.loads(row[6])
+            accumulated = ClauseArray(EMPTY_CLAUSE_SET)
+            for clause, items_json in zip(SIGNATURE_CLAUSES, row[:5]):
+                accumulated[clause.value] = frozenset(json.loads(items_json))
+            accumulated[SQLContribute.SELECT.value] = frozenset(select)
+            accumulated[SQLContribute.WHERE.value] = frozenset(where)
+            contribute = ClauseArray(values=[tuple(items) for items in json.loads(contribute)])
+            if frequency > 1:
+                # 与merge_view一致，合并过的视图用合并后的SELECT和WHERE
+                contribute[SQLContribute.SELECT.value] = tuple(select)
+                contribute[SQLContribute.WHERE.value] = tuple(where)
+            items.append((ViewSummary(None, operator, sql, contribute, accumulated, source or None,
+                                      None if index is None or index < 0 else index), frequency))
+        return items
+
+    def sources(self, signature):
+        """
+        :param signature:
+        :return: (来源日志, sql序号, 次数)列表
+        """
+        return self.conn.execute('SELECT source, query_index, count FROM view_sources WHERE signature = ? '
+                                 'ORDER BY source, query_index', (signature,)).fetchall()
+
+    def find(self, tables):
+        """
+        按表查找视图，走views_structure索引
+        :param tables: 表名集合
+        :return: (签名, sql, 出现次数)列表
+        """
+        return self.conn.execute('SELECT signature, sql, frequency FROM views WHERE from_tables = ? '
+                                 'ORDER BY frequency DESC', (dump_items(tables),)).fetchall()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM views').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
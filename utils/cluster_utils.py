@@ -0,0 +1,230 @@
+import hashlib
+import random
+
+from utils.analysis_utils import ACCUMULATE_CLAUSES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 2^61-1，排列函数(a * x + b) mod p，x和a、b都小于2^32，乘积不会超出uint64
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# 一次向量化计算签名的视图数
+SIGNATURE_BATCH = 4096
+# 每个桶最多记录的不同簇的视图数，限制每次插入的比较次数
+BUCKET_HEADS = 4
+
+
+def view_features(view):
+    """
+    候选视图的特征集合：每个累计子句的元素加上子句名前缀
+    :param view: utils.structure.ViewSummary或MetricNode
+    :return: frozenset
+    """
+    features = []
+    for clause in ACCUMULATE_CLAUSES:
+        for item in view.accumulate_contribute[clause]:
+            features.append(clause + '\x1f' + item)
+    return frozenset(features)
+
+
+def jaccard(features1, features2):
+    if not features1 and not features2:
+        return 1.0
+    return len(features1 & features2) / len(features1 | features2)
+
+
+def lsh_params(threshold, num_perm):
+    """
+    选择band数和每个band的行数：碰撞概率曲线的拐点(1/b)^(1/r)不超过阈值且尽量接近阈值；
+    候选对之后会用精确的Jaccard相似度过滤，宁可多召回；阈值低于1/num_perm时没有满足条件的组合，
+    取召回最高的每行一个band
+    :param threshold:
+    :param num_perm:
+    :return: (bands, rows)
+    """
+    best = (1 / num_perm, num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows != 0:
+            continue
+        bands = num_perm // rows
+        inflection = (1 / bands) ** (1 / rows)
+        if best[0] < inflection <= threshold:
+            best = (inflection, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher(object):
+    """
+    MinHash签名，特征先用blake2b映射为32位整数，跨进程、跨运行结果稳定；
+    安装了numpy时按批向量化计算，否则逐个视图计算，两者结果相同
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        rand = random.Random(seed)
+        self.num_perm = num_perm
+        self.a = [rand.randint(1, MAX_HASH) for _ in range(num_perm)]
+        self.b = [rand.randint(0, MAX_HASH) for _ in range(num_perm)]
+        self.feature_hashes = {}
+        if np is not None:
+            self.np_a = np.array(self.a, dtype=np.uint64)[:, None]
+            self.np_b = np.array(self.b, dtype=np.uint64)[:, None]
+
+    def hash_feature(self, feature):
+        value = self.feature_hashes.get(feature)
+        if value is None:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=4).digest()
+            value = self.feature_hashes[feature] = int.from_bytes(digest, 'little')
+        return value
+
+    def signature(self, features):
+        """
+        :param features: 特征集合
+        :return: num_perm个最小哈希值组成的元组
+        """
+        return self.signatures([features])[0]
+
+    def signatures(self, feature_sets):
+        """
+        批量计算签名
+        :param feature_sets: 特征集合列表
+        :return: 签名元组列表
+        """
+        hashes = [[self.hash_feature(feature) for feature in features] for features in feature_sets]
+        if np is None:
+            return [self._python_signature(values) for values in hashes]
+        # 所有视图的特征拼接成一行，按视图分段取最小值；空集合的签名全为MAX_HASH
+        lengths = [len(values) for values in hashes]
+        flat = np.fromiter((value for values in hashes for value in values), dtype=np.uint64, count=sum(lengths))
+        if len(flat) == 0:
+            return [(MAX_HASH,) * self.num_perm for _ in hashes]
+        permuted = (self.np_a * flat[None, :] + self.np_b) % MERSENNE_PRIME & MAX_HASH
+        starts = np.cumsum([0] + lengths[:-1])
+        non_empty = np.array(lengths) > 0
+        minimums = np.minimum.reduceat(permuted, starts[non_empty], axis=1).T.tolist()
+        signatures = []
+        rows = iter(minimums)
+        for length in lengths:
+            signatures.append(tuple(next(rows)) if length > 0 else (MAX_HASH,) * self.num_perm)
+        return signatures
+
+    def _python_signature(self, values):
+        if not values:
+            return (MAX_HASH,) * self.num_perm
+        return tuple(min((a * value + b) % MERSENNE_PRIME & MAX_HASH for value in values)
+                     for a, b in zip(self.a, self.b))
+
+
+class ViewClusterer(object):
+    """
+    基于MinHash + LSH的近似重复聚类：签名按band分桶，每个桶记录最多BUCKET_HEADS个不同簇的视图，
+    新视图与同桶记录的视图比较精确的Jaccard相似度，超过阈值时合并到同一个簇（并查集）；
+    每个视图最多比较bands * BUCKET_HEADS次，整体接近线性
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, seed=1):
+        """
+        :param threshold: Jaccard相似度阈值
+        :param num_perm: 签名长度
+        :param seed: 排列函数的随机种子，相同种子的结果可复现
+        """
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.features = []
+        self.frequencies = []
+        self.parents = []
+
+    def _find(self, index):
+        parents = self.parents
+        root = index
+        while parents[root] != root:
+            root = parents[root]
+        while parents[index] != root:
+            parents[index], index = root, parents[index]
+        return root
+
+    def _union(self, index1, index2):
+        root1, root2 = self._find(index1), self._find(index2)
+        if root1 != root2:
+            # 序号小的作为根，簇号按首次出现的顺序分配
+            self.parents[max(root1, root2)] = min(root1, root2)
+
+    def _insert(self, features, signature, frequency):
+        index = len(self.features)
+        self.features.append(features)
+        self.frequencies.append(frequency)
+        self.parents.append(index)
+        for band, buckets in enumerate(self.buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows]
+            heads = buckets.get(key)
+            if heads is None:
+                buckets[key] = [index]
+                continue
+            matched = False
+            for head in heads:
+                if self._find(head) == self._find(index):
+                    matched = True
+                elif jaccard(self.features[head], features) >= self.threshold:
+                    self._union(head, index)
+                    matched = True
+            if not matched and len(heads) < BUCKET_HEADS:
+                heads.append(index)
+        return index
+
+    def add(self, view, frequency=1):
+        """
+        :param view:
+        :param frequency: 视图的出现次数，用来选代表视图
+        :return: 视图序号
+        """
+        features = view_features(view)
+        return self._insert(features, self.hasher.signature(features), frequency)
+
+    def add_all(self, items):
+        """
+        :param items: (候选视图, 出现次数)迭代器，例如ViewCatalog.items()
+        :return:
+        """
+        batch = []
+        for view, frequency in items:
+            batch.append((view_features(view), frequency))
+            if len(batch) >= SIGNATURE_BATCH:
+                self._insert_batch(batch)
+                batch = []
+        self._insert_batch(batch)
+
+    def _insert_batch(self, batch):
+        signatures = self.hasher.signatures([features for features, _ in batch])
+        for (features, frequency), signature in zip(batch, signatures):
+            self._insert(features, signature, frequency)
+
+    def cluster_ids(self):
+        """
+        :return: 每个视图的簇号，按加入顺序排列，簇号从0开始连续编号
+        """
+        ids = {}
+        result = []
+        for index in range(len(self.parents)):
+            root = self._find(index)
+            if root not in ids:
+                ids[root] = len(ids)
+            result.append(ids[root])
+        return result
+
+    def representatives(self):
+        """
+        :return: 簇号到代表视图序号的字典，代表视图为簇中出现次数最多的视图
+        """
+        representatives = {}
+        for index, cluster in enumerate(self.cluster_ids()):
+            best = representatives.get(cluster)
+            if best is None or self.frequencies[index] > self.frequencies[best]:
+                representatives[cluster] = index
+        return representatives
+
+    def __len__(self):
+        return len(self.features)
@@ -0,0 +1,287 @@
+import json
+import os
+import re
+from array import array
+
+from utils.export_utils import write_little_endian
+from utils.structure import SQLContribute
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+VOCAB_FILE = 'vocab.jsonl'
+META_FILE = 'meta.json'
+TOKENS_FILE = 'tokens.u4'
+OFFSETS_FILE = 'offsets.i8'
+# 每行一个样本的来源[日志, 查询序号]，与样本一一对应
+SOURCES_FILE = 'sources.jsonl'
+# token id为uint32，偏移为int64，均为小端
+TOKEN_TYPECODE = 'I'
+OFFSET_TYPECODE = 'q'
+TOKEN_SIZE = 4
+OFFSET_SIZE = 8
+
+# 字符串常量、数字、标识符、多字符运算符，其余非空白字符各自成一个token
+TOKEN_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\d+(?:\.\d+)?|\w+|<=>|>=|<=|<>|!=|\|\||[^\w\s]")
+
+PAD_TOKEN = '<pad>'
+SEP_TOKEN = '<sep>'
+SQL_TOKEN = '<sql>'
+# 每个样本中sql之后依次拼接的累计子句，每个子句以<子句名>开头，子句元素之间用<sep>分隔
+DATASET_CLAUSES = [SQLContribute.SELECT, SQLContribute.FROM, SQLContribute.WHERE, SQLContribute.GROUP_BY,
+                   SQLContribute.ORDER_BY, SQLContribute.JOIN_TYPE, SQLContribute.JOIN_CONDITION]
+SPECIAL_TOKENS = [PAD_TOKEN, SEP_TOKEN, SQL_TOKEN] + [f'<{clause.value}>' for clause in DATASET_CLAUSES]
+
+
+def tokenize_sql(sql):
+    return TOKEN_PATTERN.findall(sql)
+
+
+def view_source(view):
+    """
+    :param view: utils.structure.ViewSummary
+    :return: (来源日志, 查询序号)，没有来源时为None
+    """
+    if view.source is None:
+        return None
+    return view.source, view.index
+
+
+class Vocabulary(object):
+    """
+    只增不减的词表，token id即加入的顺序；保存时只追加上次保存之后新增的token，
+    已经写出的数据集中的id永远有效
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: 词表文件，每行一个json字符串，为None时只在内存中使用
+        """
+        self.path = path
+        self.tokens = []
+        self.ids = {}
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self.add(json.loads(line))
+        self.saved = len(self.tokens)
+        for token in SPECIAL_TOKENS:
+            self.add(token)
+
+    def add(self, token):
+        """
+        :param token:
+        :return: token id，新token分配新id
+        """
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def encode(self, tokens):
+        return [self.add(token) for token in tokens]
+
+    def decode(self, ids):
+        return [self.tokens[token_id] for token_id in ids]
+
+    def save(self):
+        if self.path is None or self.saved == len(self.tokens):
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for token in self.tokens[self.saved:]:
+                f.write(json.dumps(token, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.saved = len(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+def encode_view(view, vocab):
+    """
+    候选视图编码为一个token id序列：<sql> sql的token，再依次是各累计子句，子句内元素按字典序排列
+    :param view: utils.structure.ViewSummary或MetricNode
+    :param vocab: Vocabulary
+    :return: token id列表
+    """
+    sep = vocab.add(SEP_TOKEN)
+    ids = [vocab.add(SQL_TOKEN)]
+    ids += vocab.encode(tokenize_sql(view.sql))
+    for clause in DATASET_CLAUSES:
+        ids.append(vocab.add(f'<{clause.value}>'))
+        for i, item in enumerate(sorted(view.accumulate_contribute[clause.value])):
+            if i > 0:
+                ids.append(sep)
+            ids += vocab.encode(tokenize_sql(item))
+    return ids
+
+
+def _read_meta(directory):
+    path = os.path.join(directory, META_FILE)
+    if not os.path.exists(path):
+        return {'samples': 0, 'tokens': 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _read_sources(f, samples):
+    # 读取前samples行，返回这些行和它们之后的字节位置
+    sources = []
+    for line in f:
+        if len(sources) == samples:
+            break
+        source, index = json.loads(line)
+        sources.append((source, index))
+    if len(sources) < samples:
+        raise ValueError(f'{SOURCES_FILE} has {len(sources)} rows, expected {samples}')
+    return sources
+
+
+class TokenDataset(object):
+    """
+    可追加的token id数据集：tokens.u4为所有样本拼接后的token id，offsets.i8为样本数+1个起始偏移，
+    第i个样本为tokens[offsets[i]:offsets[i + 1]]，sources.jsonl的第i行为它的来源；meta.json记录已提交的样本数和token数，
+    重新打开时截掉上次未提交的部分，之后继续追加，已有数据不需要重建；
+    按(来源日志, 查询序号)去重，重新处理的日志中已经写入过的查询不会重复追加
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vocab = Vocabulary(os.path.join(directory, VOCAB_FILE))
+        meta = _read_meta(directory)
+        self.samples = meta['samples']
+        self.tokens = meta['tokens']
+        self.tokens_file = self._open_truncated(TOKENS_FILE, self.tokens * TOKEN_SIZE)
+        self.offsets_file = self._open_truncated(OFFSETS_FILE, (self.samples + 1) * OFFSET_SIZE)
+        self.sources_file = self._open_sources()
+        self.pending_tokens = array(TOKEN_TYPECODE)
+        self.pending_offsets = array(OFFSET_TYPECODE)
+        self.pending_sources = []
+        if self.samples == 0 and self.offsets_file.tell() == 0:
+            self.pending_offsets.append(0)
+
+    def _open_truncated(self, file_name, size):
+        path = os.path.join(self.directory, file_name)
+        f = open(path, 'ab')
+        f.truncate(min(size, f.tell()))
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def _open_sources(self):
+        # 已提交的来源读入self.keys，截掉之后未提交的行
+        path = os.path.join(self.directory, SOURCES_FILE)
+        if not os.path.exists(path):
+            # 之前版本写出的数据集没有来源，已有样本记为无来源
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('[null, null]\n' * self.samples)
+        with open(path, 'rb+') as f:
+            sources = _read_sources(iter(f.readline, b''), self.samples)
+            f.truncate(f.tell())
+        self.keys = {source for source in sources if source[0] is not None}
+        return open(path, 'a', encoding='utf-8')
+
+    def add(self, view):
+        """
+        追加一个候选视图作为样本，commit之后才对读取方可见；来源查询已经写入过时跳过
+        :param view:
+        :return: 样本序号，跳过时为None
+        """
+        samples = self.add_all([view])
+        return samples[0] if samples else None
+
+    def add_all(self, views):
+        """
+        追加候选视图，同一个查询的视图要在同一次调用中加入；之前的调用中已经写入过的查询整个跳过
+        :param views:
+        :return: 追加的样本序号列表
+        """
+        views = list(views)
+        keys = {view_source(view) for view in views}
+        keys.discard(None)
+        samples = []
+        for view in views:
+            source = view_source(view)
+            if source in self.keys:
+                continue
+            self.pending_tokens.extend(encode_view(view, self.vocab))
+            self.pending_offsets.append(self.tokens + len(self.pending_tokens))
+            self.pending_sources.append(source or (None, None))
+            samples.append(self.samples)
+            self.samples += 1
+        self.keys |= keys
+        return samples
+
+    def commit(self):
+        """
+        写出缓存的样本：先写数据和词表，最后更新meta.json
+        :return:
+        """
+        for f, values in ((self.tokens_file, self.pending_tokens), (self.offsets_file, self.pending_offsets)):
+            write_little_endian(f, values)
+            f.flush()
+            os.fsync(f.fileno())
+        for source in self.pending_sources:
+            self.sources_file.write(json.dumps(source, ensure_ascii=False) + '\n')
+        self.sources_file.flush()
+        os.fsync(self.sources_file.fileno())
+        self.tokens += len(self.pending_tokens)
+        self.pending_tokens = array(TOKEN_TYPECODE)
+        self.pending_offsets = array(OFFSET_TYPECODE)
+        self.pending_sources = []
+        self.vocab.save()
+        tmp_path = os.path.join(self.directory, META_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'samples': self.samples, 'tokens': self.tokens, 'vocab_size': len(self.vocab)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+    def close(self):
+        self.commit()
+        self.tokens_file.close()
+        self.offsets_file.close()
+        self.sources_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TokenDatasetReader(object):
+    """
+    以内存映射方式读取TokenDataset，样本是tokens数组的切片，不复制数据，需要numpy
+    """
+
+    def __init__(self, directory):
+        if np is None:
+            raise ImportError('numpy is required to read token datasets')
+        meta = _read_meta(directory)
+        self.vocab = Vocabulary(os.path.join(directory, VOCAB_FILE))
+        self.offsets = np.memmap(os.path.join(directory, OFFSETS_FILE), dtype='<i8', mode='r',
+                                 shape=(meta['samples'] + 1,))
+        # 空文件不能映射
+        if meta['tokens'] == 0:
+            self.tokens = np.zeros(0, dtype='<u4')
+        else:
+            self.tokens = np.memmap(os.path.join(directory, TOKENS_FILE), dtype='<u4', mode='r',
+                                    shape=(meta['tokens'],))
+        # 每个样本的(来源日志, 查询序号)
+        self.sources = [(None, None)] * meta['samples']
+        path = os.path.join(directory, SOURCES_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.sources = _read_sources(f, meta['samples'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
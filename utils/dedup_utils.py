@@ -0,0 +1,43 @@
+import hashlib
+
+from utils.analysis_utils import render_sql, remove_str_number
+from utils.structure import SQLContribute
+
+# 这些子句集合完全相同的视图才会合并
+SIGNATURE_CLAUSES = [SQLContribute.FROM, SQLContribute.GROUP_BY, SQLContribute.ORDER_BY,
+                     SQLContribute.JOIN_TYPE, SQLContribute.JOIN_CONDITION]
+
+
+def view_signature(view):
+    """
+    计算候选视图的规范签名，签名相同的视图可以合并
+    :param view:
+    :return: 十六进制哈希字符串
+    """
+    digest = hashlib.sha1()
+    for clause in SIGNATURE_CLAUSES:
+        for item in sorted(set(view.accumulate_contribute[clause.value])):
+            digest.update(item.encode('utf-8'))
+            digest.update(b'\x1f')
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def merge_view(view, select, where):
+    """
+    用合并后的SELECT和WHERE集合替换视图摘要的对应子句，生成新的摘要并重新生成sql；
+    累计结果同步替换，导出、覆盖度和聚类看到的是合并后的视图
+    :param view: utils.structure.ViewSummary
+    :param select:
+    :param where:
+    :return: 新的ViewSummary
+    """
+    contribute = view.contribute_sql.copy()
+    contribute[SQLContribute.SELECT.value] = tuple(sorted(select))
+    contribute[SQLContribute.WHERE.value] = tuple(sorted(where))
+    accumulated = view.accumulate_contribute.copy()
+    accumulated[SQLContribute.SELECT.value] = frozenset(select)
+    accumulated[SQLContribute.WHERE.value] = frozenset(where)
+    view = view._replace(contribute_sql=contribute, accumulate_contribute=accumulated)
+    return view._replace(sql=remove_str_number(render_sql(view)))
+
@@ -0,0 +1,488 @@
+import bz2
+import io
+import json
+import lzma
+import os
+import struct
+import zlib
+
+from utils.analysis_utils import iter_history_entries
+from utils.fetch_utils import MappedFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+SQL_EXECUTION_START = 'org.apache.spark.sql.execution.ui.SparkListenerSQLExecutionStart'
+SQL_ADAPTIVE_UPDATE = 'org.apache.spark.sql.execution.ui.SparkListenerSQLAdaptiveExecutionUpdate'
+SQL_EXECUTION_END = 'org.apache.spark.sql.execution.ui.SparkListenerSQLExecutionEnd'
+DRIVER_ACCUM_UPDATES = 'org.apache.spark.sql.execution.ui.SparkListenerDriverAccumUpdates'
+TASK_END = 'SparkListenerTaskEnd'
+# JsonProtocol总是先写Event字段，据此不解析json就能判断事件类型
+EVENT_PREFIX = '{"Event":"'
+
+# 与SparkPlanGraph一致，这些包装节点不单独成为节点，直接连到子节点
+TRANSPARENT_NODES = {'InputAdapter', 'ShuffleQueryStage', 'BroadcastQueryStage', 'TableCacheQueryStage',
+                     'ReusedSubquery'}
+# 这些节点可能被ReusedExchange/ReusedSubquery复用，复用处指向同一个节点
+SHARED_NODES = {'Subquery', 'SubqueryBroadcast'}
+# 各类型sql metric的单位，average类型的任务值不能直接相加，不输出
+METRIC_UNITS = {'sum': '', 'size': ' B', 'timing': ' ms', 'nsTiming': ' ns'}
+
+READ_SIZE = 1 << 20
+# lz4-java的LZ4BlockOutputStream：magic、(压缩方式|压缩级别)、压缩长度、原始长度、校验和
+LZ4_MAGIC = b'LZ4Block'
+LZ4_HEADER = struct.Struct('<BiiI')
+LZ4_METHOD_RAW = 0x10
+LZ4_METHOD_LZ4 = 0x20
+# snappy-java的SnappyOutputStream：magic、版本、兼容版本，之后每块为大端长度加snappy原始格式数据
+SNAPPY_MAGIC = b'\x82SNAPPY\x00'
+SNAPPY_HEADER_SIZE = 16
+SNAPPY_LENGTH = struct.Struct('>i')
+
+CODEC_ERRORS = (zlib.error, lzma.LZMAError, EOFError)
+if zstandard is not None:
+    CODEC_ERRORS += (zstandard.ZstdError,)
+if lz4_block is not None:
+    CODEC_ERRORS += (lz4_block.LZ4BlockError,)
+if snappy is not None:
+    CODEC_ERRORS += (snappy.UncompressError,)
+
+
+def _read_exact(raw, size):
+    """
+    :param raw: 二进制流
+    :param size:
+    :return: size个字节，流已经结束时返回空字节串
+    """
+    data = raw.read(size)
+    while 0 < len(data) < size:
+        chunk = raw.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    if 0 < len(data) < size:
+        raise EOFError('compressed event log is truncated')
+    return data
+
+
+def _iter_stream_codec(raw, new_decompressor):
+    """
+    解压流式格式，兼容多个压缩流首尾相接
+    :param raw: 二进制流
+    :param new_decompressor: 创建解压对象的函数，解压对象需要有decompress、eof、unused_data
+    :return: 解压后的数据块迭代器
+    """
+    decompressor = new_decompressor()
+    started = False
+    while True:
+        data = raw.read(READ_SIZE)
+        if not data:
+            if started:
+                raise EOFError('compressed event log is truncated')
+            return
+        while data:
+            started = True
+            yield decompressor.decompress(data)
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data
+            decompressor = new_decompressor()
+            started = False
+
+
+def _iter_lz4_blocks(raw):
+    while True:
+        magic = _read_exact(raw, len(LZ4_MAGIC))
+        if not magic:
+            return
+        if magic != LZ4_MAGIC:
+            raise ValueError(f'bad lz4 block magic: {magic!r}')
+        token, compressed_length, original_length, _ = LZ4_HEADER.unpack(_read_exact(raw, LZ4_HEADER.size))
+        data = _read_exact(raw, compressed_length)
+        method = token & 0xf0
+        if method == LZ4_METHOD_RAW:
+            yield data
+        elif method == LZ4_METHOD_LZ4:
+            yield lz4_block.decompress(data, uncompressed_size=original_length)
+        else:
+            raise ValueError(f'unknown lz4 block method: {method:#x}')
+
+
+def _iter_snappy_blocks(raw):
+    header = _read_exact(raw, SNAPPY_HEADER_SIZE)
+    while header:
+        if header[:len(SNAPPY_MAGIC)] != SNAPPY_MAGIC:
+            raise ValueError(f'bad snappy stream magic: {header[:len(SNAPPY_MAGIC)]!r}')
+        header = b''
+        while True:
+            length = _read_exact(raw, SNAPPY_LENGTH.size)
+            if not length:
+                break
+            # 长度不会是负数，以0x82开头的是下一个首尾相接的流的头
+            if length[0] == SNAPPY_MAGIC[0]:
+                header = length + _read_exact(raw, SNAPPY_HEADER_SIZE - SNAPPY_LENGTH.size)
+                break
+            yield snappy.uncompress(_read_exact(raw, SNAPPY_LENGTH.unpack(length)[0]))
+
+
+# 日志后缀到(解压函数, 需要的可选依赖, 依赖名)，Spark的event log以压缩codec的短名为后缀
+EVENT_LOG_CODECS = {
+    '.gz': (lambda raw: _iter_stream_codec(raw, lambda: zlib.decompressobj(zlib.MAX_WBITS | 16)), zlib, 'zlib'),
+    '.bz2': (lambda raw: _iter_stream_codec(raw, bz2.BZ2Decompressor), bz2, 'bz2'),
+    '.xz': (lambda raw: _iter_stream_codec(raw, lzma.LZMADecompressor), lzma, 'lzma'),
+    '.zstd': (lambda raw: _iter_stream_codec(raw, lambda: zstandard.ZstdDecompressor().decompressobj()),
+              zstandard, 'zstandard'),
+    '.lz4': (_iter_lz4_blocks, lz4_block, 'lz4'),
+    '.snappy': (_iter_snappy_blocks, snappy, 'python-snappy'),
+}
+EVENT_LOG_CODECS['.zst'] = EVENT_LOG_CODECS['.zstd']
+
+
+class DecompressedStream(io.RawIOBase):
+    """
+    将解压后的数据块迭代器包装为二进制流，解压错误统一转为ValueError；关闭时不关闭底层流
+    """
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+        self.buf = b''
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos == len(self.buf):
+            try:
+                self.buf = next(self.chunks, None)
+            except CODEC_ERRORS as e:
+                raise ValueError(f'corrupt compressed event log: {e}') from e
+            self.pos = 0
+            if self.buf is None:
+                self.buf = b''
+                return 0
+        size = min(len(b), len(self.buf) - self.pos)
+        b[:size] = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+
+def is_event_log(path):
+    """
+    :param path:
+    :return: 是否为Spark原始event log；jar转换后的history json以.json结尾
+    """
+    return not path.endswith('.json')
+
+
+def open_event_log(stream, path):
+    """
+    按后缀解压event log
+    :param stream: fetcher打开的文本流，压缩日志需要能通过buffer属性取得底层二进制流
+    :param path:
+    :return: 解压后的文本流，关闭时不关闭原始流；未压缩时返回原始流
+    """
+    codec = EVENT_LOG_CODECS.get(os.path.splitext(path)[1])
+    if codec is None:
+        return stream
+    iter_chunks, module, module_name = codec
+    if module is None:
+        raise ImportError(f'{module_name} is required to read {path}')
+    raw = getattr(stream, 'buffer', None)
+    if raw is None:
+        raise ValueError(f'{path} is compressed but the stream has no binary buffer')
+    return io.TextIOWrapper(io.BufferedReader(DecompressedStream(iter_chunks(raw)), READ_SIZE), encoding='utf-8')
+
+
+class SqlExecution(object):
+    """
+    一条sql执行在event log中的状态，自适应执行时计划会被后续事件替换为最终计划
+    """
+    __slots__ = ('description', 'physical_plan', 'plan_info', 'accumulator_ids', 'values')
+
+    def __init__(self, description):
+        self.description = description
+        self.physical_plan = ''
+        self.plan_info = None
+        # 开始和自适应更新事件中出现过的所有accumulatorId
+        self.accumulator_ids = []
+        # accumulatorId到各任务累加值的和
+        self.values = {}
+
+
+def iter_plan_metrics(plan_info):
+    """
+    :param plan_info: sparkPlanInfo
+    :return: 计划树中所有节点的metric
+    """
+    stack = [plan_info]
+    while stack:
+        info = stack.pop()
+        yield from info.get('metrics') or ()
+        stack.extend(info.get('children') or ())
+
+
+def _shared_key(info):
+    # 复用的算子与原算子的accumulatorId相同
+    return info.get('nodeName'), tuple(metric.get('accumulatorId') for metric in info.get('metrics') or ())
+
+
+def build_plan_graph(plan_info):
+    """
+    按SparkPlanGraph的规则将sparkPlanInfo展开为节点图，节点按先序编号，根节点为0；
+    与SparkPlanGraph不同的是WholeStageCodegen也作为普通节点连在树中，与history json中的节点图一致
+    :param plan_info: sparkPlanInfo
+    :return: (节点列表, 边列表, WholeStageCodegen子图列表)，节点为sparkPlanInfo，边为(子节点id, 父节点id)，
+        子图为(WholeStageCodegen节点id, 子图内节点id列表)
+    """
+    nodes = []
+    edges = []
+    clusters = {}
+    shared = {}
+    # (节点, 父节点id, 所在WholeStageCodegen的id)，逆序入栈保证子节点从左到右编号
+    stack = [(plan_info, None, None)]
+    while stack:
+        info, parent, cluster = stack.pop()
+        name = info.get('nodeName', '')
+        children = info.get('children') or []
+        if name in TRANSPARENT_NODES:
+            # InputAdapter之下已不在同一个WholeStageCodegen中
+            inner_cluster = cluster if name == 'ReusedSubquery' else None
+            stack.extend((child, parent, inner_cluster) for child in reversed(children))
+            continue
+        is_shared = 'Exchange' in name or name in SHARED_NODES
+        if name == 'ReusedExchange' and children:
+            key = _shared_key(children[0])
+        else:
+            key = _shared_key(info) if is_shared else None
+        if key is not None and key in shared and parent is not None:
+            edges.append((shared[key], parent))
+            continue
+        nid = len(nodes)
+        nodes.append(info)
+        if is_shared:
+            shared[_shared_key(info)] = nid
+        if parent is not None:
+            edges.append((nid, parent))
+        # 子查询不属于外层的WholeStageCodegen
+        if name in SHARED_NODES:
+            cluster = None
+        if cluster is not None:
+            clusters[cluster].append(nid)
+        if name.startswith('WholeStageCodegen'):
+            clusters[nid] = []
+            cluster = nid
+        stack.extend((child, nid, cluster) for child in reversed(children))
+    return nodes, edges, list(clusters.items())
+
+
+def format_metric(metric, values):
+    value = values.get(metric.get('accumulatorId'))
+    unit = METRIC_UNITS.get(metric.get('metricType'))
+    if value is None or unit is None:
+        return None
+    return f"{metric.get('name')}: {value}{unit}"
+
+
+def plan_metrics_text(plan_info, values=None):
+    """
+    生成与history json中node metrics相同格式的文本，供get_node_metrics解析
+    :param plan_info: sparkPlanInfo
+    :param values: accumulatorId到metric值，为None时不输出metric值
+    :return: 文本，节点图中没有边（例如DDL命令）时返回None
+    """
+    nodes, edges, clusters = build_plan_graph(plan_info)
+    if not edges:
+        return None
+    blocks = []
+    for nid, info in enumerate(nodes):
+        desc = info.get('simpleString', '').replace('\n', ' ')
+        lines = [f"id: {nid} name: {info.get('nodeName', '')} desc: {desc}"]
+        if values:
+            for metric in info.get('metrics') or ():
+                line = format_metric(metric, values)
+                if line is not None:
+                    lines.append(line)
+        blocks.append('\n'.join(lines))
+    edge_text = ''.join(f'  {child}->{parent};\n' for child, parent in edges)
+    cluster_text = ''.join(f"cluster{nid}\n{' '.join(map(str, members))}\n" for nid, members in clusters)
+    return '[PlanMetric]\n' + '\n\n\n\n'.join(blocks) + '\n\n\n\n' + edge_text + '[SubGraph]\n' + cluster_text
+
+
+def _execution_entry(execution_id, execution, metric_values):
+    if execution.plan_info is None:
+        return None
+    metrics_text = plan_metrics_text(execution.plan_info, execution.values if metric_values else None)
+    if metrics_text is None:
+        return None
+    return {'execution id': execution_id, 'original query': execution.description, 'node metrics': metrics_text,
+            'physical plan': execution.physical_plan, 'dot metrics': '', 'materialized views': ''}
+
+
+def _add_value(execution, accumulator_id, value):
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            return
+    if isinstance(value, int):
+        execution.values[accumulator_id] = execution.values.get(accumulator_id, 0) + value
+
+
+def event_log_events(metric_values=False):
+    """
+    :param metric_values: 是否汇总metric值
+    :return: 需要解析的事件类型
+    """
+    events = {SQL_EXECUTION_START, SQL_ADAPTIVE_UPDATE, SQL_EXECUTION_END}
+    if metric_values:
+        events |= {TASK_END, DRIVER_ACCUM_UPDATES}
+    return events
+
+
+def iter_stream_events(stream, wanted):
+    """
+    :param stream: 解压后的文本流
+    :param wanted: 需要的事件类型
+    :return: (事件类型, 行)迭代器
+    """
+    for line in stream:
+        if line.startswith(EVENT_PREFIX):
+            event = line[len(EVENT_PREFIX):line.find('"', len(EVENT_PREFIX))]
+        elif line.strip():
+            event = json.loads(line).get('Event')
+        else:
+            continue
+        if event in wanted:
+            yield event, line
+
+
+def iter_buffer_events(buf, wanted, start=0, end=None):
+    """
+    在内存映射的未压缩event log中逐行查找事件，只复制需要的行，其余行既不复制也不解码
+    :param buf: mmap或bytes
+    :param wanted: 需要的事件类型
+    :param start: 日志在buf中的起始位置
+    :param end: 日志在buf中的结束位置
+    :return: (事件类型, 行的字节串)迭代器
+    """
+    if end is None:
+        end = len(buf)
+    prefix = EVENT_PREFIX.encode('utf-8')
+    wanted_events = {event.encode('utf-8'): event for event in wanted}
+    pos = start
+    while pos < end:
+        line_end = buf.find(b'\n', pos, end)
+        if line_end == -1:
+            line_end = end
+        if buf[pos:pos + len(prefix)] == prefix:
+            event = wanted_events.get(buf[pos + len(prefix):buf.find(b'"', pos + len(prefix), line_end)])
+            if event is not None:
+                yield event, buf[pos:line_end]
+        else:
+            line = buf[pos:line_end]
+            if line.strip():
+                event = json.loads(line).get('Event')
+                if event in wanted:
+                    yield event, line
+        pos = line_end + 1
+
+
+def iter_event_log_entries(stream, metric_values=False):
+    """
+    流式读取Spark原始event log，逐行只解析sql执行相关的事件，每条sql执行结束时返回一项，
+    格式与history json中的一项相同；内存占用只和同时在执行的sql有关
+    :param stream: 解压后的文本流
+    :param metric_values: 是否汇总任务上报的metric值，需要额外解析每个任务结束事件，默认只输出节点图
+    :return: 每条sql执行对应的字典，没有结束事件的执行在日志读完时返回
+    """
+    return iter_execution_entries(iter_stream_events(stream, event_log_events(metric_values)), metric_values)
+
+
+def iter_execution_entries(events, metric_values=False):
+    """
+    :param events: (事件类型, 行)迭代器，行为json文本或字节串
+    :param metric_values: 是否汇总metric值
+    :return: 每条sql执行对应的字典
+    """
+    executions = {}
+    # accumulatorId到所属sql执行
+    accumulators = {}
+    for event, line in events:
+        if event == TASK_END:
+            if not accumulators:
+                continue
+            for accumulable in json.loads(line).get('Task Info', {}).get('Accumulables') or ():
+                execution = accumulators.get(accumulable.get('ID'))
+                if execution is not None:
+                    _add_value(execution, accumulable['ID'], accumulable.get('Update'))
+        elif event == DRIVER_ACCUM_UPDATES:
+            for accumulator_id, value in json.loads(line).get('accumUpdates') or ():
+                execution = accumulators.get(accumulator_id)
+                if execution is not None:
+                    _add_value(execution, accumulator_id, value)
+        elif event == SQL_EXECUTION_START or event == SQL_ADAPTIVE_UPDATE:
+            data = json.loads(line)
+            execution_id = data.get('executionId')
+            execution = executions.get(execution_id)
+            if execution is None:
+                execution = executions[execution_id] = SqlExecution(data.get('description', ''))
+            execution.physical_plan = data.get('physicalPlanDescription', '')
+            execution.plan_info = data.get('sparkPlanInfo')
+            if metric_values and execution.plan_info is not None:
+                for metric in iter_plan_metrics(execution.plan_info):
+                    accumulators[metric.get('accumulatorId')] = execution
+                    execution.accumulator_ids.append(metric.get('accumulatorId'))
+        elif event == SQL_EXECUTION_END:
+            execution_id = json.loads(line).get('executionId')
+            execution = executions.pop(execution_id, None)
+            if execution is None:
+                continue
+            for accumulator_id in execution.accumulator_ids:
+                accumulators.pop(accumulator_id, None)
+            entry = _execution_entry(execution_id, execution, metric_values)
+            if entry is not None:
+                yield entry
+    for execution_id, execution in executions.items():
+        entry = _execution_entry(execution_id, execution, metric_values)
+        if entry is not None:
+            yield entry
+
+
+def iter_log_entries(stream, path, metric_values=False):
+    """
+    按日志格式逐项返回sql：history json流式解析，原始event log解压后逐行读取，
+    内存映射的未压缩event log直接在映射上查找
+    :param stream: fetcher打开的文本流
+    :param path:
+    :param metric_values: 原始event log是否汇总metric值
+    :return: 每条sql对应的字典
+    """
+    if not is_event_log(path):
+        yield from iter_history_entries(stream)
+        return
+    mapped = getattr(getattr(stream, 'buffer', None), 'raw', None)
+    if isinstance(mapped, MappedFile) and os.path.splitext(path)[1] not in EVENT_LOG_CODECS:
+        # 内存映射的未压缩日志直接在映射上查找事件
+        events = iter_buffer_events(mapped.buf, event_log_events(metric_values), mapped.start, mapped.end)
+        yield from iter_execution_entries(events, metric_values)
+        return
+    events = open_event_log(stream, path)
+    try:
+        yield from iter_event_log_entries(events, metric_values)
+    finally:
+        if events is not stream:
+            events.close()
@@ -0,0 +1,333 @@
+import json
+import os
+import shutil
+import sys
+from abc import ABC, abstractmethod
+from array import array
+
+from utils.structure import SQLContribute
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PARQUET_SUFFIX = '.parquet'
+SCHEMA_FILE = 'schema.json'
+COLUMNAR_FORMAT = 'columnar-v1'
+
+# 导出的累计子句：列名 -> accumulate_contribute中的子句
+EXPORT_CLAUSES = [('from', SQLContribute.FROM), ('where', SQLContribute.WHERE),
+                  ('group_by', SQLContribute.GROUP_BY), ('join_type', SQLContribute.JOIN_TYPE),
+                  ('join_condition', SQLContribute.JOIN_CONDITION)]
+# 列名及类型，类型为int64、string或list<string>
+EXPORT_COLUMNS = [('source', 'string'), ('query_index', 'int64'), ('operator', 'string'), ('sql', 'string')] + \
+                 [(name, 'list<string>') for name, _ in EXPORT_CLAUSES] + \
+                 [('frequency', 'int64'), ('cluster', 'int64'), ('representative', 'int64'), ('coverage', 'int64')]
+
+
+def write_little_endian(f, values):
+    """
+    按小端字节序写出array.array，numpy可以用'<'开头的dtype直接映射
+    :param f: 二进制文件
+    :param values: array.array
+    :return:
+    """
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def view_row(view, frequency, cluster=-1, representative=False, coverage=0):
+    """
+    候选视图摘要转换为一行导出数据，集合按字典序排序，保证导出结果稳定
+    :param view: utils.structure.ViewSummary
+    :param frequency: 去重后的出现次数
+    :param cluster: utils.cluster_utils中的近似重复簇号，未聚类时为-1
+    :param representative: 是否为所在簇的代表视图
+    :param coverage: utils.subsume_utils中统计的可回答的查询数
+    :return: 列名到值的字典
+    """
+    row = {'source': view.source or '',
+           'query_index': -1 if view.index is None else view.index,
+           'operator': view.name,
+           'sql': view.sql}
+    for name, clause in EXPORT_CLAUSES:
+        row[name] = sorted(view.accumulate_contribute[clause.value])
+    row['frequency'] = frequency
+    row['cluster'] = cluster
+    row['representative'] = int(representative)
+    row['coverage'] = coverage
+    return row
+
+
+class ViewWriter(ABC):
+    """
+    候选视图的列式流式写入基类，按批缓存行，每满一批写出一次；
+    先写到临时路径，close时再替换目标，中途失败不会留下不完整的结果
+    """
+
+    def __init__(self, path, batch_size=10000):
+        """
+        :param path: 导出目标路径
+        :param batch_size: 每批行数，对应parquet的一个row group
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.batch_size = max(1, batch_size)
+        self.rows = 0
+        self.columns = self._empty_batch()
+
+    @staticmethod
+    def _empty_batch():
+        return {name: [] for name, _ in EXPORT_COLUMNS}
+
+    def append(self, view, frequency=1, cluster=-1, representative=False, coverage=0):
+        """
+        追加一个候选视图
+        :param view: utils.structure.ViewSummary
+        :param frequency:
+        :param cluster:
+        :param representative:
+        :param coverage:
+        :return:
+        """
+        for name, value in view_row(view, frequency, cluster, representative, coverage).items():
+            self.columns[name].append(value)
+        if len(self.columns['sql']) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        size = len(self.columns['sql'])
+        if size == 0:
+            return
+        self._write_batch(self.columns)
+        self.rows += size
+        self.columns = self._empty_batch()
+        self._commit()
+
+    @abstractmethod
+    def _write_batch(self, columns):
+        """
+        写出一批列数据
+        :param columns: 列名到值列表的dict
+        """
+
+    def _commit(self):
+        """
+        一批写完、rows更新之后调用
+        """
+        pass
+
+    @abstractmethod
+    def _publish(self):
+        """
+        全部写完后使结果可见
+        """
+
+    @abstractmethod
+    def _discard(self):
+        """
+        出错时丢弃已写出的部分
+        """
+
+    def close(self):
+        self.flush()
+        self._publish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+
+def arrow_type(column_type):
+    if column_type == 'int64':
+        return pa.int64()
+    if column_type == 'string':
+        return pa.string()
+    return pa.list_(pa.string())
+
+
+class ParquetViewWriter(ViewWriter):
+    """
+    写入parquet文件，每批一个row group，需要pyarrow
+    """
+
+    def __init__(self, path, batch_size=10000):
+        super().__init__(path, batch_size)
+        self.schema = pa.schema([(name, arrow_type(column_type)) for name, column_type in EXPORT_COLUMNS])
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+
+    def _write_batch(self, columns):
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+
+    def _publish(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def _discard(self):
+        self.writer.close()
+        os.remove(self.tmp_path)
+
+
+class ColumnarViewWriter(ViewWriter):
+    """
+    没有pyarrow时的替代格式：一个目录，每列若干个小端定长数组文件，可以直接用numpy.memmap映射：
+    int64列为<name>.i8；string列为<name>.offsets.i8（行数+1个结束偏移）和<name>.data（utf-8字节）；
+    list<string>列在string列的基础上多一个<name>.list.i8（行数+1个元素偏移）；
+    schema.json记录列类型和已写完的行数，每批写完后更新
+    """
+
+    def __init__(self, path, batch_size=10000):
+        super().__init__(path, batch_size)
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.files = {}
+        # string列和list<string>列当前的结束偏移
+        self.data_offsets = {}
+        self.list_offsets = {}
+        for name, column_type in EXPORT_COLUMNS:
+            if column_type == 'int64':
+                self._open(name + '.i8')
+                continue
+            self._open(name + '.data')
+            self._write_int64(name + '.offsets.i8', [0])
+            self.data_offsets[name] = 0
+            if column_type == 'list<string>':
+                self._write_int64(name + '.list.i8', [0])
+                self.list_offsets[name] = 0
+        self._write_schema()
+
+    def _open(self, file_name):
+        self.files[file_name] = open(os.path.join(self.tmp_path, file_name), 'wb')
+        return self.files[file_name]
+
+    def _write_int64(self, file_name, values):
+        f = self.files.get(file_name) or self._open(file_name)
+        write_little_endian(f, array('q', values))
+
+    def _write_strings(self, name, strings):
+        offset = self.data_offsets[name]
+        offsets = []
+        chunks = []
+        for string in strings:
+            chunk = string.encode('utf-8')
+            chunks.append(chunk)
+            offset += len(chunk)
+            offsets.append(offset)
+        self.files[name + '.data'].write(b''.join(chunks))
+        self._write_int64(name + '.offsets.i8', offsets)
+        self.data_offsets[name] = offset
+
+    def _write_schema(self):
+        schema = {'format': COLUMNAR_FORMAT, 'rows': self.rows,
+                  'columns': [{'name': name, 'type': column_type} for name, column_type in EXPORT_COLUMNS]}
+        tmp_schema = os.path.join(self.tmp_path, SCHEMA_FILE + '.tmp')
+        with open(tmp_schema, 'w') as f:
+            json.dump(schema, f)
+        os.replace(tmp_schema, os.path.join(self.tmp_path, SCHEMA_FILE))
+
+    def _write_batch(self, columns):
+        for name, column_type in EXPORT_COLUMNS:
+            values = columns[name]
+            if column_type == 'int64':
+                self._write_int64(name + '.i8', values)
+            elif column_type == 'string':
+                self._write_strings(name, values)
+            else:
+                offset = self.list_offsets[name]
+                offsets = []
+                for items in values:
+                    offset += len(items)
+                    offsets.append(offset)
+                self._write_strings(name, [item for items in values for item in items])
+                self._write_int64(name + '.list.i8', offsets)
+                self.list_offsets[name] = offset
+
+    def _commit(self):
+        for f in self.files.values():
+            f.flush()
+        self._write_schema()
+
+    def _close_files(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def _publish(self):
+        self._close_files()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_path, self.path)
+
+    def _discard(self):
+        self._close_files()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def create_view_writer(path, batch_size=10000):
+    """
+    安装了pyarrow时写parquet文件（path加.parquet后缀），否则写ColumnarViewWriter格式的目录
+    :param path: 不带后缀的导出路径
+    :param batch_size:
+    :return: ViewWriter
+    """
+    if pq is not None:
+        return ParquetViewWriter(path + PARQUET_SUFFIX, batch_size)
+    return ColumnarViewWriter(path, batch_size)
+
+
+def open_columns(path):
+    """
+    以内存映射方式打开ColumnarViewWriter写出的目录，需要numpy
+    :param path:
+    :return: 列名到数组字典的映射：int64列为{'values'}，string列为{'offsets', 'data'}，
+             list<string>列另有{'list_offsets'}；第i个字符串为data[offsets[i]:offsets[i + 1]]
+    """
+    if np is None:
+        raise ImportError('numpy is required to open columnar view exports')
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    rows = schema['rows']
+
+    def int64_file(file_name, length):
+        # 空文件不能映射
+        if length == 0:
+            return np.zeros(0, dtype='<i8')
+        return np.memmap(os.path.join(path, file_name), dtype='<i8', mode='r', shape=(length,))
+
+    columns = {}
+    for column in schema['columns']:
+        name, column_type = column['name'], column['type']
+        if column_type == 'int64':
+            columns[name] = {'values': int64_file(name + '.i8', rows)}
+            continue
+        strings = rows
+        arrays = {}
+        if column_type == 'list<string>':
+            arrays['list_offsets'] = int64_file(name + '.list.i8', rows + 1)
+            strings = int(arrays['list_offsets'][-1])
+        arrays['offsets'] = int64_file(name + '.offsets.i8', strings + 1)
+        data_size = int(arrays['offsets'][-1])
+        # 空文件不能映射
+        if data_size == 0:
+            arrays['data'] = np.zeros(0, dtype=np.uint8)
+        else:
+            arrays['data'] = np.memmap(os.path.join(path, name + '.data'), dtype=np.uint8, mode='r',
+                                       shape=(data_size,))
+        columns[name] = arrays
+    return columns
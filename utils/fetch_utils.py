@@ -0,0 +1,510 @@
+import http.client
+import io
+import json
+import mmap
+import os
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit, quote
+
+from utils.analysis_utils import run_cmd, iter_ls_entries, minute_str
+from utils.metrics_utils import warn
+
+
+class FetchError(IOError):
+    pass
+
+
+class PermanentFetchError(FetchError):
+    """
+    重试也不会成功的错误，例如文件不存在、没有权限，不再重试
+    """
+
+
+# 4xx中表示暂时性问题、可以重试的状态码
+RETRYABLE_CLIENT_STATUSES = (408, 429)
+
+
+def status_error(resp, body):
+    """
+    :param resp: 状态码不是200的http响应
+    :param body: 响应内容
+    :return: 4xx（除RETRYABLE_CLIENT_STATUSES外）为PermanentFetchError，其余为FetchError
+    """
+    message = f'{resp.status} {resp.reason}: {body[:200]!r}'
+    if 400 <= resp.status < 500 and resp.status not in RETRYABLE_CLIENT_STATUSES:
+        return PermanentFetchError(message)
+    return FetchError(message)
+
+
+class HistoryFetcher(ABC):
+    """
+    日志读取的基类，子类需要实现read（单次读取，失败抛异常）和iter_listing，重试由基类统一处理；
+    并发读取由流水线负责
+    """
+    # 为True时流水线不单独读取文件，由解析阶段直接打开（本地文件读取没有等待，不需要和解析重叠）
+    in_place = False
+
+    def __init__(self, retries=3, retry_interval=1.0):
+        """
+        :param retries: 单个文件失败后的重试次数
+        :param retry_interval: 重试间隔（秒），第n次重试等待n倍间隔
+        """
+        self.retries = max(0, retries)
+        self.retry_interval = retry_interval
+
+    @abstractmethod
+    def read(self, path):
+        """
+        读取整个文件的文本，失败时抛出OSError或http.client.HTTPException
+        :param path:
+        :return:
+        """
+
+    def read_bytes(self, path):
+        """
+        读取原始字节，压缩的event log不能按文本读取；默认从文本流的底层二进制流读取
+        :param path:
+        :return:
+        """
+        with self.open_stream(path) as stream:
+            return stream.buffer.read()
+
+    @abstractmethod
+    def iter_listing(self, directory, start_after=None):
+        """
+        按文件名顺序列出目录
+        :param directory:
+        :param start_after: 只返回文件名大于该值的文件，用于分页和增量刷新
+        :return: (文件名, 大小, 修改时间)迭代器，修改时间格式与hdfs dfs -ls相同
+        """
+
+    def open_stream(self, path):
+        """
+        以文本流方式打开文件，子类可覆盖为真正的流式读取；带有底层二进制流，read_bytes可以直接使用
+        :param path:
+        :return:
+        """
+        return io.TextIOWrapper(io.BytesIO(self.read(path).encode('utf-8')), encoding='utf-8')
+
+    def _retry(self, func, path):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(path)
+            except (PermanentFetchError, FileNotFoundError) as e:
+                warn('fetch error', f'{path} failed: {e}')
+                return None
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    warn('fetch error', f'{path} failed after {attempt + 1} attempts: {e}')
+                    return None
+                time.sleep(self.retry_interval * (attempt + 1))
+
+    def fetch(self, path):
+        """
+        读取单个文件，失败时按配置重试
+        :param path:
+        :return: 文件内容，全部重试失败时返回None
+        """
+        return self._retry(self.read, path)
+
+    def fetch_bytes(self, path):
+        """
+        读取单个文件的原始字节，失败时按配置重试
+        :param path:
+        :return: 文件内容，全部重试失败时返回None
+        """
+        return self._retry(self.read_bytes, path)
+
+    def open(self, path):
+        """
+        以文本流方式打开单个文件，打开失败时按配置重试，读取过程中的错误由调用方处理
+        :param path:
+        :return: 文本流，全部重试失败时返回None
+        """
+        return self._retry(self.open_stream, path)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CommandStream(io.TextIOWrapper):
+    """
+    子进程标准输出的文本流，关闭时结束子进程
+    """
+
+    def __init__(self, proc):
+        super().__init__(proc.stdout, encoding='utf-8')
+        self.proc = proc
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+
+
+class ResponseStream(io.TextIOWrapper):
+    """
+    http响应的文本流，响应没有读完就关闭时丢弃底层连接
+    """
+
+    def __init__(self, resp, discard):
+        super().__init__(resp, encoding='utf-8')
+        self.resp = resp
+        self.discard = discard
+
+    def close(self):
+        if not self.closed:
+            # 未读完的响应数据会留在连接中，不能再复用；read1读到Content-Length时不会主动关闭响应
+            if not (self.resp.isclosed() or self.resp.length == 0):
+                self.discard()
+            super().close()
+
+
+class HdfsCliFetcher(HistoryFetcher):
+    """
+    通过hdfs dfs -cat读取，每个文件仍需要启动一次JVM，但多个文件并发读取
+    """
+
+    def read(self, path):
+        (ret, out, err) = run_cmd(['hdfs', 'dfs', '-cat', path])
+        if ret != 0:
+            raise FetchError(err.decode('utf-8', 'replace').strip())
+        return '\n'.join(out)
+
+    def read_bytes(self, path):
+        proc = subprocess.run(['hdfs', 'dfs', '-cat', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise FetchError(proc.stderr.decode('utf-8', 'replace').strip())
+        return proc.stdout
+
+    def iter_listing(self, directory, start_after=None):
+        return iter_ls_entries(directory, start_after)
+
+    def open_stream(self, path):
+        proc = subprocess.Popen(['hdfs', 'dfs', '-cat', path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return CommandStream(proc)
+
+
+class WebHdfsFetcher(HistoryFetcher):
+    """
+    通过WebHDFS REST接口读取，每个工作线程复用自己的namenode/datanode长连接，避免每个文件启动JVM
+    """
+
+    def __init__(self, namenode='server1:9870', user=None, timeout=60, **kwargs):
+        """
+        :param namenode: namenode http地址，host:port
+        :param user: user.name参数，未开启安全认证时使用
+        :param timeout: 单次请求超时时间（秒）
+        """
+        super().__init__(**kwargs)
+        self.namenode = namenode
+        self.user = user
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self, netloc):
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(netloc)
+        if conn is None:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            conns[netloc] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _discard(self, netloc):
+        conn = self._local.conns.pop(netloc, None)
+        if conn is not None:
+            conn.close()
+            with self._lock:
+                self._connections.remove(conn)
+
+    def _request(self, netloc, url):
+        conn = self._connection(netloc)
+        try:
+            conn.request('GET', url)
+            return conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            # 连接失效时丢弃，下次重试重新建立
+            self._discard(netloc)
+            raise
+
+    def _url(self, path, op):
+        hdfs_path = '/' + urlsplit(path).path.lstrip('/').replace('//', '/')
+        url = f'/webhdfs/v1{quote(hdfs_path)}?op={op}'
+        if self.user is not None:
+            url += f'&user.name={quote(self.user)}'
+        return url
+
+    def _open(self, path):
+        url = self._url(path, 'OPEN')
+        netloc = self.namenode
+        resp = self._request(netloc, url)
+        if resp.status in (301, 302, 307):
+            resp.read()
+            location = urlsplit(resp.getheader('Location'))
+            netloc = location.netloc
+            resp = self._request(netloc, f'{location.path}?{location.query}')
+        if resp.status != 200:
+            raise status_error(resp, resp.read())
+        return netloc, resp
+
+    def read(self, path):
+        netloc, resp = self._open(path)
+        try:
+            return resp.read().decode('utf-8')
+        except (OSError, http.client.HTTPException):
+            self._discard(netloc)
+            raise
+
+    def _list_page(self, directory, start_after):
+        url = self._url(directory, 'LISTSTATUS_BATCH')
+        if start_after is not None:
+            url += f'&startAfter={quote(start_after)}'
+        resp = self._request(self.namenode, url)
+        try:
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            self._discard(self.namenode)
+            raise
+        if resp.status != 200:
+            raise status_error(resp, body)
+        listing = json.loads(body)['DirectoryListing']
+        return listing['partialListing']['FileStatuses']['FileStatus'], listing['remainingEntries']
+
+    def iter_listing(self, directory, start_after=None):
+        """
+        通过LISTSTATUS_BATCH分页列出目录，每页一次请求，边列出边返回；只返回文件，跳过子目录
+        """
+        while True:
+            page = self._retry(lambda _: self._list_page(directory, start_after), directory)
+            if page is None:
+                raise FetchError(f'failed to list {directory}')
+            statuses, remaining = page
+            for status in statuses:
+                if status['type'] == 'FILE':
+                    yield status['pathSuffix'], status['length'], minute_str(status['modificationTime'] / 1000)
+            if remaining == 0 or not statuses:
+                return
+            start_after = statuses[-1]['pathSuffix']
+
+    def open_stream(self, path):
+        netloc, resp = self._open(path)
+        return ResponseStream(resp, lambda: self._discard(netloc))
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    def __getstate__(self):
+        # 连接和线程状态不能跨进程传递，子进程中重新建立
+        state = self.__dict__.copy()
+        for key in ('_local', '_lock', '_connections'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+
+class MappedFile(io.RawIOBase):
+    """
+    内存映射文件（或归档中未压缩成员）的只读二进制流，buf[start:end]为文件内容；
+    按块读取时每次只复制一块，也可以直接在buf上查找
+    """
+
+    def __init__(self, buf, start=0, end=None, owner=None):
+        """
+        :param buf: mmap
+        :param start: 文件内容的起始位置
+        :param end: 文件内容的结束位置
+        :param owner: 关闭流时一起关闭的mmap，归档中各成员共享的mmap不随成员关闭
+        """
+        super().__init__()
+        self.buf = buf
+        self.start = start
+        self.end = len(buf) if end is None else end
+        self.pos = start
+        self.owner = owner
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self.end - self.pos)
+        b[:size] = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def readall(self):
+        data = self.buf[self.pos:self.end]
+        self.pos = self.end
+        return data
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            if self.owner is not None:
+                self.owner.close()
+
+
+def map_file(path):
+    """
+    :param path:
+    :return: 只读mmap，空文件不能映射，返回None
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# zip本地文件头的长度，文件名长度和扩展字段长度分别位于第26、28字节
+ZIP_LOCAL_HEADER_SIZE = 30
+
+
+class LocalCorpusFetcher(HistoryFetcher):
+    """
+    本地语料：目录（含子目录）或未压缩的tar、zip归档，按文件名查找日志，用于离线重跑大量日志；
+    文件和归档中未压缩的成员以内存映射方式读取，归档只映射一次，各成员直接使用映射中的对应区间
+    """
+    in_place = True
+
+    def __init__(self, root, **kwargs):
+        """
+        :param root: 目录或归档文件
+        """
+        # 本地读取失败重试也不会成功
+        kwargs.setdefault('retries', 0)
+        super().__init__(**kwargs)
+        self.root = root
+        self._lock = threading.Lock()
+        self._index = None
+        self._archive = None
+        self._zip = None
+
+    def _load_index(self):
+        with self._lock:
+            if self._index is not None:
+                return self._index
+            # 文件名到(路径/tar成员/zip成员, 大小, 修改时间)
+            index = {}
+            if os.path.isdir(self.root):
+                for dir_path, _, names in os.walk(self.root):
+                    for name in names:
+                        path = os.path.join(dir_path, name)
+                        stat = os.stat(path)
+                        index[name] = (path, stat.st_size, stat.st_mtime)
+            elif os.path.getsize(self.root) == 0:
+                # 空文件不能映射，视为没有日志的归档
+                pass
+            elif zipfile.is_zipfile(self.root):
+                self._zip = zipfile.ZipFile(self.root)
+                self._archive = map_file(self.root)
+                for info in self._zip.infolist():
+                    if not info.is_dir():
+                        index[os.path.basename(info.filename)] = (info, info.file_size,
+                                                                  time.mktime(info.date_time + (0, 0, -1)))
+            elif tarfile.is_tarfile(self.root):
+                try:
+                    with tarfile.open(self.root, 'r:') as tar:
+                        for member in tar:
+                            if member.isfile():
+                                index[os.path.basename(member.name)] = (member, member.size, member.mtime)
+                except tarfile.ReadError as e:
+                    raise ValueError(f'{self.root}: only uncompressed tar archives can be memory mapped') from e
+                self._archive = map_file(self.root)
+            else:
+                raise ValueError(f'{self.root} is neither a directory nor a tar/zip archive')
+            self._index = index
+            return index
+
+    def open_raw(self, path):
+        """
+        :param path: 只使用文件名
+        :return: 二进制流，能映射时为MappedFile
+        """
+        entry = self._load_index().get(os.path.basename(path))
+        if entry is None:
+            raise FileNotFoundError(f'{path} is not in {self.root}')
+        item = entry[0]
+        if isinstance(item, str):
+            buf = map_file(item)
+            if buf is None:
+                return io.BytesIO()
+            return MappedFile(buf, owner=buf)
+        if isinstance(item, tarfile.TarInfo):
+            return MappedFile(self._archive, item.offset_data, item.offset_data + item.size)
+        if item.compress_type != zipfile.ZIP_STORED:
+            return self._zip.open(item)
+        header = item.header_offset
+        name_length = int.from_bytes(self._archive[header + 26:header + 28], 'little')
+        extra_length = int.from_bytes(self._archive[header + 28:header + 30], 'little')
+        start = header + ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+        return MappedFile(self._archive, start, start + item.file_size)
+
+    def read(self, path):
+        with self.open_stream(path) as f:
+            return f.read()
+
+    def read_bytes(self, path):
+        with self.open_raw(path) as f:
+            return f.read()
+
+    def open_stream(self, path):
+        raw = self.open_raw(path)
+        if isinstance(raw, MappedFile):
+            raw = io.BufferedReader(raw)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+
+    def iter_listing(self, directory, start_after=None):
+        """
+        列出语料中的所有文件，忽略directory
+        """
+        for name, (_, size, mtime) in sorted(self._load_index().items()):
+            if start_after is None or name > start_after:
+                yield name, size, minute_str(mtime)
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+            if self._archive is not None:
+                self._archive.close()
+            self._index = self._archive = self._zip = None
+
+    def __getstate__(self):
+        # 映射和打开的归档不能跨进程传递，子进程中重新打开
+        state = self.__dict__.copy()
+        for key in ('_lock', '_index', '_archive', '_zip'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._index = None
+        self._archive = None
+        self._zip = None
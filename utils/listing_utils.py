@@ -0,0 +1,85 @@
+import json
+import os
+import time
+
+from utils.analysis_utils import filter_spark_logs
+
+
+class LogListing(object):
+    """
+    日志目录列表的本地缓存：已完成的日志不会再变化，再次运行时只从最早的未完成日志之前开始列出，
+    之前的部分直接使用缓存；hdfs按文件名排序列出，未完成日志改名后的文件名排在原文件名之前，
+    日志被清理或编号位数变化时增量结果不准确，超过full_refresh_interval后完整列出一次
+    """
+
+    def __init__(self, fetcher, directory, cache_path=None, full_refresh_interval=24 * 3600):
+        """
+        :param fetcher: utils.fetch_utils中的HistoryFetcher，提供iter_listing
+        :param directory: 日志目录
+        :param cache_path: 缓存文件，为None时每次完整列出
+        :param full_refresh_interval: 完整列出的间隔（秒）
+        """
+        self.fetcher = fetcher
+        self.directory = directory
+        self.cache_path = cache_path
+        self.full_refresh_interval = full_refresh_interval
+
+    def _load(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cache = json.load(f)
+        except ValueError:
+            return None
+        if cache.get('directory') != self.directory or \
+                time.time() - cache.get('full_listed_at', 0) > self.full_refresh_interval:
+            return None
+        return cache
+
+    def _save(self, entries, full_listed_at):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'directory': self.directory, 'full_listed_at': full_listed_at, 'entries': entries}, f,
+                      ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.cache_path)
+
+    def iter_entries(self):
+        """
+        先返回缓存中仍然有效的部分，再边列出边返回其余部分，全部列出后更新缓存
+        :return: (日志名, 大小, 修改时间)迭代器，按日志名排序
+        """
+        now = time.time()
+        cache = self._load()
+        entries = []
+        start_after = None
+        full_listed_at = now
+        if cache is not None:
+            full_listed_at = cache['full_listed_at']
+            cached = cache['entries']
+            # 从第一个未完成日志之前开始重新列出
+            end = len(cached)
+            for i, (log_name, _, _) in enumerate(cached):
+                if 'inprogress' in log_name:
+                    end = i
+                    break
+            entries = cached[:end]
+            if end > 0:
+                start_after = entries[-1][0]
+        for log_name, size, mtime in entries:
+            yield log_name, size, mtime
+        for entry in self.fetcher.iter_listing(self.directory, start_after):
+            entries.append(list(entry))
+            yield entry
+        if self.cache_path is not None:
+            self._save(entries, full_listed_at)
+
+    def iter_logs(self, start_time='1940-01-01 00:00', end_time='2500-01-01 00:00'):
+        """
+        :param start_time: 日志开始时间段
+        :param end_time: 日志结束时间段
+        :return: 时间段内已完成的(日志名, 大小, 修改时间)迭代器
+        """
+        return filter_spark_logs(self.iter_entries(), start_time, end_time)
@@ -0,0 +1,79 @@
+import json
+import os
+
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class LogManifest(object):
+    """
+    已处理日志清单，以日志名+修改时间+大小为键，追加写入json lines文件；
+    同一日志的多条记录以最后一条为准；内存中只保留大小、修改时间和状态，候选sql只写入文件不读回
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # 日志名 -> (大小, 修改时间, 状态)
+        self.entries = {}
+        self.pending = []
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb+') as f:
+            end = 0
+            for line in iter(f.readline, b''):
+                if not line.endswith(b'\n'):
+                    # 上次运行中断时可能留下不完整的最后一行，截掉后再追加，避免和下一条记录连成一行
+                    f.truncate(end)
+                    break
+                end += len(line)
+                line = line.strip()
+                if line == b'':
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[entry['log']] = (entry['size'], entry['mtime'], entry['status'])
+
+    def is_processed(self, log_name, size, mtime):
+        """
+        日志是否已处理过且之后没有变化，处理失败的日志需要重新处理
+        :param log_name:
+        :param size:
+        :param mtime:
+        :return:
+        """
+        entry = self.entries.get(log_name)
+        return entry is not None and entry[0] == size and entry[1] == mtime and entry[2] != STATUS_FAILED
+
+    def record(self, log_name, size, mtime, status, outputs=None):
+        """
+        记录单个日志的处理结果，调用commit后才会写入文件
+        :param log_name:
+        :param size:
+        :param mtime:
+        :param status: STATUS_DONE/STATUS_FAILED
+        :param outputs: 该日志产生的候选sql，只写入文件
+        :return:
+        """
+        self.entries[log_name] = (size, mtime, status)
+        self.pending.append({'log': log_name, 'size': size, 'mtime': mtime, 'status': status,
+                             'outputs': outputs or []})
+
+    def commit(self):
+        """
+        将记录追加写入文件，应在对应的视图结果保存之后调用，保证中断后不会漏掉日志
+        :return:
+        """
+        if len(self.pending) == 0:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for entry in self.pending:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+
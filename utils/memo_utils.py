@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+
+class SubtreeEntry(object):
+    __slots__ = ('name', 'raw_fingerprint', 'contribute_sql', 'sql_fragment', 'accumulate_contribute', 'count')
+
+    def __init__(self, name, raw_fingerprint, contribute_sql, sql_fragment, accumulate_contribute):
+        self.name = name
+        self.raw_fingerprint = raw_fingerprint
+        self.contribute_sql = contribute_sql
+        self.sql_fragment = sql_fragment
+        self.accumulate_contribute = accumulate_contribute
+        self.count = 0
+
+
+class SubtreeMemo(object):
+    """
+    跨日志的子树结果缓存：以子树指纹为键，保存子树根节点的contribute_sql、sql片段和累计结果，
+    并统计每个子树出现的次数；超过容量时淘汰最久未使用的子树。
+    累计结果已去掉表达式编号，只要指纹相同即可复用；contribute_sql和sql片段带有表达式编号，
+    只有保留编号的指纹也相同时才复用
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, fingerprint, raw_fingerprint=None):
+        """
+        :param fingerprint: analysis_utils.subtree_fingerprints计算的指纹
+        :param raw_fingerprint: 保留表达式编号的指纹，不为None时编号也必须相同才算命中
+        :return: SubtreeEntry，未命中返回None
+        """
+        self.lookups += 1
+        entry = self.entries.get(fingerprint)
+        if entry is not None and raw_fingerprint is not None and entry.raw_fingerprint != raw_fingerprint:
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(fingerprint)
+        return entry
+
+    def store(self, fingerprint, raw_fingerprint, node, accumulated):
+        """
+        记录一次子树出现，已有的结果保留，缺少的sql片段和累计结果用本次的补上；
+        sql片段只从表达式编号相同的子树补上
+        :param fingerprint:
+        :param raw_fingerprint: 保留表达式编号的指纹
+        :param node: 子树根节点
+        :param accumulated: 本次是否计算了该节点的累计结果
+        :return:
+        """
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            entry = SubtreeEntry(node.name, raw_fingerprint, node.contribute_sql.copy(), node.sql_fragment,
+                                 node.accumulate_contribute if accumulated else None)
+            self.entries[fingerprint] = entry
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            if entry.sql_fragment is None and entry.raw_fingerprint == raw_fingerprint:
+                entry.sql_fragment = node.sql_fragment
+            if entry.accumulate_contribute is None and accumulated:
+                entry.accumulate_contribute = node.accumulate_contribute
+        entry.count += 1
+
+    def most_common(self, n=10):
+        """
+        :param n:
+        :return: 出现次数最多的n个子树，(指纹, 根节点名, 出现次数, sql片段)列表，没有渲染过的子树sql片段为None
+        """
+        entries = sorted(self.entries.items(), key=lambda item: -item[1].count)[:n]
+        return [(fingerprint.hex(), entry.name, entry.count, entry.sql_fragment) for fingerprint, entry in entries]
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('spark_plan')
+
+# 采样时视为空闲的调用栈：栈顶在这些模块中的线程正在等待
+IDLE_MODULES = ('threading.py', 'selectors.py', 'queue.py', 'connection.py', 'thread.py')
+
+_local = threading.local()
+
+
+class StageTimer(object):
+    __slots__ = ('wall', 'cpu', 'calls')
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+
+class _Timed(object):
+    __slots__ = ('timer', 'wall', 'cpu')
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        timer = self.timer
+        timer.wall += time.perf_counter() - self.wall
+        timer.cpu += time.thread_time() - self.cpu
+        timer.calls += 1
+
+
+class Metrics(object):
+    """
+    一条日志（或一次运行）的阶段计时和计数：wall为经过时间，cpu为所在线程的cpu时间；
+    counters为普通计数，unsupported按类别统计不支持的算子、字段等，warnings按类别统计告警次数
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self.unsupported = {}
+        self.warnings = Counter()
+
+    def timed(self, stage):
+        """
+        :param stage: 阶段名
+        :return: 计时的上下文管理器，可重复进入，时间累加
+        """
+        timer = self.stages.get(stage)
+        if timer is None:
+            timer = self.stages[stage] = StageTimer()
+        return _Timed(timer)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def count_unsupported(self, kind, name):
+        names = self.unsupported.get(kind)
+        if names is None:
+            names = self.unsupported[kind] = Counter()
+        names[name] += 1
+
+    def merge(self, other):
+        """
+        :param other: 另一个Metrics，累加到当前对象
+        :return:
+        """
+        for stage, timer in other.stages.items():
+            own = self.stages.get(stage)
+            if own is None:
+                own = self.stages[stage] = StageTimer()
+            own.wall += timer.wall
+            own.cpu += timer.cpu
+            own.calls += timer.calls
+        self.counters.update(other.counters)
+        for kind, names in other.unsupported.items():
+            self.unsupported.setdefault(kind, Counter()).update(names)
+        self.warnings.update(other.warnings)
+
+    def match_rate(self):
+        matched = self.counters['metric_nodes_matched']
+        total = matched + self.counters['metric_nodes_unmatched']
+        return matched / total if total else None
+
+    def summary(self):
+        """
+        :return: 可直接json序列化的dict
+        """
+        return {
+            'stages': {stage: {'wall': round(timer.wall, 6), 'cpu': round(timer.cpu, 6), 'calls': timer.calls}
+                       for stage, timer in self.stages.items()},
+            'counters': dict(self.counters),
+            'match_rate': self.match_rate(),
+            'unsupported': {kind: dict(names.most_common()) for kind, names in self.unsupported.items()},
+            'warnings': dict(self.warnings),
+        }
+
+
+# 不在任何日志中时计入的进程级指标
+_process_metrics = Metrics()
+
+
+def current():
+    """
+    :return: 当前线程正在收集的Metrics，没有时为进程级的Metrics
+    """
+    return getattr(_local, 'metrics', _process_metrics)
+
+
+class collecting(object):
+    """
+    在with块内把当前线程的指标收集到metrics中，可嵌套
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'metrics', None)
+        _local.metrics = self.metrics
+        return self.metrics
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.previous is None:
+            del _local.metrics
+        else:
+            _local.metrics = self.previous
+
+
+def timed(stage):
+    return current().timed(stage)
+
+
+def count(name, n=1):
+    current().counters[name] += n
+
+
+class RateLimitedLogger(object):
+    """
+    按类别限流的日志：同一类别每interval秒最多输出burst条，其余只计数，
+    下一个时间窗口的第一条或flush时输出被抑制的条数
+    """
+
+    def __init__(self, log, burst=5, interval=60.0):
+        self.log = log
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def emit(self, level, key, message):
+        if not self.log.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = 0 if window is None else window[2]
+                window = self.windows[key] = [now, 0, 0]
+                if suppressed > 0:
+                    self.log.log(level, '[%s] %d similar messages suppressed', key, suppressed)
+            if window[1] >= self.burst:
+                window[2] += 1
+                return
+            window[1] += 1
+        self.log.log(level, '[%s] %s', key, message)
+
+    def flush(self):
+        with self.lock:
+            for key, window in self.windows.items():
+                if window[2] > 0:
+                    self.log.warning('[%s] %d similar messages suppressed', key, window[2])
+                    window[2] = 0
+
+
+limited_logger = RateLimitedLogger(logger)
+
+
+def warn(key, message):
+    """
+    计数并限流输出一条告警
+    :param key: 告警类别，用于计数和限流
+    :param message:
+    :return:
+    """
+    current().warnings[key] += 1
+    limited_logger.emit(logging.WARNING, key, message)
+
+
+def unsupported(kind, name, message):
+    """
+    记录一个不支持的算子、字段等
+    :param kind: 类别，如operator、field、metric、join_type
+    :param name: 不支持的名称，按名称计数
+    :param message:
+    :return:
+    """
+    current().count_unsupported(kind, name)
+    limited_logger.emit(logging.WARNING, f'unsupported {kind}', message)
+
+
+class RunMetrics(object):
+    """
+    一次运行的指标：汇总每条日志的Metrics，每条日志一行写入log_path（jsonl），结束时写出整体摘要
+    """
+
+    def __init__(self, log_path=None):
+        """
+        :param log_path: 每条日志指标的jsonl文件，为None时不写
+        """
+        self.total = Metrics()
+        self.logs = 0
+        self.failed = 0
+        self.extra = {}
+        self.started_at = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.log_file = None
+        if log_path is not None:
+            self.log_file = open(log_path, 'a', encoding='utf-8')
+
+    def add_log(self, path, metrics, failed=False):
+        """
+        :param path: 日志路径
+        :param metrics: 这条日志的Metrics
+        :param failed: 是否读取或解析失败
+        :return:
+        """
+        self.total.merge(metrics)
+        self.logs += 1
+        self.failed += failed
+        if self.log_file is not None:
+            self.log_file.write(json.dumps({'log': path, 'failed': failed, **metrics.summary()},
+                                           ensure_ascii=False) + '\n')
+
+    def summary(self):
+        total = Metrics()
+        total.merge(self.total)
+        total.merge(_process_metrics)
+        return {'started_at': self.started_at, 'wall': round(time.perf_counter() - self.wall, 6),
+                'cpu': round(time.process_time() - self.cpu, 6), 'logs': self.logs, 'failed': self.failed,
+                **total.summary(), **self.extra}
+
+    def write(self, path):
+        """
+        写出整体摘要并关闭每条日志的指标文件；多进程解析时cpu只包含主进程，各阶段的cpu包含所有进程
+        :param path:
+        :return:
+        """
+        limited_logger.flush()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        self.close()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+class StackSampler(object):
+    """
+    采样式profiler：后台线程每interval秒记录一次本进程其他线程的调用栈（跳过空闲等待的线程），
+    输出折叠栈格式，可直接用flamegraph.pl或speedscope查看
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename.endswith(IDLE_MODULES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def write(self, path):
+        self.stop()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f'{stack} {samples}\n')
+
+
+class profiling(object):
+    """
+    在with块内对当前进程采样，结束时写出折叠栈；path为None时什么都不做
+    """
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.sampler = None if path is None else StackSampler(interval)
+
+    def __enter__(self):
+        if self.sampler is not None:
+            self.sampler.start()
+        return self.sampler
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.sampler is not None:
+            self.sampler.write(self.path)
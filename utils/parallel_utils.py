@@ -0,0 +1,104 @@
+import http.client
+import io
+import os
+from multiprocessing.util import Finalize
+
+from utils.analysis_utils import history_entry_fields, analyze_plan, summarize_view
+from utils.eventlog_utils import iter_log_entries
+from utils.metrics_utils import Metrics, StackSampler, collecting, timed, count, warn
+
+# 进程池中每个子进程各自持有的HistoryFetcher、PlanCache和SubtreeMemo，由_init_worker设置
+_worker_fetcher = None
+_worker_plan_cache = None
+_worker_memo = None
+
+
+def _init_worker(fetcher, plan_cache, memo, profile_path=None, profile_interval=0.005):
+    global _worker_fetcher, _worker_plan_cache, _worker_memo
+    _worker_fetcher = fetcher
+    _worker_plan_cache = plan_cache
+    _worker_memo = memo
+    if profile_path is not None:
+        # 每个子进程单独采样，退出时写到以进程号结尾的文件
+        sampler = StackSampler(profile_interval).start()
+        Finalize(None, sampler.write, args=(f'{profile_path}.{os.getpid()}',), exitpriority=10)
+
+
+def analyze_history(history_json_path, fetcher=None, plan_cache=None, memo=None):
+    """
+    流式读取单个history json或原始event log并处理其中的每一条sql，可在子进程中执行
+    :param history_json_path: 以.json结尾的按history json读取，否则按（可能压缩的）原始event log读取
+    :param fetcher: utils.fetch_utils中的HistoryFetcher，为None时使用子进程初始化时设置的fetcher
+    :param plan_cache: 节点图缓存，为None时使用子进程初始化时设置的缓存
+    :param memo: 跨日志的子树缓存，为None时使用子进程初始化时设置的缓存
+    :return: (sql序号, 候选视图摘要列表)列表，读取失败时返回None；每条sql的节点图处理完即释放
+    """
+    if fetcher is None:
+        fetcher = _worker_fetcher
+    with timed('fetch'):
+        stream = fetcher.open(history_json_path)
+    if stream is None:
+        return None
+    return analyze_stream(history_json_path, stream, plan_cache, memo)
+
+
+def analyze_content(history_json_path, content, plan_cache=None, memo=None):
+    """
+    处理已经读取到内存中的日志，可在子进程中执行
+    :param history_json_path:
+    :param content: 日志的原始字节
+    :param plan_cache: 节点图缓存，为None时使用子进程初始化时设置的缓存
+    :param memo: 跨日志的子树缓存，为None时使用子进程初始化时设置的缓存
+    :return: 同analyze_history
+    """
+    return analyze_stream(history_json_path, io.TextIOWrapper(io.BytesIO(content), encoding='utf-8'),
+                          plan_cache, memo)
+
+
+def analyze_stream(history_json_path, stream, plan_cache=None, memo=None):
+    """
+    逐条处理单个日志文本流中的sql
+    :param history_json_path:
+    :param stream: 日志的文本流，处理完后关闭
+    :param plan_cache:
+    :param memo:
+    :return: 同analyze_history
+    """
+    if plan_cache is None:
+        plan_cache = _worker_plan_cache
+    if memo is None:
+        memo = _worker_memo
+    results = []
+    try:
+        with stream:
+            for index, entry in enumerate(iter_log_entries(stream, history_json_path)):
+                _, metrics_text, physical_plan, _, _ = history_entry_fields(entry)
+                count('queries')
+                if metrics_text == '':
+                    warn('empty history', f'{history_json_path} query {index} is empty.')
+                    continue
+                try:
+                    _, candidate_views, _ = analyze_plan(physical_plan, metrics_text, plan_cache, memo)
+                except Exception as e:
+                    # 单条sql的计划无法还原时跳过这条sql，不影响同一日志中的其他sql
+                    count('failed_queries')
+                    warn('query error', f'{history_json_path} query {index}: {type(e).__name__}: {e}')
+                    continue
+                results.append((index, [summarize_view(view, history_json_path, index) for view in candidate_views]))
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        warn('read error', f'{history_json_path}: {e}')
+        return None
+    return results
+
+
+def analyze_measured(analyze, *args):
+    """
+    执行analyze并把期间的阶段计时和计数收集到一个新的Metrics中，可在子进程中执行
+    :param analyze: analyze_history、analyze_content或它们的partial
+    :param args: analyze的参数
+    :return: (analyze的结果, Metrics)
+    """
+    metrics = Metrics()
+    with collecting(metrics):
+        return analyze(*args), metrics
+
@@ -0,0 +1,211 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from utils.metrics_utils import Metrics, collecting, warn
+from utils.parallel_utils import analyze_content, analyze_history, analyze_measured, _init_worker
+
+# 队列结束标记
+_DONE = object()
+# 本地日志不在读取阶段读取，由解析阶段直接打开
+_IN_PLACE = object()
+# 解析子进程异常退出后进程池不可用，重建进程池后每个日志最多重试的次数
+BROKEN_POOL_RETRIES = 2
+
+
+class LogPipeline(object):
+    """
+    asyncio驱动的四段流水线：列出日志 -> 读取 -> 解析还原 -> 写出结果，段与段之间用有界队列连接，
+    下游处理不过来时上游在put处等待（背压）；列出和读取在线程池中执行，解析还原在进程池中执行，
+    写出在单独的一个线程中执行，读取、解析和写出互相重叠，事件循环只做调度；
+    子进程异常退出导致进程池损坏时重建进程池，受影响的日志重新解析；
+    同一时刻在途的日志不超过window个，写出按列出的顺序进行；
+    本地语料（fetcher.in_place）跳过读取阶段，由解析阶段直接打开；
+    每条日志的读取、解析各阶段计时和计数随结果传回，写出时汇总到metrics
+    """
+
+    def __init__(self, fetcher, fetch_concurrency=8, parse_workers=1, queue_size=16, window=None,
+                 plan_cache=None, memo=None, metrics=None, profile_path=None, profile_interval=0.005):
+        """
+        :param fetcher: utils.fetch_utils中的HistoryFetcher
+        :param fetch_concurrency: 同时读取的日志数
+        :param parse_workers: 解析进程数，为1时在当前进程的一个线程中解析
+        :param queue_size: 每个队列最多缓存的日志数，读取后待解析的日志内容都在内存中
+        :param window: 在途日志数上限，为None时为所有队列和并发数之和
+        :param plan_cache: utils.cache_utils中的PlanCache
+        :param memo: utils.memo_utils中的SubtreeMemo，多进程时每个子进程各自持有一份
+        :param metrics: utils.metrics_utils中的RunMetrics，为None时不汇总
+        :param profile_path: 多进程时每个解析子进程的采样结果写到profile_path.进程号，为None时不采样
+        :param profile_interval: 采样间隔（秒）
+        """
+        self.fetcher = fetcher
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        self.parse_workers = max(1, parse_workers)
+        self.queue_size = max(1, queue_size)
+        if window is None:
+            window = self.queue_size * 3 + self.fetch_concurrency + self.parse_workers
+        self.window = max(1, window)
+        self.plan_cache = plan_cache
+        self.memo = memo
+        self.metrics = metrics
+        self.profile_path = profile_path
+        self.profile_interval = profile_interval
+        # 当前的解析线程池或进程池，进程池损坏后替换为新的
+        self.parse_executor = None
+
+    def run(self, logs, sink):
+        """
+        :param logs: (日志路径, 附加信息)迭代器，在单独的线程中迭代，可以是边列出边返回的生成器
+        :param sink: sink(日志路径, 附加信息, analyze_history的结果)，在同一个写出线程中按logs的顺序依次调用，
+            期间的计时和计数计入这条日志
+        :return:
+        """
+        asyncio.run(self._run(logs, sink))
+
+    def _new_parse_executor(self):
+        if self.parse_workers <= 1:
+            return ThreadPoolExecutor(max_workers=1)
+        return ProcessPoolExecutor(max_workers=self.parse_workers, initializer=_init_worker,
+                                   initargs=(self.fetcher, self.plan_cache, self.memo, self.profile_path,
+                                             self.profile_interval))
+
+    def _rebuild_parse_executor(self, broken):
+        # 同一个损坏的进程池上的所有在途任务都会失败，只由第一个发现的解析任务重建
+        if self.parse_executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.parse_executor = self._new_parse_executor()
+
+    async def _run(self, logs, sink):
+        self.parse_executor = self._new_parse_executor()
+        if self.parse_workers <= 1:
+            parse = partial(analyze_content, plan_cache=self.plan_cache, memo=self.memo)
+            parse_in_place = partial(analyze_history, fetcher=self.fetcher, plan_cache=self.plan_cache,
+                                     memo=self.memo)
+        else:
+            parse = analyze_content
+            parse_in_place = analyze_history
+        list_executor = ThreadPoolExecutor(max_workers=1)
+        fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_concurrency)
+        sink_executor = ThreadPoolExecutor(max_workers=1)
+        window = asyncio.Semaphore(self.window)
+        fetch_queue = asyncio.Queue(self.queue_size)
+        parse_queue = asyncio.Queue(self.queue_size)
+        result_queue = asyncio.Queue(self.queue_size)
+        fetchers = [asyncio.ensure_future(self._fetch(fetch_executor, fetch_queue, parse_queue))
+                    for _ in range(self.fetch_concurrency)]
+        parsers = [asyncio.ensure_future(self._parse(parse, parse_in_place, parse_queue, result_queue))
+                   for _ in range(self.parse_workers)]
+        tasks = [asyncio.ensure_future(self._list(list_executor, iter(logs), window, fetch_queue)),
+                 asyncio.ensure_future(self._finish(fetchers, parse_queue, len(parsers))),
+                 asyncio.ensure_future(self._finish(parsers, result_queue, 1)),
+                 asyncio.ensure_future(self._sink(sink_executor, sink, window, result_queue, self.metrics))]
+        tasks += fetchers + parsers
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            for executor in (list_executor, fetch_executor, self.parse_executor, sink_executor):
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _list(self, executor, logs, window, fetch_queue):
+        loop = asyncio.get_running_loop()
+        seq = 0
+        while True:
+            item = await loop.run_in_executor(executor, next, logs, _DONE)
+            if item is _DONE:
+                break
+            # 在途日志达到上限时暂停列出，写出一个释放一个
+            await window.acquire()
+            await fetch_queue.put((seq, item))
+            seq += 1
+        for _ in range(self.fetch_concurrency):
+            await fetch_queue.put(_DONE)
+
+    async def _fetch(self, executor, fetch_queue, parse_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await fetch_queue.get()
+            if item is _DONE:
+                return
+            seq, (path, info) = item
+            if self.fetcher.in_place:
+                content, metrics = _IN_PLACE, Metrics()
+            else:
+                content, metrics = await loop.run_in_executor(executor, self._fetch_bytes, path)
+            await parse_queue.put((seq, path, info, content, metrics))
+
+    def _fetch_bytes(self, path):
+        metrics = Metrics()
+        with collecting(metrics), metrics.timed('fetch'):
+            return self.fetcher.fetch_bytes(path), metrics
+
+    async def _parse(self, parse, parse_in_place, parse_queue, result_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await parse_queue.get()
+            if item is _DONE:
+                return
+            seq, path, info, content, metrics = item
+            queries = None
+            retries = 0
+            while content is not None:
+                executor = self.parse_executor
+                try:
+                    if content is _IN_PLACE:
+                        queries, parse_metrics = await loop.run_in_executor(executor, analyze_measured,
+                                                                            parse_in_place, path)
+                    else:
+                        queries, parse_metrics = await loop.run_in_executor(executor, analyze_measured, parse,
+                                                                            path, content)
+                    metrics.merge(parse_metrics)
+                except BrokenProcessPool as e:
+                    # 任一子进程异常退出时进程池中所有在途的日志都会失败，重建进程池后重新解析
+                    self._rebuild_parse_executor(executor)
+                    with collecting(metrics):
+                        if retries < BROKEN_POOL_RETRIES:
+                            retries += 1
+                            warn('parse retry', f'{path}: {type(e).__name__}: {e}, retry {retries}')
+                            continue
+                        warn('parse error', f'{path}: {type(e).__name__}: {e}')
+                except Exception as e:
+                    # 单个日志解析失败时按读取失败处理，不中断流水线
+                    with collecting(metrics):
+                        warn('parse error', f'{path}: {type(e).__name__}: {e}')
+                break
+            await result_queue.put((seq, path, info, queries, metrics))
+
+    @staticmethod
+    async def _finish(workers, queue, consumers):
+        # 上一段的所有任务结束后通知下一段的每个消费者
+        await asyncio.gather(*workers)
+        for _ in range(consumers):
+            await queue.put(_DONE)
+
+    @staticmethod
+    async def _sink(executor, sink, window, result_queue, run_metrics):
+        # 先完成的日志在这里等待排在前面的日志，最多window个；写出在executor的单个线程中依次执行
+        loop = asyncio.get_running_loop()
+        finished = {}
+        next_seq = 0
+        while True:
+            item = await result_queue.get()
+            if item is _DONE:
+                return
+            finished[item[0]] = item[1:]
+            while next_seq in finished:
+                path, info, queries, metrics = finished.pop(next_seq)
+                await loop.run_in_executor(executor, LogPipeline._sink_log, sink, run_metrics, path, info, queries,
+                                           metrics)
+                window.release()
+                next_seq += 1
+
+    @staticmethod
+    def _sink_log(sink, run_metrics, path, info, queries, metrics):
+        with collecting(metrics):
+            sink(path, info, queries)
+        if run_metrics is not None:
+            run_metrics.add_log(path, metrics, queries is None)
@@ -1,17 +1,54 @@
+import sys
+from collections import namedtuple
 from enum import Enum
 
 
+def intern_value(value):
+    """
+    驻留表达式、表名、条件等字符串，同样的字符串在大量节点和日志中反复出现，驻留后只保留一份
+    :param value: 字符串或字符串列表，其余类型原样返回
+    :return:
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [sys.intern(item) if isinstance(item, str) else item for item in value]
+    return value
+
+
 class PhysicalPlanNode(object):
+    __slots__ = ('name', 'para', 'para_tag')
+
     def __init__(self, name, para, para_tag):
         self.name = name
         self.para = para
         self.para_tag = para_tag
 
 
+class PlanContext(object):
+    """
+    单个执行计划解析过程中的状态，每个日志各自一份，便于多进程并行
+    """
+
+    def __init__(self):
+        self.node_cache = {}
+        self.union_cache = {}
+        self.accumulator = 0
+        # 根节点nid到后序遍历结果的缓存
+        self.post_orders = {}
+        # 去掉编号前后的表达式映射，以及累计结果中相同集合的共享实例
+        self.stripped = {}
+        self.interned_sets = {}
+        # 跨日志的子树缓存（utils.memo_utils.SubtreeMemo）、nid到子树指纹（去掉/保留表达式编号）、计算了累计结果的nid
+        self.memo = None
+        self.fingerprints = {}
+        self.raw_fingerprints = {}
+        self.accumulated = set()
+
+
 class MetricNode(object):
-    union_cache = {}
-    node_cache = {}
-    accumulator = 0
+    __slots__ = ('nid', 'name', 'desc', 'desc_tag', 'time_info', 'children_node', 'parents_node',
+                 'contribute_sql', 'sql', 'sql_fragment', 'accumulate_contribute')
 
     def __init__(self, nid, name, desc, time_info, desc_tag):
         self.nid = nid
@@ -21,11 +58,17 @@ class MetricNode(object):
         self.time_info = time_info
         self.children_node = []
         self.parents_node = []
-        self.contribute_sql = {'select': [], 'from': [], 'where': [], 'group by': [], 'order by': [],
-                               'subquery': [], 'join_type': [], 'join_condition': [], 'union_query': []}
+        self.contribute_sql = ClauseArray(())
         self.sql = ''
-        self.accumulate_contribute = {'select': [], 'from': [], 'where': [], 'group by': [], 'order by': [],
-                                      'join_type': [], 'join_condition': []}
+        # generate_sql的渲染结果缓存
+        self.sql_fragment = None
+        self.accumulate_contribute = ClauseArray(EMPTY_CLAUSE_SET)
+
+
+# 候选视图的不可变摘要，只保留去重和导出需要的信息，不再引用节点图：
+# sql为去掉编号后的sql，contribute_sql用于合并后重新生成sql，source和index为来源日志及其中的sql序号
+ViewSummary = namedtuple('ViewSummary', ['nid', 'name', 'sql', 'contribute_sql', 'accumulate_contribute',
+                                         'source', 'index'])
 
 
 class Attribute(Enum):
@@ -60,3 +103,46 @@ class SQLContribute(Enum):
     SUBQUERY = 'subquery'
     JOIN_TYPE = 'join_type'
     UNION_QUERY = 'union_query'
+
+
+# SQLContribute及其value到ClauseArray下标的映射
+CLAUSE_INDEX = {}
+for _index, _clause in enumerate(SQLContribute):
+    CLAUSE_INDEX[_clause] = _index
+    CLAUSE_INDEX[_clause.value] = _index
+CLAUSE_KEYS = [clause.value for clause in SQLContribute]
+EMPTY_CLAUSE_SET = frozenset()
+
+
+class ClauseArray(list):
+    """
+    按SQLContribute顺序存放各子句的定长数组，替代以子句名为键的字典；
+    仍可以用SQLContribute或其value作下标，兼容原来的字典式访问
+    """
+    __slots__ = ()
+
+    def __init__(self, default=(), values=None):
+        """
+        :param default: 各子句的初始值，所有位置共享同一个不可变对象
+        :param values: 按SQLContribute顺序的初始值，给定时忽略default
+        """
+        super().__init__([default] * len(CLAUSE_KEYS) if values is None else values)
+
+    def __getitem__(self, key):
+        if key.__class__ is not int:
+            key = CLAUSE_INDEX[key]
+        return list.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if key.__class__ is not int:
+            key = CLAUSE_INDEX[key]
+        list.__setitem__(self, key, value)
+
+    def keys(self):
+        return list(CLAUSE_KEYS)
+
+    def items(self):
+        return list(zip(CLAUSE_KEYS, self))
+
+    def copy(self):
+        return ClauseArray(values=self)
@@ -0,0 +1,146 @@
+from utils.structure import SQLContribute
+
+# 这些子句完全相同的视图才可能互相包含，作为分桶的键
+STRUCTURE_CLAUSES = [SQLContribute.FROM, SQLContribute.JOIN_TYPE, SQLContribute.JOIN_CONDITION]
+SELECT = SQLContribute.SELECT.value
+WHERE = SQLContribute.WHERE.value
+GROUP_BY = SQLContribute.GROUP_BY.value
+
+
+def structure_key(view):
+    return tuple(view.accumulate_contribute[clause.value] for clause in STRUCTURE_CLAUSES)
+
+
+def iter_bits(bits):
+    """
+    :param bits: 位集合
+    :return: 从低到高的置位下标
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class SubsumptionBucket(object):
+    """
+    同一组表和join的视图：视图在桶内的序号对应位集合中的一位，
+    每个SELECT/GROUP BY元素记录包含它的视图位集合，每个视图记录自己WHERE元素的位集合
+    """
+
+    def __init__(self):
+        self.views = []
+        self.all = 0
+        self.no_group = 0
+        # (子句, 元素)到包含它的视图位集合
+        self.postings = {}
+        # WHERE元素到桶内编号
+        self.where_ids = {}
+        self.where_masks = []
+
+    def add(self, view, index):
+        bit = 1 << len(self.views)
+        self.views.append(index)
+        self.all |= bit
+        for clause in (SELECT, GROUP_BY):
+            for item in view.accumulate_contribute[clause]:
+                key = (clause, item)
+                self.postings[key] = self.postings.get(key, 0) | bit
+        if not view.accumulate_contribute[GROUP_BY]:
+            self.no_group |= bit
+        mask = 0
+        for item in view.accumulate_contribute[WHERE]:
+            element = self.where_ids.get(item)
+            if element is None:
+                element = self.where_ids[item] = len(self.where_ids)
+            mask |= 1 << element
+        self.where_masks.append(mask)
+
+    def _superset(self, clause, items, candidates):
+        for item in items:
+            candidates &= self.postings.get((clause, item), 0)
+            if not candidates:
+                break
+        return candidates
+
+    def subsumers(self, query):
+        contribute = query.accumulate_contribute
+        candidates = self._superset(SELECT, contribute[SELECT], self.all)
+        if not candidates:
+            return []
+        # 视图没有聚合时可以回答任意分组；否则视图的分组要比查询的更细（包含查询的分组列）
+        if contribute[GROUP_BY]:
+            candidates &= self._superset(GROUP_BY, contribute[GROUP_BY], candidates) | self.no_group
+        else:
+            candidates &= self.no_group
+        query_where = 0
+        for item in contribute[WHERE]:
+            element = self.where_ids.get(item)
+            if element is not None:
+                query_where |= 1 << element
+        # 视图的WHERE条件必须是查询WHERE条件的子集
+        return [self.views[i] for i in iter_bits(candidates) if self.where_masks[i] & ~query_where == 0]
+
+
+class SubsumptionIndex(object):
+    """
+    判断哪些候选视图可以回答一个查询：视图包含查询，当且仅当表和join相同、SELECT是查询的超集、
+    GROUP BY比查询更细或不聚合、WHERE是查询的子集（条件更弱）；
+    先按表和join分桶，桶内用位集合求交，不需要和每个视图两两比较
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.views = []
+
+    def add(self, view):
+        """
+        :param view: utils.structure.ViewSummary或MetricNode
+        :return: 视图序号
+        """
+        index = len(self.views)
+        self.views.append(view)
+        key = structure_key(view)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = SubsumptionBucket()
+        bucket.add(view, index)
+        return index
+
+    def add_all(self, views):
+        for view in views:
+            self.add(view)
+
+    def subsumers(self, query):
+        """
+        :param query: 查询或候选视图，需要有accumulate_contribute
+        :return: 包含该查询的视图序号列表，查询自身在索引中时也包含在内
+        """
+        bucket = self.buckets.get(structure_key(query))
+        if bucket is None:
+            return []
+        return bucket.subsumers(query)
+
+    def coverage(self, queries):
+        """
+        统计每个视图能回答的查询数
+        :param queries: (查询, 权重)迭代器，例如ViewCatalog.items()，权重为出现次数
+        :return: 与视图序号对应的覆盖数列表
+        """
+        counts = [0] * len(self.views)
+        for query, weight in queries:
+            for index in self.subsumers(query):
+                counts[index] += weight
+        return counts
+
+    def rank(self, queries):
+        """
+        :param queries: (查询, 权重)迭代器
+        :return: 按覆盖数从高到低排列的(视图, 覆盖数)列表
+        """
+        counts = self.coverage(queries)
+        order = sorted(range(len(self.views)), key=lambda index: -counts[index])
+        return [(self.views[index], counts[index]) for index in order]
+
+    def __len__(self):
+        return len(self.views)